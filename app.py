@@ -1,40 +1,180 @@
 import os
-from flask import Flask, render_template, request, redirect, jsonify
+import json
+from flask import Flask, Response, render_template, request, redirect, jsonify, stream_with_context
 from flask_cors import CORS
-from flask_limiter import Limiter
-from flask_limiter.util import get_remote_address
-from url_shortener import create_short_url, get_all_urls, get_original_url
 from constants import BASE_URL
-from qr_generator import generate_qr_matrix
-from db import init_db, increment_url_clicks, get_stats as db_get_stats
+from url_shortener import create_short_url, list_urls_page, search_urls_page, get_stats, get_original_url, get_cache_stats, get_code_filter_stats, get_snapshot_stats, get_link_analytics, shorten_batch, BatchStats, DEFAULT_PAGE_SIZE
+from url_utils import validate_export_filters, validate_link_limits, validate_url
+from url_export import export_urls, EXPORT_FORMATS
+from qr_generator import get_qr_render, get_qr_cache_stats, QR_FORMATS
+from storage import get_storage
+from code_generator import get_code_generator
+from click_buffer import click_buffer
+from click_events import click_events, country_from_headers
+from link_expiry import expiry_purger
+from page_cache import page_cache, static_assets, REVALIDATE
+from rate_limit import rate_limiter, RateLimitExceeded
+import metrics
 
 app = Flask(__name__)
 app.secret_ket = os.urandom(24)
 
 CORS(app)
 
-limiter = Limiter(
-    app=app,
-    key_func=get_remote_address,
-    default_limits=["200 per day", "50 per hour"],
-    storage_uri="memory://"
-)
+# Endpoints with their own limit group; redirects and probes are never limited.
+RATE_LIMIT_GROUPS = {'shorten': 'shorten', 'shorten_batch_api': 'batch'}
+RATE_LIMIT_EXEMPT = {'redirect_to_url', 'static', 'health', 'prometheus_metrics'}
 
-with app.app_context():
+
+@app.before_request
+def start_request_trace():
+    metrics.start_request()
+
+
+@app.before_request
+def apply_rate_limits():
+    if request.endpoint is None or request.endpoint in RATE_LIMIT_EXEMPT:
+        return None
+    group = RATE_LIMIT_GROUPS.get(request.endpoint, 'default')
     try:
-        init_db()
+        rate_limiter.check(group, request.remote_addr or 'unknown')
+    except RateLimitExceeded as e:
+        return rate_limited_response(e)
+    return None
+
+
+def rate_limited_response(e):
+    response = jsonify({
+        'error': 'Rate limit exceeded. Please try again later.',
+        'limit': str(e.limit)
+    })
+    response.status_code = 429
+    response.headers['Retry-After'] = str(max(1, int(e.retry_after + 0.999)))
+    return response
+
+
+@app.after_request
+def finish_request_trace(response):
+    route = request.url_rule.rule if request.url_rule else '<unmatched>'
+    metrics.finish_request(route, request.method, response.status_code)
+    return response
+
+
+def _runtime_gauges():
+    pool = get_storage().get_pool_stats()
+    cache = get_cache_stats()
+    clicks = click_buffer.stats()
+    events = click_events.stats()
+    qr = get_qr_cache_stats()
+    code_filter = get_code_filter_stats()
+    snapshot = get_snapshot_stats()
+    return [
+        ('db_pool_connections', 'Pooled database connections.',
+         {'idle': pool.get('idle', 0), 'in_use': pool.get('in_use', 0)}),
+        ('db_pool_checkouts', 'Pool checkouts by outcome.',
+         {'hit': pool.get('hits', 0), 'miss': pool.get('misses', 0),
+          'wait': pool.get('waits', 0), 'timeout': pool.get('timeouts', 0)}),
+        ('resolution_cache_entries', 'Entries in the short code resolution cache.', {'': cache['size']}),
+        ('resolution_cache_lookups', 'Resolution cache lookups by outcome.',
+         {'hit': cache['hits'], 'negative_hit': cache['negative_hits'], 'miss': cache['misses']}),
+        ('click_buffer_pending', 'Buffered clicks not yet written.', {'': clicks['pending_clicks']}),
+        ('click_events', 'Click analytics pipeline state.',
+         {'buffered': events['buffered'], 'dropped': events['dropped'], 'flushed': events['flushed']}),
+        ('qr_cache_entries', 'Cached QR renders.', {'': qr['size']}),
+        ('code_filter_codes', 'Short codes in the Bloom filter.', {'': code_filter.get('codes', 0)}),
+        ('code_filter_memory_bytes', 'Size of the short code Bloom filter.', {'': code_filter.get('memory_bytes', 0)}),
+        ('code_filter_lookups', 'Short code filter lookups by outcome.',
+         {'checked': code_filter['checks'], 'definite_miss': code_filter['definite_misses']}),
+        ('code_filter_false_positive_rate', 'Estimated Bloom filter false positive rate.',
+         {'': code_filter.get('estimated_fp_rate', 0)}),
+        ('redirect_snapshot_links', 'Links in the mapped redirect snapshot.', {'': snapshot.get('links', 0)}),
+        ('redirect_snapshot_lookups', 'Redirect snapshot lookups by outcome.',
+         {'hit': snapshot['hits'], 'miss': snapshot['misses']}),
+        ('redirect_snapshot_age_seconds', 'Seconds since the redirect snapshot was built.',
+         {'': snapshot.get('age_seconds', 0)}),
+        ('db_replicas_healthy', 'Read replicas currently in rotation.',
+         {'': sum(r['healthy'] for replicas in get_storage().get_replica_stats().values() for r in replicas)}),
+        ('rate_limit_store_operations', 'Round-trips to the rate limit store.',
+         {'': rate_limiter.stats()['store_operations']}),
+        ('expired_links_purged', 'Expired links deleted by this process.',
+         {'': expiry_purger.stats()['purged']}),
+    ]
+
+
+metrics.register_collector(_runtime_gauges)
+
+
+def _render_page(name, **context):
+    with app.test_request_context('/'):
+        return render_template(name, **context)
+
+
+def _cached_response(cached, cache_control=REVALIDATE, status=200):
+    status, headers, body = cached.respond(
+        request.headers.get('Accept-Encoding', ''),
+        request.headers.get('If-None-Match', ''),
+        cache_control,
+        status,
+    )
+    return Response(body, status=status, headers=headers)
+
+
+@app.url_defaults
+def fingerprint_static_urls(endpoint, values):
+    if endpoint == 'static' and 'v' not in values:
+        fingerprint = static_assets.fingerprint(values.get('filename', ''))
+        if fingerprint:
+            values['v'] = fingerprint
+
+
+def serve_static(filename):
+    """Static files from memory, precompressed; immutable when the URL is fingerprinted."""
+    response = static_assets.respond(
+        filename,
+        request.args.get('v'),
+        request.headers.get('Accept-Encoding', ''),
+        request.headers.get('If-None-Match', ''),
+    )
+    if response is None:
+        return _cached_response(page_cache.page('404.html'), status=404)
+    status, headers, body = response
+    return Response(body, status=status, headers=headers)
+
+
+app.view_functions['static'] = serve_static
+page_cache.configure(_render_page)
+page_cache.prerender()
+
+
+# Raises here, failing the worker's boot, if SHORT_CODE_STRATEGY=sequence
+# has no SHORT_CODE_SECRET.
+get_code_generator()
+
+# 'startup' creates the schema on import; 'migrate' leaves it to a one-time
+# `python migrate_data.py init` so workers start without touching DDL.
+SCHEMA_INIT = os.getenv('SCHEMA_INIT', 'startup')
+
+if SCHEMA_INIT == 'startup':
+    try:
+        get_storage().init()
         print("✓ Database initialized successfully")
     except Exception as e:
         print(f"✗ Failed to initialize database: {e}")
 
 
+@app.before_request
+def start_background_workers():
+    # Started in the serving process, never in a preloading master before fork.
+    expiry_purger.start()
+
+
 @app.route('/')
 def index():
-    return render_template('index.html')
+    return _cached_response(page_cache.page('index.html'))
 
 @app.route('/login')
 def login_page():
-    return render_template('login.html')
+    return _cached_response(page_cache.page('login.html'))
 
 @app.route('/login', methods=['POST'])
 def login():
@@ -56,7 +196,7 @@ def logout():
 @app.route('/signup')
 def signup_page():
     """Render the signup page."""
-    return render_template('signup.html')
+    return _cached_response(page_cache.page('signup.html'))
 
 
 @app.route('/signup', methods=['POST'])
@@ -74,8 +214,20 @@ def signup():
 
 
 
+def _link_limits(params):
+    """(expires_at, max_clicks) from a request's JSON body or query string."""
+    return validate_link_limits(params.get('expires_at'), params.get('expires_in'), params.get('max_clicks'))
+
+
+def _with_limits(body, expires_at, max_clicks):
+    if expires_at is not None:
+        body['expires_at'] = expires_at.isoformat()
+    if max_clicks is not None:
+        body['max_clicks'] = max_clicks
+    return body
+
+
 @app.route('/shorten', methods=['POST'])
-@limiter.limit("10 per minute")  
 def shorten():
     try:
         data = request.get_json()
@@ -83,27 +235,16 @@ def shorten():
         if not data:
             return jsonify({'error': 'Invalid JSON data'}), 400
         
-        original_url = data.get('url', '').strip()
-        
-        if not original_url:
-            return jsonify({'error': 'URL is required'}), 400
-        
-        if len(original_url) > 2048:
-            return jsonify({'error': 'URL is too long (max 2048 characters)'}), 400
-        
-        if not original_url.startswith(('http://', 'https://')):
-            original_url = 'https://' + original_url
-        
-        if not ('.' in original_url and len(original_url) > 10):
-            return jsonify({'error': 'Invalid URL format'}), 400
+        original_url = validate_url(data.get('url', ''))
+        expires_at, max_clicks = _link_limits(data)
         
-        result = create_short_url(original_url)
+        result = create_short_url(original_url, expires_at, max_clicks)
         short_url = f"{BASE_URL}/{result['short_code']}"
         
-        return jsonify({
+        return jsonify(_with_limits({
             'short_url': short_url,
             'short_code': result['short_code']
-        }), 200
+        }, expires_at, max_clicks)), 200
         
     except ValueError as e:
         return jsonify({'error': str(e)}), 400
@@ -112,20 +253,176 @@ def shorten():
         return jsonify({'error': 'Failed to shorten URL. Please try again.'}), 500
 
 
+BATCH_MAX_JSON_URLS = 10000
+
+
+def _batch_item(result):
+    item = {'index': result['index'], 'url': result['url']}
+    if 'error' in result:
+        item['error'] = result['error']
+    else:
+        item['short_code'] = result['short_code']
+        item['short_url'] = f"{BASE_URL}/{result['short_code']}"
+        item['created'] = result['created']
+    return item
+
+
+def _stream_lines(stream):
+    for line in stream:
+        line = line.decode('utf-8', errors='replace').strip()
+        if line:
+            yield line
+
+
+@app.route('/api/shorten/batch', methods=['POST'])
+def shorten_batch_api():
+    """Shorten many URLs at once.
+
+    A JSON body ({"urls": [...]}) gets a JSON response. A text/plain or NDJSON
+    body with one URL per line is read as a stream and answered with NDJSON,
+    one result per line followed by a summary line, so very large imports
+    never sit in memory on either side. expires_at / expires_in / max_clicks
+    (in the JSON body, or the query string for line input) apply to every
+    link in the batch.
+    """
+    if request.is_json:
+        data = request.get_json(silent=True)
+        urls = data.get('urls') if isinstance(data, dict) else None
+        if not isinstance(urls, list):
+            return jsonify({'error': 'Expected a JSON body with a "urls" list'}), 400
+        try:
+            expires_at, max_clicks = _link_limits(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if len(urls) > BATCH_MAX_JSON_URLS:
+            return jsonify({
+                'error': f'Too many URLs for a JSON batch (max {BATCH_MAX_JSON_URLS}); '
+                         'send them as text/plain, one per line'
+            }), 400
+
+        stats = BatchStats()
+        results = []
+        for result in shorten_batch(urls, expires_at=expires_at, max_clicks=max_clicks):
+            stats.add(result)
+            results.append(_batch_item(result))
+        return jsonify(_with_limits({'results': results, 'stats': stats.to_dict()},
+                                    expires_at, max_clicks)), 200
+
+    try:
+        expires_at, max_clicks = _link_limits(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    def generate():
+        stats = BatchStats()
+        for result in shorten_batch(_stream_lines(request.stream), expires_at=expires_at, max_clicks=max_clicks):
+            stats.add(result)
+            yield json.dumps(_batch_item(result)) + '\n'
+        yield json.dumps({'stats': stats.to_dict()}) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+def _page_args():
+    cursor = request.args.get('cursor') or None
+    limit = request.args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+    return cursor, limit
+
+
 @app.route('/list')
 def list_urls():
+    cursor, limit = _page_args()
+    query = request.args.get('q', '').strip()
+    by = request.args.get('by', 'url')
+    search = {'query': query, 'by': by}
     try:
-        urls = get_all_urls()
-        return render_template('list.html', urls=urls, base_url=BASE_URL)
+        if query:
+            urls, next_cursor = search_urls_page(query, by, cursor, limit)
+        else:
+            urls, next_cursor = list_urls_page(cursor, limit)
+        stats_data = get_stats()
+        return render_template(
+            'list.html',
+            urls=urls,
+            base_url=BASE_URL,
+            next_cursor=next_cursor,
+            is_first_page=cursor is None,
+            limit=limit,
+            search=search,
+            total_urls=stats_data['total_urls'],
+            total_clicks=stats_data['total_clicks']
+        )
+    except ValueError as e:
+        return render_template('list.html', urls=[], base_url=BASE_URL, error=str(e), search=search,
+                               total_urls=0, total_clicks=0), 400
     except Exception as e:
         print(f"Error in /list: {e}")
-        return render_template('list.html', urls=[], base_url=BASE_URL, error="Failed to load URLs")
+        return render_template('list.html', urls=[], base_url=BASE_URL, error="Failed to load URLs",
+                               search=search, total_urls=0, total_clicks=0)
+
+
+@app.route('/api/urls')
+def list_urls_api():
+    cursor, limit = _page_args()
+    try:
+        urls, next_cursor = list_urls_page(cursor, limit)
+        for url in urls:
+            url['short_url'] = f"{BASE_URL}/{url['short_code']}"
+        return jsonify({'urls': urls, 'next_cursor': next_cursor}), 200
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f"Error in /api/urls: {e}")
+        return jsonify({'error': 'Failed to load URLs'}), 500
+
+
+@app.route('/api/search')
+def search_urls_api():
+    """Links whose URL contains q (by=url), that point at domain q or its
+    subdomains (by=domain) or whose short code starts with q (by=code)."""
+    cursor, limit = _page_args()
+    try:
+        urls, next_cursor = search_urls_page(request.args.get('q', ''), request.args.get('by', 'url'),
+                                             cursor, limit)
+        for url in urls:
+            url['short_url'] = f"{BASE_URL}/{url['short_code']}"
+        return jsonify({'urls': urls, 'next_cursor': next_cursor}), 200
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f"Error in /api/search: {e}")
+        return jsonify({'error': 'Search failed'}), 500
+
+
+@app.route('/api/export')
+def export_urls_api():
+    """Download every link as CSV or NDJSON, streamed straight from the database.
+
+    Optional filters: created_from / created_to (ISO-8601, from inclusive,
+    to exclusive) and min_clicks; gzip=1 sends a .gz file.
+    """
+    fmt = request.args.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'error': f"format must be one of: {', '.join(EXPORT_FORMATS)}"}), 400
+    try:
+        created_from, created_to, min_clicks = validate_export_filters(
+            request.args.get('created_from'), request.args.get('created_to'), request.args.get('min_clicks'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    compress = request.args.get('gzip') in ('1', 'true')
+    filename = f'links.{fmt}' + ('.gz' if compress else '')
+    return Response(
+        stream_with_context(export_urls(fmt, created_from, created_to, min_clicks, compress)),
+        mimetype='application/gzip' if compress else EXPORT_FORMATS[fmt],
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'},
+    )
 
 
 @app.route('/api/stats')
 def stats():
     try:
-        stats_data = db_get_stats()
+        stats_data = get_stats()
         return jsonify(stats_data), 200
     except Exception as e:
         print(f"Error in /api/stats: {e}")
@@ -136,29 +433,109 @@ def stats():
         }), 500
 
 
+@app.route('/api/db/pool')
+def pool_stats():
+    return jsonify(get_storage().get_pool_stats()), 200
+
+
+@app.route('/api/storage')
+def storage_stats():
+    return jsonify(get_storage().stats()), 200
+
+
+@app.route('/api/db/replicas')
+def replica_stats():
+    return jsonify(get_storage().get_replica_stats()), 200
+
+
+@app.route('/api/cache')
+def cache_stats():
+    return jsonify(get_cache_stats()), 200
+
+
+@app.route('/api/code-filter')
+def code_filter_stats():
+    return jsonify(get_code_filter_stats()), 200
+
+
+@app.route('/api/snapshot')
+def snapshot_stats():
+    return jsonify(get_snapshot_stats()), 200
+
+
+@app.route('/api/expiry')
+def expiry_stats():
+    return jsonify(expiry_purger.stats()), 200
+
+
+@app.route('/api/ratelimit')
+def rate_limit_stats():
+    return jsonify(rate_limiter.stats()), 200
+
+
+@app.route('/api/analytics/<short_code>')
+def link_analytics(short_code):
+    try:
+        if not short_code or len(short_code) > 20:
+            return jsonify({'error': 'Invalid short code'}), 400
+
+        analytics = get_link_analytics(
+            short_code,
+            request.args.get('granularity', 'day'),
+            request.args.get('since'),
+            request.args.get('until')
+        )
+        return jsonify(analytics), 200
+
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f"Error in /api/analytics/{short_code}: {e}")
+        return jsonify({'error': 'Failed to load analytics'}), 500
+
+
 @app.route('/api/qr/<short_code>')
 def get_qr_matrix(short_code):
+    """QR code for a short link.
+
+    ?format=matrix (default) returns the JSON module matrix, packed returns
+    base64 bit-packed rows, png and svg return images. Renders are cached per
+    URL and revalidated through ETag / If-None-Match.
+    """
     try:
         if not short_code or len(short_code) > 20:
             return jsonify({'error': 'Invalid short code'}), 400
+
+        fmt = request.args.get('format', 'matrix')
+        if fmt not in QR_FORMATS:
+            return jsonify({'error': f"Unknown format '{fmt}'"}), 400
         
         url = f"{BASE_URL}/{short_code}"
-        matrix = generate_qr_matrix(url)
+        render = get_qr_render(url)
         
-        if not matrix:
+        if not render.matrix:
             return jsonify({'error': 'Failed to generate QR code'}), 500
-        
-        return jsonify({
-            'matrix': matrix,
-            'width': len(matrix[0]) if matrix else 0,
-            'height': len(matrix) if matrix else 0
-        }), 200
+
+        etag = render.etag(fmt)
+        headers = {
+            'ETag': etag,
+            'Cache-Control': 'public, max-age=86400',
+        }
+        if etag in request.headers.get('If-None-Match', ''):
+            return Response(status=304, headers=headers)
+
+        return Response(render.render(fmt), mimetype=QR_FORMATS[fmt], headers=headers)
         
     except Exception as e:
         print(f"Error in /api/qr/{short_code}: {e}")
         return jsonify({'error': 'Failed to generate QR code'}), 500
 
 
+@app.route('/api/qr-cache/stats')
+def qr_cache_stats():
+    return jsonify(get_qr_cache_stats()), 200
+
+
 @app.route('/<short_code>')
 def redirect_to_url(short_code):
     try:
@@ -168,14 +545,11 @@ def redirect_to_url(short_code):
         original_url = get_original_url(short_code)
         
         if original_url:
-            try:
-                increment_url_clicks(short_code)
-            except Exception as e:
-                print(f"Failed to increment clicks for {short_code}: {e}")
-            
+            click_buffer.record(short_code)
+            click_events.record(short_code, request.referrer, country_from_headers(request.headers))
             return redirect(original_url, code=302)
         
-        return render_template('404.html', short_code=short_code), 404
+        return Response(page_cache.not_found(short_code), status=404, mimetype='text/html')
         
     except Exception as e:
         print(f"Error in /{short_code}: {e}")
@@ -184,7 +558,7 @@ def redirect_to_url(short_code):
 
 @app.errorhandler(404)
 def not_found(e):
-    return render_template('404.html'), 404
+    return _cached_response(page_cache.page('404.html'), status=404)
 
 
 @app.errorhandler(500)
@@ -192,18 +566,15 @@ def internal_error(e):
     return jsonify({'error': 'Internal server error'}), 500
 
 
-@app.errorhandler(429)
-def ratelimit_handler(e):
-    return jsonify({
-        'error': 'Rate limit exceeded. Please try again later.',
-        'limit': str(e.description)
-    }), 429
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
 
 
 @app.route('/health')
 def health():
     try:
-        db_get_stats()
+        get_storage().ping()
         return jsonify({
             'status': 'healthy',
             'database': 'connected'
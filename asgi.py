@@ -0,0 +1,206 @@
+"""ASGI entry point: async redirects, shorten and stats in front of the Flask app.
+
+Run with e.g. ``uvicorn asgi:app --workers 4``. The redirect path resolves
+through the shared resolution cache and the storage backend's async lookups
+(asyncpg pools for PostgreSQL), so one process can hold thousands of
+concurrent redirects. /shorten and /api/stats reuse the
+synchronous logic in url_shortener.py on a worker thread, and every other
+route is passed through to the Flask app unchanged.
+"""
+import asyncio
+import json
+from typing import Dict, List, Tuple
+
+from asgiref.wsgi import WsgiToAsgi
+from werkzeug.datastructures import Headers
+from werkzeug.exceptions import HTTPException
+
+import metrics
+from app import app as flask_app, RATE_LIMIT_GROUPS
+from click_buffer import click_buffer
+from click_events import click_events, country_from_headers
+from constants import BASE_URL
+from link_expiry import expiry_purger
+from page_cache import page_cache
+from rate_limit import rate_limiter, RateLimitExceeded
+from storage import get_storage
+from url_shortener import create_short_url, get_original_url_async, get_stats
+from url_utils import validate_link_limits, validate_url
+
+MAX_BODY_SIZE = 64 * 1024
+
+_wsgi = WsgiToAsgi(flask_app)
+_routes = flask_app.url_map.bind('')
+
+
+async def _respond(send, status: int, body: bytes = b'', headers: List[Tuple[bytes, bytes]] = ()):
+    headers = list(headers) + [(b'content-length', str(len(body)).encode())]
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def _respond_json(send, status: int, data: Dict):
+    await _respond(send, status, json.dumps(data).encode(), [(b'content-type', b'application/json')])
+
+
+async def _read_body(receive) -> bytes:
+    body = bytearray()
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if len(body) > MAX_BODY_SIZE:
+            raise ValueError('Request body too large')
+        if not message.get('more_body'):
+            return bytes(body)
+
+
+async def redirect_to_url(scope, send, short_code: str):
+    try:
+        if not short_code or len(short_code) > 20:
+            await _respond(send, 400, b'Invalid short code')
+            return
+
+        original_url = await get_original_url_async(short_code)
+
+        if original_url:
+            click_buffer.record(short_code)
+            headers = Headers([
+                (name.decode('latin-1'), value.decode('latin-1'))
+                for name, value in scope.get('headers', [])
+            ])
+            click_events.record(short_code, headers.get('Referer'), country_from_headers(headers))
+            await _respond(send, 302, b'', [(b'location', original_url.encode())])
+            return
+
+        await _respond(send, 404, page_cache.not_found(short_code), [(b'content-type', b'text/html; charset=utf-8')])
+
+    except Exception as e:
+        print(f"Error in /{short_code}: {e}")
+        await _respond(send, 500, b'An error occurred')
+
+
+async def _rate_limited(scope, send, endpoint: str) -> bool:
+    """Apply the Flask app's limit group for endpoint; answers 429 and returns True when over it."""
+    client = scope.get('client') or ('unknown', 0)
+    try:
+        await asyncio.to_thread(rate_limiter.check, RATE_LIMIT_GROUPS.get(endpoint, 'default'), client[0])
+    except RateLimitExceeded as e:
+        body = json.dumps({'error': 'Rate limit exceeded. Please try again later.', 'limit': str(e.limit)})
+        await _respond(send, 429, body.encode(), [
+            (b'content-type', b'application/json'),
+            (b'retry-after', str(max(1, int(e.retry_after + 0.999))).encode()),
+        ])
+        return True
+    return False
+
+
+async def shorten(scope, receive, send):
+    if await _rate_limited(scope, send, 'shorten'):
+        return
+
+    try:
+        try:
+            data = json.loads(await _read_body(receive) or b'null')
+        except json.JSONDecodeError:
+            data = None
+
+        if not data or not isinstance(data, dict):
+            await _respond_json(send, 400, {'error': 'Invalid JSON data'})
+            return
+
+        original_url = validate_url(data.get('url', ''))
+        expires_at, max_clicks = validate_link_limits(
+            data.get('expires_at'), data.get('expires_in'), data.get('max_clicks'))
+
+        result = await asyncio.to_thread(create_short_url, original_url, expires_at, max_clicks)
+
+        body = {
+            'short_url': f"{BASE_URL}/{result['short_code']}",
+            'short_code': result['short_code']
+        }
+        if expires_at is not None:
+            body['expires_at'] = expires_at.isoformat()
+        if max_clicks is not None:
+            body['max_clicks'] = max_clicks
+        await _respond_json(send, 200, body)
+
+    except ValueError as e:
+        await _respond_json(send, 400, {'error': str(e)})
+    except Exception as e:
+        print(f"Error in /shorten: {e}")
+        await _respond_json(send, 500, {'error': 'Failed to shorten URL. Please try again.'})
+
+
+async def stats(scope, send):
+    if await _rate_limited(scope, send, 'stats'):
+        return
+
+    try:
+        await _respond_json(send, 200, await asyncio.to_thread(get_stats))
+    except Exception as e:
+        print(f"Error in /api/stats: {e}")
+        await _respond_json(send, 500, {
+            'total_urls': 0,
+            'total_clicks': 0,
+            'error': 'Failed to load statistics'
+        })
+
+
+async def _traced(endpoint: str, scope, receive, send, args: Dict):
+    status = [500]
+
+    async def send_with_status(message):
+        if message['type'] == 'http.response.start':
+            status[0] = message['status']
+        await send(message)
+
+    metrics.start_request()
+    try:
+        if endpoint == 'redirect_to_url':
+            await redirect_to_url(scope, send_with_status, args['short_code'])
+        elif endpoint == 'shorten':
+            await shorten(scope, receive, send_with_status)
+        else:
+            await stats(scope, send_with_status)
+    finally:
+        rule = '/<short_code>' if endpoint == 'redirect_to_url' else scope['path']
+        metrics.finish_request(rule, scope['method'], status[0])
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            try:
+                await get_storage().open_async()
+            except Exception as e:
+                await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                return
+            # Redirects served here never reach Flask's before_request.
+            expiry_purger.start()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            expiry_purger.stop()
+            await get_storage().close_async()
+            await asyncio.to_thread(click_buffer.stop)
+            await asyncio.to_thread(click_events.stop)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await _lifespan(receive, send)
+        return
+
+    if scope['type'] == 'http':
+        try:
+            endpoint, args = _routes.match(scope['path'], method=scope['method'])
+        except HTTPException:
+            endpoint, args = None, {}
+
+        if endpoint in ('redirect_to_url', 'shorten', 'stats'):
+            await _traced(endpoint, scope, receive, send, args)
+            return
+
+    await _wsgi(scope, receive, send)
@@ -0,0 +1,388 @@
+"""Benchmark the redirect, shorten and stats paths.
+
+Seeds a disposable local Postgres database and drives the app either
+in-process through Flask's test client or over HTTP against a running
+server, then reports latency percentiles, throughput and database queries
+per request as JSON that later runs can be compared against. Cold start
+(importing app in a fresh interpreter, then serving its first redirect) is
+measured too, so startup regressions show up in the same diff.
+
+    python benchmark.py --database-url postgresql://localhost/url_shortener_bench \\
+        --table-size 100000 --requests 20000 --zipf 1.1 --miss-ratio 0.05 \\
+        --output bench.json --compare previous.json
+
+Never point --database-url at a database you care about: it is seeded with
+synthetic links and --reset truncates it (then rebuilds url_stats, the
+short code filter and the redirect snapshot to match).
+"""
+import argparse
+import bisect
+import itertools
+import json
+import os
+import platform
+import random
+import sys
+import threading
+import time
+from http.client import HTTPConnection, HTTPSConnection
+from typing import Callable, Dict, List, Optional
+from urllib.parse import urlsplit
+
+WORKLOADS = ('redirect', 'shorten', 'stats')
+SEED_CHUNK_SIZE = 10000
+# Modules that should only load when a request needs them.
+LAZY_MODULES = ('qrcode', 'PIL', 'dotenv')
+
+COLD_START_SCRIPT = '''
+import json, sys, time
+started = time.perf_counter()
+from app import app
+imported = time.perf_counter()
+status = app.test_client().get(sys.argv[1]).status_code
+served = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'first_redirect_ms': (served - imported) * 1000,
+    'status': status,
+    'loaded': [name for name in sys.argv[2:] if name in sys.modules],
+}))
+'''
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(int(round(pct / 100 * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+class ZipfSampler:
+    """Samples ranks 0..n-1 with P(k) proportional to 1 / (k + 1) ** s."""
+
+    def __init__(self, n: int, s: float, rng: random.Random):
+        self.rng = rng
+        total = 0.0
+        self.cumulative = []
+        for k in range(1, n + 1):
+            total += 1.0 / (k ** s) if s > 0 else 1.0
+            self.cumulative.append(total)
+        self.total = total
+
+    def sample(self) -> int:
+        return bisect.bisect_left(self.cumulative, self.rng.random() * self.total)
+
+
+def seed_database(table_size: int, reset: bool) -> List[str]:
+    """Make sure the benchmark table holds table_size synthetic links; returns their codes."""
+    from code_generator import encode_base62, KEYSPACE
+    from db import copy_url_entries, count_urls, get_cursor, init_db, rebuild_stats, shard_map
+
+    init_db()
+    if reset:
+        for database in range(shard_map.databases):
+            with get_cursor(database=database) as cur:
+                cur.execute('TRUNCATE urls')
+        # TRUNCATE skips the row triggers that keep url_stats.
+        rebuild_stats()
+
+    codes = [encode_base62((i * 7919 + 104729) % KEYSPACE) for i in range(table_size)]
+    existing = count_urls()
+    if existing < table_size:
+        print(f"Seeding {table_size - existing} links...", file=sys.stderr)
+        for start in range(0, table_size, SEED_CHUNK_SIZE):
+            rows = [
+                (codes[i], f"https://bench.example.com/page/{i}", 0, None)
+                for i in range(start, min(start + SEED_CHUNK_SIZE, table_size))
+            ]
+            copy_url_entries(rows)
+    if reset:
+        rebuild_host_caches()
+    return codes
+
+
+def rebuild_host_caches() -> None:
+    """Rebuild the short code filter and redirect snapshot after a reset.
+
+    Both still describe the truncated table; workers pick up the new files
+    when they next check the inode.
+    """
+    from code_filter import code_filter
+    from redirect_snapshot import redirect_snapshot
+
+    if code_filter.enabled and not code_filter.rebuild():
+        print("Warning: short code filter is being rebuilt elsewhere; it may list truncated codes",
+              file=sys.stderr)
+    if redirect_snapshot.enabled and redirect_snapshot.rebuild() is None:
+        print("Warning: redirect snapshot is being rebuilt elsewhere; it may serve truncated links",
+              file=sys.stderr)
+
+
+class Workload:
+    def __init__(self, codes: List[str], zipf: float, miss_ratio: float, seed: int):
+        self.codes = codes
+        self.miss_ratio = miss_ratio
+        self.rng = random.Random(seed)
+        self.sampler = ZipfSampler(len(codes), zipf, self.rng) if codes else None
+        self.counter = itertools.count()
+        self.run_id = f"{int(time.time())}-{os.getpid()}"
+        self.lock = threading.Lock()
+
+    def redirect_path(self) -> str:
+        with self.lock:
+            if not self.codes or self.rng.random() < self.miss_ratio:
+                return '/zz' + ''.join(self.rng.choices('abcdefghijklmnopqrstuvwxyz', k=4))
+            return '/' + self.codes[self.sampler.sample()]
+
+    def shorten_body(self) -> bytes:
+        n = next(self.counter)
+        return json.dumps({'url': f"https://bench.example.com/new/{self.run_id}/{n}"}).encode()
+
+
+def _summarize(latencies: List[float], errors: int, elapsed: float, queries: Optional[int]) -> Dict:
+    latencies.sort()
+    count = len(latencies)
+    result = {
+        'requests': count,
+        'errors': errors,
+        'elapsed_seconds': round(elapsed, 3),
+        'requests_per_second': round(count / elapsed, 1) if elapsed > 0 else 0.0,
+        'latency_ms': {
+            'mean': round(sum(latencies) / count * 1000, 3) if count else 0.0,
+            'p50': round(percentile(latencies, 50) * 1000, 3),
+            'p95': round(percentile(latencies, 95) * 1000, 3),
+            'p99': round(percentile(latencies, 99) * 1000, 3),
+            'max': round(latencies[-1] * 1000, 3) if count else 0.0,
+        },
+        'db_queries_per_request': round(queries / count, 3) if count and queries is not None else None,
+    }
+    return result
+
+
+def _run_threads(total: int, concurrency: int, make_request: Callable[[int], Callable[[], bool]]) -> Dict:
+    """Issue total requests from concurrency threads; make_request(worker) returns a per-thread caller."""
+    latencies: List[float] = []
+    errors = [0]
+    remaining = itertools.count()
+    lock = threading.Lock()
+
+    def worker(worker_id: int):
+        call = make_request(worker_id)
+        local_latencies = []
+        local_errors = 0
+        while next(remaining) < total:
+            started = time.perf_counter()
+            try:
+                ok = call()
+            except Exception:
+                ok = False
+            local_latencies.append(time.perf_counter() - started)
+            if not ok:
+                local_errors += 1
+        with lock:
+            latencies.extend(local_latencies)
+            errors[0] += local_errors
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return {'latencies': latencies, 'errors': errors[0], 'elapsed': time.perf_counter() - started}
+
+
+def run_client(name: str, workload: Workload, total: int, concurrency: int) -> Dict:
+    """Drive the Flask app in-process through its test client."""
+    from app import app
+    from db import get_pool_stats
+    from rate_limit import rate_limiter
+
+    rate_limiter.enabled = False
+
+    def make_request(worker_id: int):
+        client = app.test_client()
+        if name == 'redirect':
+            return lambda: client.get(workload.redirect_path()).status_code in (302, 404)
+        if name == 'shorten':
+            return lambda: client.post(
+                '/shorten', data=workload.shorten_body(), content_type='application/json'
+            ).status_code == 200
+        return lambda: client.get('/api/stats').status_code == 200
+
+    queries_before = get_pool_stats().get('queries', 0)
+    run = _run_threads(total, concurrency, make_request)
+    queries = get_pool_stats().get('queries', 0) - queries_before
+    return _summarize(run['latencies'], run['errors'], run['elapsed'], queries)
+
+
+def run_http(name: str, workload: Workload, total: int, concurrency: int, base_url: str) -> Dict:
+    """Drive a running server over keep-alive HTTP connections."""
+    parts = urlsplit(base_url)
+    connection_class = HTTPSConnection if parts.scheme == 'https' else HTTPConnection
+
+    def server_queries() -> Optional[int]:
+        conn = connection_class(parts.netloc, timeout=10)
+        try:
+            conn.request('GET', '/api/db/pool')
+            response = conn.getresponse()
+            data = json.loads(response.read() or b'{}')
+            return data.get('queries')
+        except Exception:
+            return None
+        finally:
+            conn.close()
+
+    def make_request(worker_id: int):
+        conn = connection_class(parts.netloc, timeout=30)
+
+        def call() -> bool:
+            if name == 'redirect':
+                conn.request('GET', workload.redirect_path())
+            elif name == 'shorten':
+                conn.request('POST', '/shorten', body=workload.shorten_body(),
+                             headers={'Content-Type': 'application/json'})
+            else:
+                conn.request('GET', '/api/stats')
+            response = conn.getresponse()
+            response.read()
+            if name == 'redirect':
+                return response.status in (302, 404)
+            return response.status == 200
+
+        return call
+
+    # Per-process counters: only meaningful against a single-worker server.
+    queries_before = server_queries()
+    run = _run_threads(total, concurrency, make_request)
+    queries_after = server_queries()
+    queries = None
+    if queries_before is not None and queries_after is not None:
+        queries = queries_after - queries_before - 1
+    return _summarize(run['latencies'], run['errors'], run['elapsed'], queries)
+
+
+def run_cold_start(workload: Workload, runs: int) -> Dict:
+    """Time importing app and serving one redirect, each run in a fresh interpreter."""
+    import subprocess
+
+    # The schema was created by seeding; workers in production skip it too.
+    env = dict(os.environ, SCHEMA_INIT='migrate')
+    samples = {'process_ms': [], 'import_ms': [], 'first_redirect_ms': []}
+    loaded = set()
+    for _ in range(runs):
+        started = time.perf_counter()
+        output = subprocess.run(
+            [sys.executable, '-c', COLD_START_SCRIPT, workload.redirect_path(), *LAZY_MODULES],
+            env=env, cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, check=True,
+        ).stdout
+        samples['process_ms'].append((time.perf_counter() - started) * 1000)
+        result = json.loads(output.strip().splitlines()[-1])
+        samples['import_ms'].append(result['import_ms'])
+        samples['first_redirect_ms'].append(result['first_redirect_ms'])
+        loaded.update(result['loaded'])
+
+    summary = {name: round(percentile(sorted(values), 50), 1) for name, values in samples.items()}
+    summary['runs'] = runs
+    summary['eager_modules'] = sorted(loaded)
+    return summary
+
+
+def compare(current: Dict, previous: Dict) -> None:
+    print(f"\n{'workload':<10} {'metric':<22} {'previous':>12} {'current':>12} {'change':>9}")
+    for name, result in current['results'].items():
+        old = previous.get('results', {}).get(name)
+        if not old:
+            continue
+        metrics = [
+            ('requests_per_second', result['requests_per_second'], old['requests_per_second']),
+            ('p50_ms', result['latency_ms']['p50'], old['latency_ms']['p50']),
+            ('p95_ms', result['latency_ms']['p95'], old['latency_ms']['p95']),
+            ('p99_ms', result['latency_ms']['p99'], old['latency_ms']['p99']),
+            ('db_queries_per_request', result['db_queries_per_request'], old['db_queries_per_request']),
+        ]
+        for metric, new_value, old_value in metrics:
+            if new_value is None or old_value is None:
+                continue
+            change = f"{(new_value - old_value) / old_value * 100:+.1f}%" if old_value else 'n/a'
+            print(f"{name:<10} {metric:<22} {old_value:>12} {new_value:>12} {change:>9}")
+
+    cold, old_cold = current.get('cold_start'), previous.get('cold_start')
+    if cold and old_cold:
+        for metric in ('process_ms', 'import_ms', 'first_redirect_ms'):
+            new_value, old_value = cold[metric], old_cold[metric]
+            change = f"{(new_value - old_value) / old_value * 100:+.1f}%" if old_value else 'n/a'
+            print(f"{'cold':<10} {metric:<22} {old_value:>12} {new_value:>12} {change:>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', default=os.getenv('BENCH_DATABASE_URL'),
+                        help='disposable database to seed (default: $BENCH_DATABASE_URL)')
+    parser.add_argument('--mode', choices=('client', 'http'), default='client')
+    parser.add_argument('--base-url', default='http://localhost:5000', help='server for --mode http')
+    parser.add_argument('--workloads', default=','.join(WORKLOADS))
+    parser.add_argument('--table-size', type=int, default=10000)
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--zipf', type=float, default=1.1, help='skew of redirect targets; 0 is uniform')
+    parser.add_argument('--miss-ratio', type=float, default=0.05, help='fraction of redirects to unknown codes')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--reset', action='store_true', help='truncate urls before seeding')
+    parser.add_argument('--cold-starts', type=int, default=5, help='fresh-interpreter startups to time; 0 skips')
+    parser.add_argument('--output', help='write results JSON here')
+    parser.add_argument('--compare', help='previous results JSON to diff against')
+    args = parser.parse_args()
+
+    if not args.database_url:
+        parser.error('--database-url or BENCH_DATABASE_URL is required')
+    os.environ['DATABASE_URL'] = args.database_url
+
+    codes = seed_database(args.table_size, args.reset)
+    workload = Workload(codes, args.zipf, args.miss_ratio, args.seed)
+
+    results = {}
+    for name in args.workloads.split(','):
+        if name not in WORKLOADS:
+            parser.error(f"Unknown workload '{name}'")
+        print(f"Running {name} ({args.requests} requests, concurrency {args.concurrency})...", file=sys.stderr)
+        if args.mode == 'client':
+            results[name] = run_client(name, workload, args.requests, args.concurrency)
+        else:
+            results[name] = run_http(name, workload, args.requests, args.concurrency, args.base_url)
+
+    cold_start = None
+    if args.cold_starts > 0:
+        print(f"Timing {args.cold_starts} cold starts...", file=sys.stderr)
+        cold_start = run_cold_start(workload, args.cold_starts)
+
+    report = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'config': {
+            'mode': args.mode,
+            'table_size': args.table_size,
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+            'zipf': args.zipf,
+            'miss_ratio': args.miss_ratio,
+            'seed': args.seed,
+        },
+        'results': results,
+        'cold_start': cold_start,
+    }
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            compare(report, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
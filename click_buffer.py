@@ -0,0 +1,130 @@
+import atexit
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional
+from storage import get_storage
+
+
+class ClickBuffer:
+    """Aggregates click increments in memory and flushes them in batches.
+
+    ``record`` only touches a dict under a lock, so the redirect never waits on
+    the database. A daemon thread hands the accumulated counts to ``flush_fn``
+    every ``flush_interval`` seconds, or sooner once ``max_keys`` distinct codes
+    are pending. Counts from a failed flush are merged back and retried.
+    """
+
+    def __init__(
+        self,
+        flush_fn: Callable[[Dict[str, int]], None],
+        flush_interval: float = 1.0,
+        max_keys: int = 10000,
+    ):
+        self.flush_fn = flush_fn
+        self.flush_interval = flush_interval
+        self.max_keys = max_keys
+
+        self._pending: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread: Optional[threading.Thread] = None
+        self._thread_pid: Optional[int] = None
+
+        self._recorded = 0
+        self._flushed = 0
+        self._flushes = 0
+        self._failures = 0
+        self._dropped = 0
+
+    def record(self, short_code: str, count: int = 1) -> None:
+        self._ensure_thread()
+        with self._lock:
+            if short_code not in self._pending and len(self._pending) >= self.max_keys * 2:
+                # The flusher is behind; shed load rather than grow without bound.
+                self._dropped += count
+                return
+            self._pending[short_code] = self._pending.get(short_code, 0) + count
+            self._recorded += count
+            full = len(self._pending) >= self.max_keys
+
+        if full:
+            self._wakeup.set()
+
+    def flush(self) -> int:
+        """Write out everything pending now. Returns the number of clicks flushed."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+
+            if not batch:
+                return 0
+
+            try:
+                self.flush_fn(batch)
+            except Exception as e:
+                print(f"Failed to flush {len(batch)} click counters: {e}")
+                with self._lock:
+                    self._failures += 1
+                    for code, count in batch.items():
+                        self._pending[code] = self._pending.get(code, 0) + count
+                return 0
+
+            total = sum(batch.values())
+            with self._lock:
+                self._flushes += 1
+                self._flushed += total
+            return total
+
+    def _ensure_thread(self) -> None:
+        pid = os.getpid()
+        if self._thread_pid == pid or self._stopping:
+            return
+
+        with self._flush_lock:
+            if self._thread_pid == pid:
+                return
+            # Counts inherited across a fork belong to the parent process.
+            self._pending = {}
+            self._thread = threading.Thread(target=self._run, name='click-flusher', daemon=True)
+            self._thread_pid = pid
+            self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stopping:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Stop the flusher thread and write out whatever is still buffered."""
+        self._stopping = True
+        self._wakeup.set()
+        if self._thread is not None and self._thread_pid == os.getpid():
+            self._thread.join(timeout)
+        deadline = time.monotonic() + timeout
+        while self.flush() and time.monotonic() < deadline:
+            pass
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'pending_codes': len(self._pending),
+                'pending_clicks': sum(self._pending.values()),
+                'recorded': self._recorded,
+                'flushed': self._flushed,
+                'flushes': self._flushes,
+                'failures': self._failures,
+                'dropped': self._dropped,
+            }
+
+
+click_buffer = ClickBuffer(
+    lambda counts: get_storage().increment_url_clicks_batch(counts),
+    flush_interval=float(os.getenv('CLICK_FLUSH_INTERVAL', '1')),
+    max_keys=int(os.getenv('CLICK_BUFFER_SIZE', '10000')),
+)
+
+atexit.register(click_buffer.stop)
@@ -0,0 +1,157 @@
+import atexit
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import Callable, Dict, Optional, Tuple
+from urllib.parse import urlsplit
+from storage import get_storage
+
+COUNTRY_HEADERS = ('CF-IPCountry', 'X-Country-Code', 'X-AppEngine-Country', 'CloudFront-Viewer-Country')
+
+RollupKey = Tuple[str, datetime, str, str]
+
+
+def referrer_host(referrer: Optional[str]) -> str:
+    """Reduce a Referer header to its host so rollups stay low-cardinality."""
+    if not referrer:
+        return 'direct'
+    host = urlsplit(referrer).hostname
+    return host.lower()[:255] if host else 'unknown'
+
+
+def country_from_headers(headers) -> str:
+    for name in COUNTRY_HEADERS:
+        value = headers.get(name)
+        if value and len(value) == 2 and value.isalpha():
+            return value.upper()
+    return 'XX'
+
+
+class ClickEventPipeline:
+    """Click events for analytics, kept off the request path.
+
+    Redirects append (short_code, timestamp, referrer, country) to a bounded
+    ring buffer, which is a single deque append. A background thread drains
+    it every ``flush_interval`` seconds, folds events into hourly buckets and
+    hands the counts to ``flush_fn``, which upserts the rollup tables. If the
+    buffer fills faster than it drains, the oldest events are overwritten and
+    counted as dropped.
+    """
+
+    def __init__(
+        self,
+        flush_fn: Callable[[Dict[RollupKey, int]], None],
+        capacity: int = 100000,
+        flush_interval: float = 5.0,
+        max_pending: int = 50000,
+    ):
+        self.flush_fn = flush_fn
+        self.capacity = capacity
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+
+        self._events: deque = deque(maxlen=capacity)
+        self._pending: Dict[RollupKey, int] = {}
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread: Optional[threading.Thread] = None
+        self._thread_pid: Optional[int] = None
+
+        self._recorded = 0
+        self._dropped = 0
+        self._flushed = 0
+        self._failures = 0
+
+    def record(self, short_code: str, referrer: Optional[str] = None, country: str = 'XX') -> None:
+        self._ensure_thread()
+        if len(self._events) >= self.capacity:
+            self._dropped += 1
+            self._wakeup.set()
+        self._events.append((short_code, time.time(), referrer_host(referrer), country))
+        self._recorded += 1
+
+    def _drain(self) -> None:
+        pending = self._pending
+        popleft = self._events.popleft
+        while True:
+            try:
+                short_code, ts, referrer, country = popleft()
+            except IndexError:
+                return
+            hour = datetime.fromtimestamp(ts - ts % 3600, tz=timezone.utc).replace(tzinfo=None)
+            key = (short_code, hour, referrer, country)
+            if key not in pending and len(pending) >= self.max_pending:
+                self._dropped += 1
+                continue
+            pending[key] = pending.get(key, 0) + 1
+
+    def flush(self) -> int:
+        """Aggregate buffered events and write them. Returns the number of events written."""
+        with self._flush_lock:
+            self._drain()
+            if not self._pending:
+                return 0
+
+            batch, self._pending = self._pending, {}
+            try:
+                self.flush_fn(batch)
+            except Exception as e:
+                print(f"Failed to flush {len(batch)} click rollups: {e}")
+                self._failures += 1
+                for key, count in batch.items():
+                    self._pending[key] = self._pending.get(key, 0) + count
+                return 0
+
+            total = sum(batch.values())
+            self._flushed += total
+            return total
+
+    def _ensure_thread(self) -> None:
+        pid = os.getpid()
+        if self._thread_pid == pid or self._stopping:
+            return
+
+        with self._flush_lock:
+            if self._thread_pid == pid:
+                return
+            self._events.clear()
+            self._pending = {}
+            self._thread = threading.Thread(target=self._run, name='click-events', daemon=True)
+            self._thread_pid = pid
+            self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stopping:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stopping = True
+        self._wakeup.set()
+        if self._thread is not None and self._thread_pid == os.getpid():
+            self._thread.join(timeout)
+        self.flush()
+
+    def stats(self) -> Dict:
+        return {
+            'buffered': len(self._events),
+            'capacity': self.capacity,
+            'pending_rollups': len(self._pending),
+            'recorded': self._recorded,
+            'flushed': self._flushed,
+            'dropped': self._dropped,
+            'failures': self._failures,
+        }
+
+
+click_events = ClickEventPipeline(
+    lambda counts: get_storage().upsert_click_rollups(counts),
+    capacity=int(os.getenv('CLICK_EVENTS_CAPACITY', '100000')),
+    flush_interval=float(os.getenv('CLICK_EVENTS_FLUSH_INTERVAL', '5')),
+)
+
+atexit.register(click_events.stop)
@@ -0,0 +1,421 @@
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+from hashlib import blake2b
+from typing import Dict, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: no shared workers, the thread lock is enough.
+    fcntl = None
+
+from storage import host_cache_enabled, host_cache_path
+
+HEADER_SIZE = 4096
+MAGIC = b'URLBLOOM'
+VERSION = 1
+MIN_CAPACITY = 1000000
+
+# magic, version, databases, num_bits, hashes, capacity, fp_rate, count, built_at, synced_at
+_HEADER = struct.Struct('<8sIIQIQdQdd')
+_COUNT_OFFSET = _HEADER.size - 24
+_SYNCED_AT_OFFSET = _HEADER.size - 8
+# Per database: insert watermark, highest id seen, id to rescan from, and the
+# candidate for the next rescan point with the time it was recorded.
+_SYNC_STATE = struct.Struct('<qQQQd')
+MAX_DATABASES = (HEADER_SIZE - _HEADER.size) // _SYNC_STATE.size
+
+
+def bloom_parameters(capacity: int, fp_rate: float):
+    """Bits and hash count for a Bloom filter holding capacity keys at fp_rate."""
+    num_bits = math.ceil(-capacity * math.log(fp_rate) / math.log(2) ** 2)
+    num_bits += -num_bits % 8
+    hashes = max(1, round(num_bits / capacity * math.log(2)))
+    return num_bits, hashes
+
+
+class BloomFilter:
+    """Bloom filter over a writable buffer (bytearray or mmap) starting at ``offset``."""
+
+    def __init__(self, bits, num_bits: int, hashes: int, offset: int = 0):
+        self.bits = bits
+        self.num_bits = num_bits
+        self.hashes = hashes
+        self.offset = offset
+
+    def _positions(self, key: str) -> List[int]:
+        digest = blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.hashes)]
+
+    def __contains__(self, key: str) -> bool:
+        bits, offset = self.bits, self.offset
+        for position in self._positions(key):
+            if not bits[offset + (position >> 3)] & (1 << (position & 7)):
+                return False
+        return True
+
+    def add(self, key: str) -> bool:
+        """Set key's bits; returns True if any were new (so key wasn't present)."""
+        bits, offset = self.bits, self.offset
+        added = False
+        for position in self._positions(key):
+            index = offset + (position >> 3)
+            mask = 1 << (position & 7)
+            byte = bits[index]
+            if not byte & mask:
+                bits[index] = byte | mask
+                added = True
+        return added
+
+    def false_positive_rate(self, count: int) -> float:
+        return (1 - math.exp(-self.hashes * count / self.num_bits)) ** self.hashes
+
+
+class ShortCodeFilter:
+    """Which short codes might exist, so unknown ones can 404 without a query.
+
+    The Bloom filter lives in a file that every worker on the host mmaps: a
+    code added by one worker is visible to the others immediately, and a
+    restart reopens the file instead of rescanning urls. A background thread
+    per process catches up with rows written elsewhere (other hosts,
+    migrations): it polls the insert watermark kept in url_stats and, when
+    it moves, rereads rows with ids from the last ``lookback`` seconds or
+    so. The file is rebuilt from a full scan when it fills past capacity and
+    every ``rebuild_interval`` seconds, which also drops deleted codes.
+
+    Negative answers never touch the database and are only trusted while
+    the filter is loaded and was synced within ``max_staleness`` seconds;
+    otherwise lookups go to the database (replica first, then the primary)
+    as before. Codes created on this host are added at once, so only a code
+    created on another host can 404 here, and only until the next sync.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        fp_rate: float = 0.01,
+        capacity: int = 0,
+        sync_interval: float = 1.0,
+        max_staleness: float = 5.0,
+        lookback: float = 60.0,
+        rebuild_interval: float = 86400.0,
+        enabled: bool = True,
+    ):
+        if not 0 < fp_rate < 1:
+            raise ValueError("CODE_FILTER_FP_RATE must be between 0 and 1")
+        self.enabled = enabled
+        # db and the default path are settled when the filter is first used
+        # (_setup), so importing this never needs psycopg2 or a database URL.
+        self._db = None
+        self.path = path
+        self.fp_rate = fp_rate
+        self.capacity = capacity
+        self.sync_interval = sync_interval
+        self.max_staleness = max_staleness
+        self.lookback = lookback
+        self.rebuild_interval = rebuild_interval
+
+        self._bloom: Optional[BloomFilter] = None
+        self._file = None
+        self._inode: Optional[int] = None
+        self._lock = threading.RLock()
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread_pid: Optional[int] = None
+
+        self._stats_lock = threading.Lock()
+        self._checks = 0
+        self._definite_misses = 0
+        self._sync_failures = 0
+
+    # -- file handling --------------------------------------------------
+
+    def _open(self) -> bool:
+        """Map the filter file if it exists and matches this deployment."""
+        try:
+            f = open(self.path, 'r+b')
+        except FileNotFoundError:
+            return False
+
+        try:
+            mm = mmap.mmap(f.fileno(), 0)
+            magic, version, databases, num_bits, hashes = _HEADER.unpack_from(mm, 0)[:5]
+            if (magic, version, databases) != (MAGIC, VERSION, self._db.shard_map.databases) \
+                    or len(mm) != HEADER_SIZE + num_bits // 8:
+                mm.close()
+                f.close()
+                return False
+        except (ValueError, OSError, struct.error):
+            f.close()
+            return False
+
+        with self._lock:
+            previous, previous_file = self._bloom, self._file
+            self._bloom = BloomFilter(mm, num_bits, hashes, offset=HEADER_SIZE)
+            self._file = f
+            self._inode = os.fstat(f.fileno()).st_ino
+            # Lookups still holding the old map see it closed and fall back
+            # to the database; writers are kept out by the lock.
+            if previous is not None:
+                previous.bits.close()
+            if previous_file is not None:
+                previous_file.close()
+        return True
+
+    def _reopen_if_replaced(self) -> None:
+        try:
+            inode = os.stat(self.path).st_ino
+        except FileNotFoundError:
+            return
+        if inode != self._inode:
+            self._open()
+
+    @contextmanager
+    def _file_lock(self):
+        """Serialize writes to the mapped file across threads and processes."""
+        with self._lock:
+            if fcntl is not None and self._file is not None:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            else:
+                yield
+
+    @contextmanager
+    def _maintenance_lock(self):
+        """Yield True if this process may sync or rebuild now; one process at a time."""
+        if fcntl is None:
+            yield True
+            return
+        with open(self.path + '.lock', 'a+b') as lock_file:
+            try:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _header(self, mm=None):
+        return _HEADER.unpack_from(mm if mm is not None else self._bloom.bits, 0)
+
+    def _sync_state(self, database: int, mm=None) -> list:
+        return list(_SYNC_STATE.unpack_from(mm if mm is not None else self._bloom.bits,
+                                            _HEADER.size + database * _SYNC_STATE.size))
+
+    # -- lookups ----------------------------------------------------------
+
+    def _setup(self) -> None:
+        if self._db is not None:
+            return
+        import db
+        if db.shard_map.databases > MAX_DATABASES:
+            raise ValueError(f"The short code filter supports at most {MAX_DATABASES} databases")
+        if self.path is None:
+            self.path = host_cache_path('CODE_FILTER', '.bloom')
+        self._db = db
+
+    def start(self) -> None:
+        """Open or schedule a build of the filter for this process."""
+        if not self.enabled:
+            return
+        pid = os.getpid()
+        if self._thread_pid == pid or self._stopping:
+            return
+
+        with self._lock:
+            if self._thread_pid == pid:
+                return
+            self._setup()
+            self._bloom = None
+            self._open()
+            self._thread_pid = pid
+            threading.Thread(target=self._run, name='code-filter', daemon=True).start()
+
+    def definitely_absent(self, short_code: str) -> bool:
+        """True only if short_code isn't in the filter (and the filter is fresh)."""
+        self.start()
+        bloom = self._bloom
+        if bloom is None:
+            return False
+        try:
+            synced_at = struct.unpack_from('<d', bloom.bits, _SYNCED_AT_OFFSET)[0]
+            if time.time() - synced_at > self.max_staleness:
+                return False
+            present = short_code in bloom
+        except ValueError:  # Replaced by a rebuild and closed mid-lookup.
+            return False
+
+        with self._stats_lock:
+            self._checks += 1
+            if not present:
+                self._definite_misses += 1
+        return not present
+
+    def might_exist(self, short_code: str) -> bool:
+        """True if short_code may be taken; False when unknown or the filter isn't loaded."""
+        bloom = self._bloom
+        try:
+            return bloom is not None and short_code in bloom
+        except ValueError:
+            return False
+
+    def add(self, short_code: str) -> None:
+        self.start()
+        if self._bloom is None:
+            return
+        with self._file_lock():
+            bloom = self._bloom
+            if bloom.add(short_code):
+                count = struct.unpack_from('<Q', bloom.bits, _COUNT_OFFSET)[0]
+                struct.pack_into('<Q', bloom.bits, _COUNT_OFFSET, count + 1)
+
+    # -- maintenance ------------------------------------------------------
+
+    def sync(self) -> None:
+        """Add codes inserted since the last sync, if the insert watermark moved."""
+        with self._maintenance_lock() as acquired:
+            if not acquired or self._bloom is None:
+                return
+
+            now = time.time()
+            built_at = self._header()[8]
+            watermarks = self._db.get_insert_watermarks()
+            for database, watermark in enumerate(watermarks):
+                mark, seen_id, rescan_id, candidate_id, candidate_at = self._sync_state(database)
+                if watermark != mark:
+                    # Read before the scan: anything committed later moves the
+                    # watermark again and is picked up next time.
+                    for row_id, short_code in self._db.iter_url_codes(database, rescan_id):
+                        self.add(short_code)
+                        seen_id = max(seen_id, row_id)
+                    if now - built_at < 2 * self.lookback:
+                        # Rows still uncommitted when the build scanned may
+                        # have ids below everything it saw.
+                        recent = self._db.iter_url_codes(database, created_since=built_at - self.lookback)
+                        for _, short_code in recent:
+                            self.add(short_code)
+                    mark = watermark
+
+                # Rescan from an id that was the newest at least `lookback`
+                # seconds ago, so inserts that committed out of id order
+                # aren't skipped.
+                if now - candidate_at >= self.lookback:
+                    rescan_id, candidate_id, candidate_at = candidate_id, seen_id, now
+
+                with self._file_lock():
+                    _SYNC_STATE.pack_into(self._bloom.bits, _HEADER.size + database * _SYNC_STATE.size,
+                                          mark, seen_id, rescan_id, candidate_id, candidate_at)
+
+            with self._file_lock():
+                struct.pack_into('<d', self._bloom.bits, _SYNCED_AT_OFFSET, now)
+
+    def rebuild(self) -> bool:
+        """Build a fresh filter from a full scan and swap it into place."""
+        self._setup()
+        with self._maintenance_lock() as acquired:
+            if not acquired:
+                return False
+
+            count = self._db.get_stats()['total_urls']
+            capacity = self.capacity or max(MIN_CAPACITY, count * 2)
+            num_bits, hashes = bloom_parameters(capacity, self.fp_rate)
+            started = time.time()
+            watermarks = self._db.get_insert_watermarks()
+
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w+b') as f:
+                f.truncate(HEADER_SIZE + num_bits // 8)
+                mm = mmap.mmap(f.fileno(), 0)
+                bloom = BloomFilter(mm, num_bits, hashes, offset=HEADER_SIZE)
+
+                added = 0
+                for database, watermark in enumerate(watermarks):
+                    seen_id = 0
+                    for row_id, short_code in self._db.iter_url_codes(database):
+                        added += bloom.add(short_code)
+                        seen_id = max(seen_id, row_id)
+                    _SYNC_STATE.pack_into(mm, _HEADER.size + database * _SYNC_STATE.size,
+                                          watermark, seen_id, seen_id, seen_id, started)
+
+                _HEADER.pack_into(mm, 0, MAGIC, VERSION, self._db.shard_map.databases, num_bits, hashes,
+                                  capacity, self.fp_rate, added, started, time.time())
+                mm.flush()
+                mm.close()
+
+            os.replace(tmp_path, self.path)
+            self._open()
+            print(f"Short code filter built: {added} codes, {num_bits // 8 // 1024} KiB, "
+                  f"{time.time() - started:.1f}s")
+            return True
+
+    def _needs_rebuild(self) -> bool:
+        if self._bloom is None:
+            return True
+        capacity, _, count, built_at = self._header()[5:9]
+        return count > capacity or time.time() - built_at > self.rebuild_interval
+
+    def _run(self) -> None:
+        while not self._stopping:
+            try:
+                self._reopen_if_replaced()
+                if self._needs_rebuild():
+                    self.rebuild()
+                self.sync()
+            except Exception as e:
+                self._sync_failures += 1
+                print(f"Short code filter sync failed: {e}")
+            self._wakeup.wait(self.sync_interval)
+            self._wakeup.clear()
+
+    def stop(self) -> None:
+        self._stopping = True
+        self._wakeup.set()
+
+    def stats(self) -> Dict:
+        bloom = self._bloom
+        stats = {
+            'enabled': self.enabled,
+            'ready': bloom is not None,
+            'path': self.path,
+            'target_fp_rate': self.fp_rate,
+            'checks': self._checks,
+            'definite_misses': self._definite_misses,
+            'sync_failures': self._sync_failures,
+        }
+        if bloom is None:
+            return stats
+
+        _, _, _, num_bits, hashes, capacity, _, count, built_at, synced_at = self._header()
+        stats.update({
+            'codes': count,
+            'capacity': capacity,
+            'hashes': hashes,
+            'memory_bytes': num_bits // 8,
+            'estimated_fp_rate': round(bloom.false_positive_rate(count), 6),
+            'built_at': built_at,
+            'synced_seconds_ago': round(time.time() - synced_at, 3),
+        })
+        return stats
+
+
+code_filter = ShortCodeFilter(
+    os.getenv('CODE_FILTER_PATH') or None,
+    fp_rate=float(os.getenv('CODE_FILTER_FP_RATE', '0.01')),
+    capacity=int(os.getenv('CODE_FILTER_CAPACITY', '0')),
+    sync_interval=float(os.getenv('CODE_FILTER_SYNC_INTERVAL', '1')),
+    max_staleness=float(os.getenv('CODE_FILTER_MAX_STALENESS', '5')),
+    lookback=float(os.getenv('CODE_FILTER_LOOKBACK', '60')),
+    rebuild_interval=float(os.getenv('CODE_FILTER_REBUILD_INTERVAL', '86400')),
+    enabled=host_cache_enabled('CODE_FILTER'),
+)
@@ -0,0 +1,157 @@
+import hashlib
+import os
+import random
+import threading
+from typing import Callable, Dict, Optional
+from constants import BASE62_CHARS, SHORT_CODE_LENGTH
+from storage import get_storage
+
+KEYSPACE = len(BASE62_CHARS) ** SHORT_CODE_LENGTH
+
+# Even, so the two halves of the Feistel network end up back where they started.
+FEISTEL_ROUNDS = 8
+
+
+def encode_base62(number: int, length: int = SHORT_CODE_LENGTH) -> str:
+    base = len(BASE62_CHARS)
+    chars = []
+    while number:
+        number, remainder = divmod(number, base)
+        chars.append(BASE62_CHARS[remainder])
+    return ''.join(reversed(chars)).rjust(length, BASE62_CHARS[0])
+
+
+class CodeGenerator:
+    """Produces candidate short codes.
+
+    Generators never talk to the database per code; uniqueness is enforced by
+    the insert itself, and the caller simply asks for another candidate if the
+    code was already taken.
+    """
+
+    def next_code(self) -> str:
+        raise NotImplementedError
+
+
+class RandomCodeGenerator(CodeGenerator):
+    def __init__(self, length: int = SHORT_CODE_LENGTH):
+        self.length = length
+        self._random = random.SystemRandom()
+
+    def next_code(self) -> str:
+        return ''.join(self._random.choices(BASE62_CHARS, k=self.length))
+
+
+class KeyedPermutation:
+    """A secret-keyed bijection over range(62 ** length): a Feistel network.
+
+    The number is split into its high and low base62 digits, and each round
+    adds a keyed hash of one half to the other, modulo that half's range
+    (the halves differ in size when ``length`` is odd, and swap every round).
+    Without the key, neighbouring outputs say nothing about each other.
+    """
+
+    def __init__(self, secret: str, length: int = SHORT_CODE_LENGTH, rounds: int = FEISTEL_ROUNDS):
+        if rounds % 2:
+            raise ValueError("rounds must be even")
+        self._key = hashlib.sha256(secret.encode('utf-8')).digest()
+        self._high = len(BASE62_CHARS) ** (length // 2)
+        self._low = len(BASE62_CHARS) ** (length - length // 2)
+        self.rounds = rounds
+
+    def _round(self, index: int, half: int) -> int:
+        digest = hashlib.blake2b(b'%d:%d' % (index, half), key=self._key, digest_size=8).digest()
+        return int.from_bytes(digest, 'little')
+
+    def __call__(self, value: int) -> int:
+        left, right = divmod(value, self._low)
+        left_size, right_size = self._high, self._low
+        for index in range(self.rounds):
+            left, right = right, (left + self._round(index, right)) % left_size
+            left_size, right_size = right_size, left_size
+        return left * self._low + right
+
+
+class SequenceCodeGenerator(CodeGenerator):
+    """Base62-encodes IDs from blocks reserved out of a shared counter.
+
+    Each worker reserves ``block_size`` IDs at a time, so only one query in
+    every ``block_size`` codes touches the allocator. IDs go through a keyed
+    permutation of the keyspace before encoding, which keeps codes
+    fixed-width and unique while anyone without SHORT_CODE_SECRET can't
+    predict one code from another or enumerate them. The secret is
+    required, and changing it reshuffles every future code.
+
+    Codes issued by the earlier unkeyed mapping (``id * 2654435761 mod
+    62**length``) live in the same keyspace, so a permuted ID can land on
+    one of them. The insert's ON CONFLICT catches that and the caller
+    draws the next ID, so old links stay intact at the cost of a retry.
+    """
+
+    def __init__(self, allocate_block: Callable[[int], int], secret: str, block_size: int = 1000):
+        self.allocate_block = allocate_block
+        self.block_size = block_size
+        self._permute = KeyedPermutation(secret)
+
+        self._lock = threading.Lock()
+        self._next = 0
+        self._end = 0
+        self._pid: Optional[int] = None
+
+    def next_code(self) -> str:
+        with self._lock:
+            if self._pid != os.getpid() or self._next >= self._end:
+                self._next = self.allocate_block(self.block_size)
+                self._end = self._next + self.block_size
+                self._pid = os.getpid()
+
+            value = self._next
+            self._next += 1
+
+        if value >= KEYSPACE:
+            raise RuntimeError("Short code keyspace exhausted")
+        return encode_base62(self._permute(value))
+
+
+def _sequence_generator() -> CodeGenerator:
+    secret = os.getenv('SHORT_CODE_SECRET')
+    if not secret:
+        raise ValueError("SHORT_CODE_STRATEGY=sequence requires SHORT_CODE_SECRET")
+    return SequenceCodeGenerator(
+        lambda size: get_storage().allocate_id_block(size),
+        secret,
+        block_size=int(os.getenv('SHORT_CODE_BLOCK_SIZE', '1000')),
+    )
+
+
+GENERATORS: Dict[str, Callable[[], CodeGenerator]] = {
+    'random': RandomCodeGenerator,
+    'sequence': _sequence_generator,
+}
+
+_generator: Optional[CodeGenerator] = None
+_generator_lock = threading.Lock()
+
+
+def get_code_generator() -> CodeGenerator:
+    """Return the generator selected by SHORT_CODE_STRATEGY.
+
+    The default is sequence when SHORT_CODE_SECRET is set, random otherwise;
+    sequence without SHORT_CODE_SECRET raises ValueError. app.py calls this
+    at import so a misconfigured worker fails at startup, not on the first
+    shorten.
+    """
+    global _generator
+    if _generator is None:
+        with _generator_lock:
+            if _generator is None:
+                strategy = os.getenv('SHORT_CODE_STRATEGY')
+                if strategy is None:
+                    strategy = 'sequence' if os.getenv('SHORT_CODE_SECRET') else 'random'
+                    if strategy == 'random':
+                        print("Warning: SHORT_CODE_SECRET is not set: using random short codes "
+                              "(set it, or SHORT_CODE_STRATEGY=random, to silence this)")
+                if strategy not in GENERATORS:
+                    raise ValueError(f"Unknown SHORT_CODE_STRATEGY '{strategy}'")
+                _generator = GENERATORS[strategy]()
+    return _generator
@@ -1,4 +1,25 @@
+import os
+
 BASE62_CHARS = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789"
 SHORT_CODE_LENGTH = 6
 DATA_FILE = "urls.json"
-BASE_URL = "http://localhost:5000"
\ No newline at end of file
+BASE_URL = "http://localhost:5000"
+
+_ENV_FILES = ('.env', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.env'))
+
+
+def load_env() -> None:
+    """Load a .env file into the environment, if there is one.
+
+    Deployments set real environment variables and skip python-dotenv
+    entirely; it is only imported when a .env file exists.
+    """
+    for path in _ENV_FILES:
+        if os.path.isfile(path):
+            from dotenv import load_dotenv
+            load_dotenv(path)
+            return
+
+
+# Before anything reads its settings: every entry point imports this first.
+load_env()
@@ -1,13 +1,34 @@
+import csv
+import io
 import os
+import threading
+import time
 import psycopg2
-from psycopg2.extras import RealDictCursor
-from typing import List, Dict, Optional
-from dotenv import load_dotenv
+from contextlib import contextmanager
+from datetime import datetime
+from psycopg2.extras import RealDictCursor, execute_values
+from typing import Iterator, List, Dict, Optional, Tuple
 
-load_dotenv()
+# Loads .env before the local imports below, which read their settings at import.
+import constants
+
+from db_pool import ConnectionPool, PoolTimeout, pool_size_from_env
+from replicas import ReplicaSet, REPLICA_LAG_SQL, replica_urls_from_env
+from sharding import shard_map_from_env
+from url_cache import resolution_cache
+from url_utils import url_digest
+from metrics import timed_db_call, record_db_phase
 
 DATABASE_URL = os.getenv('DATABASE_URL')
 
+# Database 0 is the primary: it also holds the tables that aren't sharded
+# (id_allocator, click rollups).
+shard_map = shard_map_from_env(DATABASE_URL)
+
+_pools: Dict[str, ConnectionPool] = {}
+_pool_pid: Optional[int] = None
+_pool_lock = threading.Lock()
+
 def get_db_connection():
     try:
         conn = psycopg2.connect(DATABASE_URL, cursor_factory=RealDictCursor)
@@ -17,175 +38,1279 @@ def get_db_connection():
         print(f"DATABASE_URL: {DATABASE_URL}")
         raise
 
+def _pool_for(dsn: str) -> ConnectionPool:
+    """Return this process's connection pool for a DSN, creating it on first use.
+
+    Pools are keyed on the PID so a gunicorn worker forked from a preloaded
+    master never shares sockets with its parent.
+    """
+    global _pools, _pool_pid
+    pid = os.getpid()
+    if _pool_pid == pid and dsn in _pools:
+        return _pools[dsn]
+
+    with _pool_lock:
+        if _pool_pid != pid:
+            _pools = {}
+            _pool_pid = pid
+        if dsn not in _pools:
+            try:
+                _pools[dsn] = ConnectionPool(dsn, **pool_size_from_env())
+            except psycopg2.OperationalError as e:
+                print(f"Database connection failed: {e}")
+                raise
+    return _pools[dsn]
+
+def get_pool(database: int = 0) -> ConnectionPool:
+    """The pool for a database shard's primary."""
+    return _pool_for(shard_map.database_urls[database])
+
+def _replica_lag(dsn: str) -> float:
+    # A plain cursor, so health checks don't count towards request queries.
+    with _pool_for(dsn).connection() as conn:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(REPLICA_LAG_SQL)
+            lag = cur.fetchone()['lag']
+    if lag is None:
+        raise RuntimeError("Replica has not replayed any transactions yet")
+    return float(lag)
+
+replica_sets = [
+    ReplicaSet(
+        urls,
+        _replica_lag,
+        max_lag=float(os.getenv('REPLICA_MAX_LAG', '5')),
+        check_interval=float(os.getenv('REPLICA_CHECK_INTERVAL', '2')),
+    )
+    for urls in replica_urls_from_env(shard_map.databases)
+]
+
+@contextmanager
+def _connection(database: int, readonly: bool):
+    """A primary connection, or a replica one for reads when a healthy replica exists.
+
+    A replica that can't hand out a connection is dropped from rotation and
+    the read falls through to the primary.
+    """
+    replicas = replica_sets[database]
+    replica = replicas.choose() if readonly else None
+    if replica is not None:
+        entered = False
+        try:
+            with _pool_for(replica).connection() as conn:
+                entered = True
+                yield conn
+            return
+        except (psycopg2.OperationalError, PoolTimeout) as e:
+            replicas.mark_failed(replica, e)
+            if entered:
+                raise
+
+    with get_pool(database).connection() as conn:
+        yield conn
+
+@contextmanager
+def get_cursor(transaction: bool = False, database: int = 0, readonly: bool = False):
+    """Yield a cursor on a pooled connection to one database shard.
+
+    Statements run in autocommit mode unless ``transaction`` is set, in which
+    case everything in the block is committed together or rolled back.
+    ``readonly`` cursors may be served by a replica and can lag the primary
+    by up to REPLICA_MAX_LAG seconds.
+    """
+    with _connection(database, readonly) as conn:
+        if transaction:
+            conn.autocommit = False
+        cur = conn.cursor()
+        try:
+            yield cur
+            if transaction:
+                started = time.perf_counter()
+                conn.commit()
+                record_db_phase('commit', time.perf_counter() - started)
+        finally:
+            cur.close()
+
+def get_code_cursor(short_code: str, transaction: bool = False, readonly: bool = False):
+    """get_cursor() on the database shard that owns short_code."""
+    return get_cursor(transaction, shard_map.database_for(short_code), readonly)
+
+def get_pool_stats() -> Dict:
+    if _pool_pid != os.getpid() or not _pools:
+        return {}
+
+    labels = {}
+    for database, url in enumerate(shard_map.database_urls):
+        labels[url] = f'db{database}'
+        for index, replica in enumerate(replica_sets[database].dsns):
+            labels[replica] = f'db{database}-replica{index}'
+
+    if len(_pools) == 1:
+        return next(iter(_pools.values())).stats()
+
+    per_pool = {labels.get(dsn, dsn): pool.stats() for dsn, pool in _pools.items()}
+    totals: Dict = {}
+    for stats in per_pool.values():
+        for key, value in stats.items():
+            if key not in ('hit_rate', 'queries'):
+                totals[key] = totals.get(key, 0) + value
+    checkouts = totals['hits'] + totals['misses']
+    totals['hit_rate'] = round(totals['hits'] / checkouts, 4) if checkouts else 0.0
+    totals['queries'] = next(iter(per_pool.values()))['queries']
+    totals['pools'] = dict(sorted(per_pool.items()))
+    return totals
+
+def get_replica_stats() -> Dict:
+    return {f'db{database}': replicas.stats() for database, replicas in enumerate(replica_sets) if replicas}
+
+def close_pool(stop_replicas: bool = True) -> None:
+    """Close this process's connections.
+
+    With ``stop_replicas=False`` the replica monitors stay usable, so a
+    preloading master can drop its connections before forking workers.
+    """
+    global _pools
+    if stop_replicas:
+        for replicas in replica_sets:
+            replicas.stop()
+    with _pool_lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools = {}
+
+@timed_db_call
 def init_db():
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
+    for database in range(shard_map.databases):
+        with get_cursor(transaction=True, database=database) as cur:
+            _init_urls_table(cur, database)
+
+            _init_stats_counters(cur)
+
+            _init_tombstones(cur)
+
+            if database != 0:
+                continue
+
+            for table in ROLLUP_TABLES.values():
+                cur.execute(f'''
+                    CREATE TABLE IF NOT EXISTS {table} (
+                        short_code VARCHAR(10) NOT NULL,
+                        bucket_start TIMESTAMP NOT NULL,
+                        referrer VARCHAR(255) NOT NULL,
+                        country CHAR(2) NOT NULL,
+                        clicks BIGINT NOT NULL DEFAULT 0,
+                        PRIMARY KEY (short_code, bucket_start, referrer, country)
+                    )
+                ''')
+
+            cur.execute('''
+                CREATE TABLE IF NOT EXISTS id_allocator (
+                    name VARCHAR(32) PRIMARY KEY,
+                    next_id BIGINT NOT NULL
+                )
+            ''')
+
+            cur.execute('''
+                INSERT INTO id_allocator (name, next_id)
+                VALUES ('short_code', 1)
+                ON CONFLICT (name) DO NOTHING
+            ''')
+
+    print("Database tables created successfully!")
+
+def _urls_relkind(cur) -> Optional[str]:
+    """'r' for a plain urls table, 'p' for a partitioned one, None if missing."""
+    cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('urls')")
+    row = cur.fetchone()
+    return row['relkind'] if row else None
+
+def _create_partitioned_urls(cur) -> None:
+    """Create urls hash-partitioned on short_code.
+
+    A unique index on a partitioned table has to include the partition key,
+    so short_code is the primary key and id is just a sequence value.
+    """
     cur.execute('''
-        CREATE TABLE IF NOT EXISTS urls (
-            id SERIAL PRIMARY KEY,
-            short_code VARCHAR(10) UNIQUE NOT NULL,
+        CREATE TABLE urls (
+            id BIGSERIAL NOT NULL,
+            short_code VARCHAR(10) NOT NULL,
             original_url TEXT NOT NULL,
             clicks INTEGER DEFAULT 0,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            url_hash BYTEA,
+            expires_at TIMESTAMPTZ,
+            clicks_left INTEGER,
+            PRIMARY KEY (short_code)
+        ) PARTITION BY HASH (short_code)
+    ''')
+
+    for remainder in range(shard_map.partitions):
+        cur.execute(f'''
+            CREATE TABLE urls_p{remainder} PARTITION OF urls
+            FOR VALUES WITH (MODULUS {shard_map.partitions}, REMAINDER {remainder})
+        ''')
+
+# The lowercased host of original_url, reversed ('moc.elpmaxe.www'). Must
+# match the idx_url_host expression exactly for the index to be used.
+URL_HOST_SQL = r"reverse(lower(regexp_replace(original_url, '^[^:/?#]+://([^@/?#]*@)?([^:/?#]*).*$', '\2')))"
+
+SEARCH_FIELDS = ('url', 'domain', 'code')
+
+def _init_urls_table(cur, database: int) -> None:
+    relkind = _urls_relkind(cur)
+
+    if relkind is None and shard_map.partitions > 1:
+        _create_partitioned_urls(cur)
+    elif relkind != 'p':
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS urls (
+                id SERIAL PRIMARY KEY,
+                short_code VARCHAR(10) UNIQUE NOT NULL,
+                original_url TEXT NOT NULL,
+                clicks INTEGER DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+        cur.execute('''
+            CREATE INDEX IF NOT EXISTS idx_short_code ON urls(short_code)
+        ''')
+
+        if relkind == 'r' and shard_map.partitions > 1:
+            print("urls is not partitioned yet; run `python migrate_data.py partition` to split it")
+
+    if relkind is None and shard_map.databases > 1:
+        # Interleave ids across databases (1, 1 + n, ... on the first) so
+        # the (created_at, id) keys used for paging stay globally unique.
+        cur.execute('''
+            SELECT setval(pg_get_serial_sequence('urls', 'id'), %s, false)
+        ''', (database + 1,))
+        cur.execute('''
+            SELECT pg_get_serial_sequence('urls', 'id') AS seq
+        ''')
+        cur.execute(f"ALTER SEQUENCE {cur.fetchone()['seq']} INCREMENT BY {shard_map.databases}")
+
+    cur.execute('''
+        ALTER TABLE urls ADD COLUMN IF NOT EXISTS url_hash BYTEA
+    ''')
+
+    # Optional link limits: NULL means the link never expires / has no
+    # click cap. A link that runs out of clicks gets expires_at set, so the
+    # purger only ever has to scan one index.
+    cur.execute('''
+        ALTER TABLE urls
+            ADD COLUMN IF NOT EXISTS expires_at TIMESTAMPTZ,
+            ADD COLUMN IF NOT EXISTS clicks_left INTEGER
+    ''')
+
+    cur.execute('''
+        CREATE INDEX IF NOT EXISTS idx_expires_at ON urls(expires_at) WHERE expires_at IS NOT NULL
+    ''')
+
+    if shard_map.sharded:
+        # No index can span every shard, so url_hash can't be unique: dedupe
+        # becomes a lookup of the oldest row with the hash.
+        cur.execute('''
+            DROP INDEX IF EXISTS idx_url_hash
+        ''')
+        cur.execute('''
+            CREATE INDEX IF NOT EXISTS idx_url_hash_lookup ON urls(url_hash)
+        ''')
+    else:
+        cur.execute('''
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_url_hash ON urls(url_hash)
+        ''')
+
+    cur.execute('''
+        DROP INDEX IF EXISTS idx_original_url
+    ''')
+
+    cur.execute('''
+        CREATE INDEX IF NOT EXISTS idx_created_at_id ON urls(created_at DESC, id DESC)
+    ''')
+
+    # Search (see search_urls): short code prefixes, and destination hosts
+    # reversed so a domain and its subdomains are one prefix range.
+    cur.execute('''
+        CREATE INDEX IF NOT EXISTS idx_short_code_prefix ON urls(short_code text_pattern_ops)
+    ''')
+    cur.execute(f'''
+        CREATE INDEX IF NOT EXISTS idx_url_host ON urls(({URL_HOST_SQL}) text_pattern_ops)
+    ''')
+    _init_trigram_index(cur)
+
+    if _urls_relkind(cur) == 'p':
+        # id isn't a key of the partitioned table; BRIN keeps "rows after
+        # id N" scans (see iter_url_codes) cheap without a full btree.
+        cur.execute('''
+            CREATE INDEX IF NOT EXISTS idx_id_brin ON urls USING brin (id)
+        ''')
+
+def _init_trigram_index(cur) -> None:
+    """Index original_url for substring search, if pg_trgm can be installed."""
+    cur.execute('SAVEPOINT trigram_index')
+    try:
+        cur.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        cur.execute('''
+            CREATE INDEX IF NOT EXISTS idx_original_url_trgm ON urls USING gin (original_url gin_trgm_ops)
+        ''')
+    except psycopg2.Error as e:
+        cur.execute('ROLLBACK TO SAVEPOINT trigram_index')
+        print(f"pg_trgm is unavailable, URL substring search will scan the table: {e}")
+    cur.execute('RELEASE SAVEPOINT trigram_index')
+
+@timed_db_call
+def partition_urls_table() -> int:
+    """Move plain urls tables into hash partitions (URL_PARTITIONS). Returns rows moved.
+
+    Each database is converted in one transaction holding an exclusive lock
+    on urls, so run it in a maintenance window; the stats counters are
+    reseeded afterwards.
+    """
+    if shard_map.partitions < 2:
+        raise RuntimeError("Set URL_PARTITIONS to 2 or more before partitioning")
+
+    moved = 0
+    for database in range(shard_map.databases):
+        with get_cursor(transaction=True, database=database) as cur:
+            if _urls_relkind(cur) != 'r':
+                continue
+
+            cur.execute('LOCK TABLE urls IN ACCESS EXCLUSIVE MODE')
+            cur.execute('ALTER TABLE urls RENAME TO urls_unpartitioned')
+            cur.execute('ALTER INDEX IF EXISTS urls_pkey RENAME TO urls_unpartitioned_pkey')
+            _create_partitioned_urls(cur)
+
+            cur.execute('''
+                INSERT INTO urls (id, short_code, original_url, clicks, created_at, url_hash,
+                                  expires_at, clicks_left)
+                SELECT id, short_code, original_url, clicks, created_at, url_hash,
+                       expires_at, clicks_left
+                FROM urls_unpartitioned
+            ''')
+            moved += cur.rowcount
+
+            cur.execute('''
+                SELECT setval(pg_get_serial_sequence('urls', 'id'), COALESCE(MAX(id), 1))
+                FROM urls
+            ''')
+            cur.execute('DROP TABLE urls_unpartitioned')
+
+            _init_urls_table(cur, database)
+            _init_stats_counters(cur)
+
+    return moved
+
+STATS_SLOTS = 16
+
+ROLLUP_TABLES = {
+    'hour': 'click_rollups_hourly',
+    'day': 'click_rollups_daily',
+}
+
+_STATS_TRIGGERS = {
+    'urls_stats_insert': ('''
+        CREATE OR REPLACE FUNCTION urls_stats_insert() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO url_stats (slot, total_urls, total_clicks, total_inserted)
+            SELECT pg_backend_pid() % {slots}, COUNT(*), COALESCE(SUM(clicks), 0), COUNT(*)
+            FROM new_rows
+            HAVING COUNT(*) > 0
+            ON CONFLICT (slot) DO UPDATE SET
+                total_urls = url_stats.total_urls + EXCLUDED.total_urls,
+                total_clicks = url_stats.total_clicks + EXCLUDED.total_clicks,
+                total_inserted = url_stats.total_inserted + EXCLUDED.total_inserted;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+    ''', '''
+        CREATE TRIGGER urls_stats_insert
+        AFTER INSERT ON urls
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION urls_stats_insert()
+    '''),
+    'urls_stats_delete': ('''
+        CREATE OR REPLACE FUNCTION urls_stats_delete() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO url_stats (slot, total_urls, total_clicks)
+            SELECT pg_backend_pid() % {slots}, -COUNT(*), -COALESCE(SUM(clicks), 0)
+            FROM old_rows
+            HAVING COUNT(*) > 0
+            ON CONFLICT (slot) DO UPDATE SET
+                total_urls = url_stats.total_urls + EXCLUDED.total_urls,
+                total_clicks = url_stats.total_clicks + EXCLUDED.total_clicks;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+    ''', '''
+        CREATE TRIGGER urls_stats_delete
+        AFTER DELETE ON urls
+        REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION urls_stats_delete()
+    '''),
+    'urls_stats_update': ('''
+        CREATE OR REPLACE FUNCTION urls_stats_update() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO url_stats (slot, total_urls, total_clicks)
+            SELECT pg_backend_pid() % {slots}, 0, delta
+            FROM (
+                SELECT (SELECT COALESCE(SUM(clicks), 0) FROM new_rows)
+                     - (SELECT COALESCE(SUM(clicks), 0) FROM old_rows) AS delta
+            ) d
+            WHERE delta <> 0
+            ON CONFLICT (slot) DO UPDATE SET
+                total_clicks = url_stats.total_clicks + EXCLUDED.total_clicks;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+    ''', '''
+        CREATE TRIGGER urls_stats_update
+        AFTER UPDATE ON urls
+        REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION urls_stats_update()
+    '''),
+}
+
+def _init_stats_counters(cur) -> None:
+    """Create url_stats and the statement-level triggers that maintain it.
+
+    Totals are spread over STATS_SLOTS rows (picked by backend PID) so
+    concurrent writers rarely contend on the same counter row; readers sum
+    the slots. The table is seeded from a full count the first time only.
+    total_inserted only ever grows; it is the insert watermark the short
+    code filter polls.
+    """
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS url_stats (
+            slot SMALLINT PRIMARY KEY,
+            total_urls BIGINT NOT NULL DEFAULT 0,
+            total_clicks BIGINT NOT NULL DEFAULT 0
         )
     ''')
-    
+
     cur.execute('''
-        CREATE INDEX IF NOT EXISTS idx_short_code ON urls(short_code)
+        ALTER TABLE url_stats ADD COLUMN IF NOT EXISTS total_inserted BIGINT NOT NULL DEFAULT 0
     ''')
-    
+
+    # Always replaced, so existing triggers pick up changes to the functions.
+    for function_sql, _ in _STATS_TRIGGERS.values():
+        cur.execute(function_sql.replace('{slots}', str(STATS_SLOTS)))
+
     cur.execute('''
-        CREATE INDEX IF NOT EXISTS idx_original_url ON urls(original_url)
+        SELECT tgname FROM pg_trigger
+        WHERE tgrelid = 'urls'::regclass AND tgname = ANY(%s)
+    ''', (list(_STATS_TRIGGERS),))
+    existing = {row['tgname'] for row in cur.fetchall()}
+    if len(existing) == len(_STATS_TRIGGERS):
+        return
+
+    # Block writers while the triggers go in so the seed count is exact.
+    cur.execute('LOCK TABLE urls IN SHARE ROW EXCLUSIVE MODE')
+    for name, (_, trigger_sql) in _STATS_TRIGGERS.items():
+        if name not in existing:
+            cur.execute(trigger_sql)
+
+    _reseed_stats(cur)
+
+def _reseed_stats(cur) -> Dict:
+    """Replace url_stats with one row counted from urls, which must be locked.
+
+    total_inserted is the insert watermark and must never go back (the
+    short code filter compares it for equality), so its sum carries over.
+    """
+    cur.execute('SELECT COALESCE(SUM(total_inserted), 0)::BIGINT AS inserted FROM url_stats')
+    inserted = cur.fetchone()['inserted']
+    cur.execute('DELETE FROM url_stats')
+    cur.execute('''
+        INSERT INTO url_stats (slot, total_urls, total_clicks, total_inserted)
+        SELECT 0, COUNT(*), COALESCE(SUM(clicks), 0), %s FROM urls
+        RETURNING total_urls, total_clicks
+    ''', (inserted,))
+    return cur.fetchone()
+
+def _init_tombstones(cur) -> None:
+    """Create url_tombstones: links deleted outright, so the redirect snapshot
+    (a copy of urls outside the database) stops serving them before its
+    next rebuild."""
+    cur.execute('''
+        CREATE TABLE IF NOT EXISTS url_tombstones (
+            short_code VARCHAR(10) PRIMARY KEY,
+            deleted_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
     ''')
-    
-    conn.commit()
-    cur.close()
-    conn.close()
-    
-    print("Database tables created successfully!")
+    cur.execute('CREATE INDEX IF NOT EXISTS idx_url_tombstones_deleted_at ON url_tombstones (deleted_at)')
+
+def _databases():
+    return range(shard_map.databases)
+
+@timed_db_call
+def rebuild_stats() -> Dict:
+    """Recompute url_stats from a full scan; a repair tool, not for request paths."""
+    totals = {'total_urls': 0, 'total_clicks': 0}
+    for database in _databases():
+        with get_cursor(transaction=True, database=database) as cur:
+            cur.execute('LOCK TABLE urls IN SHARE ROW EXCLUSIVE MODE')
+            for key, value in _reseed_stats(cur).items():
+                totals[key] += value
+    return totals
 
+@timed_db_call
+def ping() -> bool:
+    for database in _databases():
+        with get_cursor(database=database) as cur:
+            cur.execute('SELECT 1')
+    return True
+
+@timed_db_call
 def create_url_entry(short_code: str, original_url: str, clicks: int = 0) -> Dict:
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
+    url_hash = url_digest(original_url)
+    if shard_map.sharded:
+        hash_sql = '%(hash)s'
+    else:
+        # An equivalent URL may already exist under another code (legacy
+        # data); the row is still inserted, just without claiming the hash.
+        hash_sql = '''CASE WHEN EXISTS (SELECT 1 FROM urls WHERE url_hash = %(hash)s)
+                    THEN NULL ELSE %(hash)s END'''
+
     try:
-        cur.execute('''
-            INSERT INTO urls (short_code, original_url, clicks)
-            VALUES (%s, %s, %s)
-            RETURNING short_code, original_url, clicks, created_at
-        ''', (short_code, original_url, clicks))
-        
-        result = cur.fetchone()
-        conn.commit()
-        
-        return dict(result)
-    
+        with get_code_cursor(short_code) as cur:
+            cur.execute(f'''
+                INSERT INTO urls (short_code, original_url, clicks, url_hash)
+                SELECT %(code)s, %(url)s, %(clicks)s, {hash_sql}
+                RETURNING short_code, original_url, clicks, created_at
+            ''', {'code': short_code, 'url': original_url, 'clicks': clicks, 'hash': url_hash})
+
+            result = dict(cur.fetchone())
+
+        resolution_cache.invalidate(short_code)
+        return result
+
     except psycopg2.IntegrityError:
-        conn.rollback()
         return find_url_by_code(short_code)
-    
-    finally:
-        cur.close()
-        conn.close()
 
+@timed_db_call
+def get_or_create_url_entry(short_code: str, original_url: str) -> Optional[Dict]:
+    """Return the existing entry for original_url, or insert it under short_code.
+
+    Equivalent URLs are matched through url_hash, the digest of the normalized
+    URL, and lookup and insert happen in one statement on one database. With
+    several databases the caller picks short_code on the shard the URL's
+    digest maps to (ShardMap.database_for_hash), which is where any earlier
+    link for the URL was placed. Returns None if short_code was already
+    taken (or a concurrent insert of the same URL won), in which case the
+    caller should retry with another code.
+
+    When sharded, no unique index covers url_hash, so two concurrent creates
+    of the same URL can both insert; links created before placement by
+    digest (or bulk-loaded by code) may also live on another shard and
+    aren't found. Either way the result is a second working link for the
+    URL, not a lost one.
+    """
+    url_hash = url_digest(original_url)
+    with get_code_cursor(short_code) as cur:
+        cur.execute('''
+            WITH existing AS (
+                SELECT short_code, original_url, clicks, created_at
+                FROM urls
+                WHERE url_hash = %(hash)s
+                ORDER BY id
+                LIMIT 1
+            ), inserted AS (
+                INSERT INTO urls (short_code, original_url, url_hash)
+                SELECT %(code)s, %(url)s, %(hash)s
+                WHERE NOT EXISTS (SELECT 1 FROM existing)
+                ON CONFLICT DO NOTHING
+                RETURNING short_code, original_url, clicks, created_at
+            )
+            SELECT * FROM existing
+            UNION ALL
+            SELECT * FROM inserted
+        ''', {'code': short_code, 'url': original_url, 'hash': url_hash})
+
+        result = cur.fetchone()
+
+    if result is None:
+        return None
+    if result['short_code'] == short_code:
+        resolution_cache.invalidate(short_code)
+    return dict(result)
+
+@timed_db_call
+def find_urls_by_hashes(url_hashes: List[bytes]) -> List[Dict]:
+    """Entries for the given digests, one per digest (the oldest when sharded).
+
+    Each digest is only looked up on the database it is placed on (see
+    get_or_create_url_entry), so each shard sees just its share of a batch.
+    """
+    if not url_hashes:
+        return []
+
+    by_database: Dict[int, List[bytes]] = {}
+    for url_hash in url_hashes:
+        by_database.setdefault(shard_map.database_for_hash(url_hash), []).append(url_hash)
+
+    found: Dict[bytes, Dict] = {}
+    for database, hashes in by_database.items():
+        with get_cursor(database=database) as cur:
+            cur.execute('''
+                SELECT DISTINCT ON (url_hash) short_code, original_url, clicks, created_at, url_hash
+                FROM urls
+                WHERE url_hash = ANY(%s)
+                ORDER BY url_hash, id
+            ''', ([psycopg2.Binary(h) for h in hashes],))
+
+            results = cur.fetchall()
+
+        for row in results:
+            row = dict(row, url_hash=bytes(row['url_hash']))
+            current = found.get(row['url_hash'])
+            if current is None or row['created_at'] < current['created_at']:
+                found[row['url_hash']] = row
+
+    return list(found.values())
+
+@timed_db_call
+def insert_url_entries(rows: List[tuple], expires_at=None, max_clicks: Optional[int] = None) -> List[Dict]:
+    """Insert (short_code, original_url, url_hash) rows, one multi-row statement per shard.
+
+    Rows whose code (or, unsharded, hash) already exist are skipped; only the
+    rows actually inserted are returned. ``expires_at`` and ``max_clicks``
+    apply to every row; url_hash may be None for rows that must not be
+    dedupe targets.
+    """
+    if not rows:
+        return []
+
+    inserted = []
+    for database, shard_rows in shard_map.group_by_database(rows).items():
+        with get_cursor(database=database) as cur:
+            results = execute_values(cur, '''
+                INSERT INTO urls (short_code, original_url, url_hash, expires_at, clicks_left)
+                VALUES %s
+                ON CONFLICT DO NOTHING
+                RETURNING short_code, original_url, clicks, created_at, url_hash, expires_at, clicks_left
+            ''', [(code, url, psycopg2.Binary(h) if h is not None else None, expires_at, max_clicks)
+                  for code, url, h in shard_rows],
+                template='(%s, %s, %s, %s::timestamptz, %s::integer)',
+                page_size=len(shard_rows), fetch=True)
+
+        inserted.extend(
+            dict(row, url_hash=bytes(row['url_hash']) if row['url_hash'] is not None else None)
+            for row in results
+        )
+
+    for row in inserted:
+        resolution_cache.invalidate(row['short_code'])
+    return inserted
+
+@timed_db_call
+def allocate_id_block(size: int) -> int:
+    """Reserve size consecutive IDs for short code generation; returns the first."""
+    with get_cursor() as cur:
+        cur.execute('''
+            UPDATE id_allocator
+            SET next_id = next_id + %s
+            WHERE name = 'short_code'
+            RETURNING next_id - %s AS start
+        ''', (size, size))
+
+        result = cur.fetchone()
+
+    if result is None:
+        raise RuntimeError("id_allocator is not initialized; run init_db()")
+    return result['start']
+
+@timed_db_call
 def find_url_by_original(original_url: str) -> Optional[Dict]:
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
-    cur.execute('''
-        SELECT short_code, original_url, clicks, created_at
-        FROM urls
-        WHERE original_url = %s
-    ''', (original_url,))
-    
-    result = cur.fetchone()
-    cur.close()
-    conn.close()
-    
+    matches = find_urls_by_hashes([url_digest(original_url)])
+    if not matches:
+        return None
+    del matches[0]['url_hash']
+    return matches[0]
+
+@timed_db_call
+def backfill_url_hashes(batch_size: int = 5000) -> int:
+    """Populate url_hash for rows created before it existed.
+
+    Works in id order, one batch per statement, so it can be interrupted and
+    rerun. When several rows normalize to the same URL only the oldest claims
+    the hash; the others keep redirecting but are no longer dedupe targets.
+    Sharded, every row gets its hash and dedupe picks the oldest instead.
+    Returns the number of rows that were given a hash.
+    """
+    claim_sql = '' if shard_map.sharded else \
+        'AND NOT EXISTS (SELECT 1 FROM urls u WHERE u.url_hash = v.url_hash)'
+
+    updated = 0
+    for database in _databases():
+        last_id = 0
+        while True:
+            with get_cursor(database=database) as cur:
+                cur.execute('''
+                    SELECT id, original_url
+                    FROM urls
+                    WHERE url_hash IS NULL AND id > %s
+                    ORDER BY id
+                    LIMIT %s
+                ''', (last_id, batch_size))
+                rows = cur.fetchall()
+
+                if not rows:
+                    break
+                last_id = rows[-1]['id']
+
+                if shard_map.sharded:
+                    values = [(row['id'], url_digest(row['original_url'])) for row in rows]
+                else:
+                    batch = {}
+                    for row in rows:
+                        batch.setdefault(url_digest(row['original_url']), row['id'])
+                    values = [(row_id, digest) for digest, row_id in batch.items()]
+
+                execute_values(cur, f'''
+                    UPDATE urls
+                    SET url_hash = v.url_hash
+                    FROM (VALUES %s) AS v(id, url_hash)
+                    WHERE urls.id = v.id
+                      {claim_sql}
+                ''', values, template='(%s::bigint, %s::bytea)', page_size=len(values))
+                updated += cur.rowcount
+
+    return updated
+
+@timed_db_call
+def copy_url_entries(rows: List[tuple]) -> int:
+    """Bulk-load (short_code, original_url, clicks, created_at) rows.
+
+    Rows are grouped by database shard, COPYed into a temporary staging table
+    and merged into urls in one transaction per shard. Codes that already
+    exist are skipped, which makes reloading the same rows harmless. When
+    several rows share a normalized URL only the first (or an existing row)
+    keeps url_hash unless sharded; the rest are still inserted so their links
+    keep working. Returns the number of rows inserted.
+    """
+    if not rows:
+        return 0
+
+    if shard_map.sharded:
+        hash_sql = 's.url_hash'
+    else:
+        hash_sql = '''CASE
+                    WHEN s.hash_rank = 1
+                     AND NOT EXISTS (SELECT 1 FROM urls u WHERE u.url_hash = s.url_hash)
+                    THEN s.url_hash
+                END'''
+
+    inserted = 0
+    for database, shard_rows in shard_map.group_by_database(enumerate(rows), lambda item: item[1][0]).items():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for seq, (short_code, original_url, clicks, created_at) in shard_rows:
+            writer.writerow([
+                seq,
+                short_code,
+                original_url,
+                clicks or 0,
+                created_at or '',
+                '\\x' + url_digest(original_url).hex(),
+            ])
+        buffer.seek(0)
+
+        with get_cursor(transaction=True, database=database) as cur:
+            cur.execute('''
+                CREATE TEMP TABLE urls_staging (
+                    seq INTEGER,
+                    short_code VARCHAR(10),
+                    original_url TEXT,
+                    clicks INTEGER,
+                    created_at TIMESTAMP,
+                    url_hash BYTEA
+                ) ON COMMIT DROP
+            ''')
+
+            cur.copy_expert('''
+                COPY urls_staging (seq, short_code, original_url, clicks, created_at, url_hash)
+                FROM STDIN WITH (FORMAT csv)
+            ''', buffer)
+
+            cur.execute(f'''
+                INSERT INTO urls (short_code, original_url, clicks, created_at, url_hash)
+                SELECT
+                    s.short_code,
+                    s.original_url,
+                    s.clicks,
+                    COALESCE(s.created_at, CURRENT_TIMESTAMP),
+                    {hash_sql}
+                FROM (
+                    SELECT *, ROW_NUMBER() OVER (PARTITION BY url_hash ORDER BY seq) AS hash_rank
+                    FROM urls_staging
+                ) s
+                ORDER BY s.seq
+                ON CONFLICT DO NOTHING
+            ''')
+
+            inserted += cur.rowcount
+
+    return inserted
+
+@timed_db_call
+def count_urls() -> int:
+    total = 0
+    for database in _databases():
+        with get_cursor(database=database) as cur:
+            cur.execute('SELECT COUNT(*) AS total FROM urls')
+            total += cur.fetchone()['total']
+    return total
+
+def _select_url_by_code(short_code: str, readonly: bool) -> Optional[Dict]:
+    with get_code_cursor(short_code, readonly=readonly) as cur:
+        cur.execute('''
+            SELECT short_code, original_url, clicks, created_at, expires_at, clicks_left
+            FROM urls
+            WHERE short_code = %s
+        ''', (short_code,))
+
+        result = cur.fetchone()
+
     return dict(result) if result else None
 
+@timed_db_call
+def get_insert_watermark(database: int) -> int:
+    """Rows ever inserted into one database's urls; changes whenever an insert commits."""
+    with get_cursor(database=database) as cur:
+        cur.execute('''
+            SELECT COALESCE(SUM(total_inserted), 0)::BIGINT AS inserted
+            FROM url_stats
+        ''')
+        return cur.fetchone()['inserted']
+
+def get_insert_watermarks() -> List[int]:
+    """get_insert_watermark() for every database."""
+    return [get_insert_watermark(database) for database in _databases()]
+
+def iter_url_codes(database: int, after_id: int = 0, created_since=None,
+                   batch_size: int = 50000) -> Iterator[Tuple[int, str]]:
+    """Stream (id, short_code) for one database's rows with id > after_id.
+
+    ``created_since`` (a Unix timestamp) further limits the scan to recent
+    rows. Reads through a server-side cursor, so even a full scan runs in
+    constant memory.
+    """
+    with get_pool(database).connection() as conn:
+        conn.autocommit = False
+        with conn.cursor(name='url_codes') as cur:
+            cur.itersize = batch_size
+            if created_since is None:
+                cur.execute('''
+                    SELECT id, short_code
+                    FROM urls
+                    WHERE id > %s
+                ''', (after_id,))
+            else:
+                cur.execute('''
+                    SELECT id, short_code
+                    FROM urls
+                    WHERE id > %s AND created_at >= to_timestamp(%s)::timestamp
+                ''', (after_id, created_since))
+            for row in cur:
+                yield row['id'], row['short_code']
+
+def get_tombstones(database: int, since: float) -> List[str]:
+    """Codes deleted from one database at or after ``since`` (a Unix timestamp)."""
+    with get_cursor(database=database) as cur:
+        cur.execute('''
+            SELECT short_code FROM url_tombstones WHERE deleted_at >= to_timestamp(%s)
+        ''', (since,))
+        return [row['short_code'] for row in cur.fetchall()]
+
+def prune_tombstones(before: float) -> int:
+    """Drop tombstones older than ``before`` (a Unix timestamp) on every database."""
+    pruned = 0
+    for database in _databases():
+        with get_cursor(database=database) as cur:
+            cur.execute('DELETE FROM url_tombstones WHERE deleted_at < to_timestamp(%s)', (before,))
+            pruned += cur.rowcount
+    return pruned
+
+def iter_redirects(database: int, batch_size: int = 50000) -> Iterator[Tuple[str, str, Optional[datetime]]]:
+    """Stream (short_code, original_url, expires_at) for one database's live links.
+
+    Click-limited links are left out: every redirect to one has to spend a
+    click in the database anyway.
+    """
+    with get_pool(database).connection() as conn:
+        conn.autocommit = False
+        with conn.cursor(name='redirects') as cur:
+            cur.itersize = batch_size
+            cur.execute('''
+                SELECT short_code, original_url, expires_at
+                FROM urls
+                WHERE clicks_left IS NULL AND (expires_at IS NULL OR expires_at > now())
+            ''')
+            for row in cur:
+                yield row['short_code'], row['original_url'], row['expires_at']
+
+def iter_urls(created_from=None, created_to=None, min_clicks: Optional[int] = None,
+              batch_size: int = 10000) -> Iterator[Dict]:
+    """Stream every link matching the filters, oldest first within each database.
+
+    ``created_from`` is inclusive and ``created_to`` exclusive; naive times
+    are in the database's time zone, like created_at. Rows come through a
+    server-side cursor ``batch_size`` at a time, on a replica when one is
+    healthy, so memory stays flat however many links match.
+    """
+    conditions, params = [], []
+    if created_from is not None:
+        conditions.append('created_at >= %s::timestamptz::timestamp')
+        params.append(created_from)
+    if created_to is not None:
+        conditions.append('created_at < %s::timestamptz::timestamp')
+        params.append(created_to)
+    if min_clicks is not None:
+        conditions.append('clicks >= %s')
+        params.append(min_clicks)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+    for database in _databases():
+        with _connection(database, readonly=True) as conn:
+            conn.autocommit = False
+            with conn.cursor(name='url_export') as cur:
+                cur.itersize = batch_size
+                cur.execute(f'''
+                    SELECT short_code, original_url, clicks, created_at, expires_at, clicks_left
+                    FROM urls
+                    {where}
+                    ORDER BY created_at, id
+                ''', params)
+                for row in cur:
+                    yield dict(row)
+
+@timed_db_call
 def find_url_by_code(short_code: str) -> Optional[Dict]:
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
-    cur.execute('''
-        SELECT short_code, original_url, clicks, created_at
-        FROM urls
-        WHERE short_code = %s
-    ''', (short_code,))
-    
-    result = cur.fetchone()
-    cur.close()
-    conn.close()
-    
-    return dict(result) if result else None
+    """Look a code up on a replica when there is one.
+
+    A replica miss is re-checked on the primary, so a link created a moment
+    ago, by any worker, resolves before replication has caught up.
+    """
+    result = _select_url_by_code(short_code, readonly=True)
+    if result is None and replica_sets[shard_map.database_for(short_code)]:
+        result = _select_url_by_code(short_code, readonly=False)
+    return result
 
+@timed_db_call
+def use_url_click(short_code: str) -> Optional[str]:
+    """Spend one click of a click-limited link; returns its URL, or None once used up.
+
+    The check and the decrement are one statement on the primary, so
+    concurrent redirects from any number of workers can't overspend the
+    limit. The last click also expires the link, handing it to the purger.
+    """
+    with get_code_cursor(short_code) as cur:
+        cur.execute('''
+            UPDATE urls
+            SET clicks_left = clicks_left - 1,
+                expires_at = CASE WHEN clicks_left = 1 THEN LEAST(expires_at, now()) ELSE expires_at END
+            WHERE short_code = %s
+              AND clicks_left > 0
+              AND (expires_at IS NULL OR expires_at > now())
+            RETURNING original_url
+        ''', (short_code,))
+
+        result = cur.fetchone()
+
+    return result['original_url'] if result else None
+
+@timed_db_call
+def delete_expired_urls(database: int, expired_before, batch_size: int = 1000) -> List[str]:
+    """Delete up to batch_size links that expired before ``expired_before``.
+
+    Candidates come off idx_expires_at and rows another purger (or a
+    redirect) holds are skipped, so each batch is one short transaction that
+    never waits on a lock. Returns the deleted short codes.
+    """
+    with get_cursor(database=database) as cur:
+        cur.execute('''
+            DELETE FROM urls
+            WHERE short_code IN (
+                SELECT short_code
+                FROM urls
+                WHERE expires_at < %s
+                ORDER BY expires_at
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING short_code
+        ''', (expired_before, batch_size))
+
+        codes = [row['short_code'] for row in cur.fetchall()]
+
+    for short_code in codes:
+        resolution_cache.invalidate(short_code)
+    return codes
+
+@timed_db_call
 def get_all_urls() -> List[Dict]:
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
-    cur.execute('''
-        SELECT 
-            short_code, 
-            original_url, 
-            clicks, 
-            TO_CHAR(created_at, 'YYYY-MM-DD HH24:MI:SS') as created_at
-        FROM urls
-        ORDER BY created_at DESC
-    ''')
-    
-    results = cur.fetchall()
-    cur.close()
-    conn.close()
-    
+    results = []
+    for database in _databases():
+        with get_cursor(database=database, readonly=True) as cur:
+            cur.execute('''
+                SELECT
+                    short_code,
+                    original_url,
+                    clicks,
+                    TO_CHAR(created_at, 'YYYY-MM-DD HH24:MI:SS') as created_at
+                FROM urls
+                ORDER BY created_at DESC
+            ''')
+
+            results.extend(cur.fetchall())
+
+    if shard_map.databases > 1:
+        results.sort(key=lambda row: row['created_at'], reverse=True)
     return [dict(row) for row in results]
 
+@timed_db_call
+def get_urls_page(limit: int = 50, after: Optional[tuple] = None) -> Tuple[List[Dict], Optional[tuple]]:
+    """Return one page of URLs, newest first, using keyset pagination.
+
+    ``after`` is the (created_at, id) key of the last row of the previous page;
+    the returned key is the one to pass for the next page, or None at the end.
+    Each page is a single index range scan on idx_created_at_id per database
+    (merged across partitions by Postgres), however deep; with several
+    databases the per-shard pages are merged here.
+    """
+    results = []
+    for database in _databases():
+        with get_cursor(database=database, readonly=True) as cur:
+            if after is None:
+                cur.execute('''
+                    SELECT id, short_code, original_url, clicks, created_at
+                    FROM urls
+                    ORDER BY created_at DESC, id DESC
+                    LIMIT %s
+                ''', (limit + 1,))
+            else:
+                cur.execute('''
+                    SELECT id, short_code, original_url, clicks, created_at
+                    FROM urls
+                    WHERE (created_at, id) < (%s, %s)
+                    ORDER BY created_at DESC, id DESC
+                    LIMIT %s
+                ''', (after[0], after[1], limit + 1))
+
+            results.extend(cur.fetchall())
+
+    return _page_rows(results, limit)
+
+def _page_rows(results: List[Dict], limit: int) -> Tuple[List[Dict], Optional[tuple]]:
+    """Merge per-database pages of up to limit + 1 rows into one page and its next key."""
+    if shard_map.databases > 1:
+        results.sort(key=lambda row: (row['created_at'], row['id']), reverse=True)
+
+    has_more = len(results) > limit
+    results = results[:limit]
+    next_key = (results[-1]['created_at'], results[-1]['id']) if has_more else None
+
+    rows = []
+    for row in results:
+        row = dict(row)
+        del row['id']
+        row['created_at'] = row['created_at'].strftime('%Y-%m-%d %H:%M:%S')
+        rows.append(row)
+    return rows, next_key
+
+def _escape_like(text: str) -> str:
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def _search_condition(by: str, query: str) -> Tuple[str, list]:
+    if by == 'code':
+        return 'short_code LIKE %s', [_escape_like(query) + '%']
+    if by == 'domain':
+        # Reversed, 'example.com' and its subdomains are 'moc.elpmaxe' and
+        # everything under 'moc.elpmaxe.': two ranges of idx_url_host.
+        host = query[::-1]
+        return f'({URL_HOST_SQL} = %s OR {URL_HOST_SQL} LIKE %s)', [host, _escape_like(host + '.') + '%']
+    return 'original_url ILIKE %s', ['%' + _escape_like(query) + '%']
+
+@timed_db_call
+def search_urls(by: str, query: str, limit: int = 50,
+                after: Optional[tuple] = None) -> Tuple[List[Dict], Optional[tuple]]:
+    """One page of links matching a search, newest first; paged like get_urls_page.
+
+    ``by`` is one of SEARCH_FIELDS: 'url' finds query anywhere in
+    original_url (case-insensitive, idx_original_url_trgm), 'domain' finds
+    links to a host or its subdomains (idx_url_host) and 'code' finds short
+    codes starting with query (idx_short_code_prefix).
+    """
+    if by not in SEARCH_FIELDS:
+        raise ValueError(f"Unknown search field '{by}'")
+    condition, params = _search_condition(by, query)
+    if after is not None:
+        condition += ' AND (created_at, id) < (%s, %s)'
+        params += [after[0], after[1]]
+
+    results = []
+    for database in _databases():
+        with get_cursor(database=database, readonly=True) as cur:
+            cur.execute(f'''
+                SELECT id, short_code, original_url, clicks, created_at
+                FROM urls
+                WHERE {condition}
+                ORDER BY created_at DESC, id DESC
+                LIMIT %s
+            ''', params + [limit + 1])
+            results.extend(cur.fetchall())
+
+    return _page_rows(results, limit)
+
+@timed_db_call
 def increment_url_clicks(short_code: str):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
-    cur.execute('''
-        UPDATE urls
-        SET clicks = clicks + 1
-        WHERE short_code = %s
-    ''', (short_code,))
-    
-    conn.commit()
-    cur.close()
-    conn.close()
+    with get_code_cursor(short_code) as cur:
+        cur.execute('''
+            UPDATE urls
+            SET clicks = clicks + 1
+            WHERE short_code = %s
+        ''', (short_code,))
+
+@timed_db_call
+def increment_url_clicks_batch(counts: Dict[str, int]) -> int:
+    """Apply many click increments in one UPDATE per shard. Returns rows updated."""
+    if not counts:
+        return 0
+
+    # Sorted so concurrent flushes from different workers lock rows in the
+    # same order and can't deadlock.
+    updated = 0
+    for database, rows in shard_map.group_by_database(sorted(counts.items())).items():
+        with get_cursor(database=database) as cur:
+            execute_values(cur, '''
+                UPDATE urls
+                SET clicks = urls.clicks + v.n
+                FROM (VALUES %s) AS v(short_code, n)
+                WHERE urls.short_code = v.short_code
+            ''', rows, template='(%s, %s::integer)', page_size=len(rows))
+
+            updated += cur.rowcount
+
+    return updated
+
+@timed_db_call
+def upsert_click_rollups(counts: Dict[tuple, int]) -> None:
+    """Add {(short_code, hour, referrer, country): clicks} to the hourly and daily rollups."""
+    if not counts:
+        return
+
+    daily: Dict[tuple, int] = {}
+    for (short_code, hour, referrer, country), clicks in counts.items():
+        key = (short_code, hour.replace(hour=0), referrer, country)
+        daily[key] = daily.get(key, 0) + clicks
 
+    with get_cursor(transaction=True) as cur:
+        for table, rows in ((ROLLUP_TABLES['hour'], counts), (ROLLUP_TABLES['day'], daily)):
+            # Sorted to take row locks in a consistent order across workers.
+            values = sorted((*key, clicks) for key, clicks in rows.items())
+            execute_values(cur, f'''
+                INSERT INTO {table} (short_code, bucket_start, referrer, country, clicks)
+                VALUES %s
+                ON CONFLICT (short_code, bucket_start, referrer, country)
+                DO UPDATE SET clicks = {table}.clicks + EXCLUDED.clicks
+            ''', values, page_size=1000)
+
+@timed_db_call
+def get_click_analytics(short_code: str, granularity: str, since, until, top: int = 10) -> Dict:
+    """Click series and top referrers/countries for one link, read from the rollups."""
+    table = ROLLUP_TABLES[granularity]
+    params = (short_code, since, until)
+    where = 'WHERE short_code = %s AND bucket_start >= %s AND bucket_start < %s'
+
+    with get_cursor(readonly=True) as cur:
+        cur.execute(f'''
+            SELECT bucket_start, SUM(clicks)::BIGINT AS clicks
+            FROM {table}
+            {where}
+            GROUP BY bucket_start
+            ORDER BY bucket_start
+        ''', params)
+        series = [dict(row) for row in cur.fetchall()]
+
+        breakdowns = {}
+        for dimension in ('referrer', 'country'):
+            cur.execute(f'''
+                SELECT {dimension}, SUM(clicks)::BIGINT AS clicks
+                FROM {table}
+                {where}
+                GROUP BY {dimension}
+                ORDER BY clicks DESC
+                LIMIT %s
+            ''', params + (top,))
+            breakdowns[dimension] = [dict(row) for row in cur.fetchall()]
+
+    return {
+        'series': series,
+        'referrers': breakdowns['referrer'],
+        'countries': breakdowns['country'],
+    }
+
+@timed_db_call
 def get_stats() -> Dict:
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
-    cur.execute('''
-        SELECT 
-            COUNT(*) as total_urls,
-            COALESCE(SUM(clicks), 0) as total_clicks
-        FROM urls
-    ''')
-    
-    result = cur.fetchone()
-    cur.close()
-    conn.close()
-    
-    return dict(result)
+    """Totals from the url_stats counters maintained by triggers on urls, summed over shards."""
+    totals = {'total_urls': 0, 'total_clicks': 0}
+    for database in _databases():
+        with get_cursor(database=database, readonly=True) as cur:
+            cur.execute('''
+                SELECT
+                    COALESCE(SUM(total_urls), 0)::BIGINT as total_urls,
+                    COALESCE(SUM(total_clicks), 0)::BIGINT as total_clicks
+                FROM url_stats
+            ''')
+
+            for key, value in cur.fetchone().items():
+                totals[key] += value
 
+    return totals
+
+@timed_db_call
 def delete_url(short_code: str) -> bool:
-    """Delete a URL by short code"""
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
-    cur.execute('''
-        DELETE FROM urls
-        WHERE short_code = %s
-    ''', (short_code,))
-    
-    deleted = cur.rowcount > 0
-    conn.commit()
-    cur.close()
-    conn.close()
-    
+    """Delete a URL by short code.
+
+    A tombstone is written in the same transaction: this process's redirect
+    snapshot drops the code at once, every other one at its next tombstone
+    poll.
+    """
+    with get_code_cursor(short_code, transaction=True) as cur:
+        cur.execute('''
+            DELETE FROM urls
+            WHERE short_code = %s
+        ''', (short_code,))
+
+        deleted = cur.rowcount > 0
+        if deleted:
+            cur.execute('''
+                INSERT INTO url_tombstones (short_code) VALUES (%s)
+                ON CONFLICT (short_code) DO UPDATE SET deleted_at = now()
+            ''', (short_code,))
+
+    resolution_cache.invalidate(short_code)
+    if deleted:
+        # Imported here: redirect_snapshot only loads db when it needs it.
+        from redirect_snapshot import redirect_snapshot
+        redirect_snapshot.forget(short_code)
     return deleted
 
+@timed_db_call
 def get_url_stats(short_code: str) -> Optional[Dict]:
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
-    cur.execute('''
-        SELECT 
-            short_code, 
-            original_url, 
-            clicks, 
-            created_at,
-            EXTRACT(EPOCH FROM (CURRENT_TIMESTAMP - created_at)) / 86400 as age_days
-        FROM urls
-        WHERE short_code = %s
-    ''', (short_code,))
-    
-    result = cur.fetchone()
-    cur.close()
-    conn.close()
-    
-    return dict(result) if result else None
\ No newline at end of file
+    with get_code_cursor(short_code, readonly=True) as cur:
+        cur.execute('''
+            SELECT 
+                short_code, 
+                original_url, 
+                clicks, 
+                created_at,
+                EXTRACT(EPOCH FROM (CURRENT_TIMESTAMP - created_at)) / 86400 as age_days
+            FROM urls
+            WHERE short_code = %s
+        ''', (short_code,))
+
+        result = cur.fetchone()
+
+    return dict(result) if result else None
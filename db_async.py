@@ -0,0 +1,120 @@
+import os
+import time
+from typing import Dict, List, Optional
+
+import asyncpg
+
+from db import replica_sets, shard_map
+from metrics import record_db_phase
+
+_pools: List[asyncpg.Pool] = []
+_replica_pools: Dict[str, asyncpg.Pool] = {}
+
+
+async def _create_pool(dsn: str) -> asyncpg.Pool:
+    return await asyncpg.create_pool(
+        dsn,
+        min_size=int(os.getenv('ASYNC_DB_POOL_MIN_SIZE', '1')),
+        max_size=int(os.getenv('ASYNC_DB_POOL_MAX_SIZE', '20')),
+        # asyncpg can't cap a connection's age, only how long it sits idle.
+        max_inactive_connection_lifetime=float(os.getenv('ASYNC_DB_POOL_MAX_IDLE', '300')),
+        command_timeout=float(os.getenv('DB_POOL_TIMEOUT', '5')),
+    )
+
+
+async def init_pool() -> List[asyncpg.Pool]:
+    """Create one asyncpg pool per database shard and replica; sized per worker like db_pool.
+
+    A replica that is down at startup is skipped rather than failing the
+    worker; its reads go to the primary.
+    """
+    global _pools
+    if not _pools:
+        _pools = [await _create_pool(url) for url in shard_map.database_urls]
+        for replicas in replica_sets:
+            for dsn in replicas.dsns:
+                try:
+                    _replica_pools[dsn] = await _create_pool(dsn)
+                except (OSError, asyncpg.PostgresError) as e:
+                    print(f"Replica unavailable at startup: {e}")
+    return _pools
+
+
+async def close_pool() -> None:
+    global _pools
+    pools, _pools = _pools + list(_replica_pools.values()), []
+    _replica_pools.clear()
+    for pool in pools:
+        await pool.close()
+
+
+def _get_pool(database: int = 0) -> asyncpg.Pool:
+    if not _pools:
+        raise RuntimeError("Async database pool is not initialized")
+    return _pools[database]
+
+
+async def _fetch_url(pool: asyncpg.Pool, short_code: str) -> Optional[Dict]:
+    started = time.perf_counter()
+    row = await pool.fetchrow('''
+        SELECT short_code, original_url, clicks, created_at, expires_at, clicks_left
+        FROM urls
+        WHERE short_code = $1
+    ''', short_code)
+    record_db_phase('query', time.perf_counter() - started)
+
+    return dict(row) if row else None
+
+
+async def find_url_by_code(short_code: str) -> Optional[Dict]:
+    """Same routing as db.find_url_by_code: a replica first, the primary on a miss."""
+    database = shard_map.database_for(short_code)
+    replicas = replica_sets[database]
+    replica = replicas.choose()
+
+    if replica in _replica_pools:
+        try:
+            row = await _fetch_url(_replica_pools[replica], short_code)
+        except (OSError, asyncpg.PostgresConnectionError, asyncpg.InterfaceError) as e:
+            replicas.mark_failed(replica, e)
+        else:
+            if row:
+                return row
+
+    return await _fetch_url(_get_pool(database), short_code)
+
+
+async def use_url_click(short_code: str) -> Optional[str]:
+    """Same as db.use_url_click, on the primary of the code's shard."""
+    started = time.perf_counter()
+    url = await _get_pool(shard_map.database_for(short_code)).fetchval('''
+        UPDATE urls
+        SET clicks_left = clicks_left - 1,
+            expires_at = CASE WHEN clicks_left = 1 THEN LEAST(expires_at, now()) ELSE expires_at END
+        WHERE short_code = $1
+          AND clicks_left > 0
+          AND (expires_at IS NULL OR expires_at > now())
+        RETURNING original_url
+    ''', short_code)
+    record_db_phase('query', time.perf_counter() - started)
+    return url
+
+
+async def ping() -> bool:
+    for database in range(len(_pools) or 1):
+        await _get_pool(database).fetchval('SELECT 1')
+    return True
+
+
+def get_pool_stats() -> Dict:
+    if not _pools:
+        return {}
+    pools = _pools + list(_replica_pools.values())
+    return {
+        'size': sum(pool.get_size() for pool in pools),
+        'idle': sum(pool.get_idle_size() for pool in pools),
+        'min_size': sum(pool.get_min_size() for pool in pools),
+        'max_size': sum(pool.get_max_size() for pool in pools),
+        'databases': len(_pools),
+        'replicas': len(_replica_pools),
+    }
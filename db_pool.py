@@ -0,0 +1,300 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+import psycopg2
+import psycopg2.extensions
+from psycopg2.extras import RealDictCursor
+
+from metrics import record_db_phase
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class CountingCursor(RealDictCursor):
+    """RealDictCursor that counts statements sent to the server, process-wide."""
+
+    queries = 0
+    _queries_lock = threading.Lock()
+
+    @classmethod
+    def _count(cls) -> None:
+        with cls._queries_lock:
+            cls.queries += 1
+
+    def execute(self, query, vars=None):
+        CountingCursor._count()
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            record_db_phase('query', time.perf_counter() - started)
+
+    def executemany(self, query, vars_list):
+        CountingCursor._count()
+        started = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            record_db_phase('query', time.perf_counter() - started)
+
+    def copy_expert(self, sql, file, size=8192):
+        CountingCursor._count()
+        started = time.perf_counter()
+        try:
+            return super().copy_expert(sql, file, size)
+        finally:
+            record_db_phase('query', time.perf_counter() - started)
+
+
+class _PooledConnection:
+    __slots__ = ('conn', 'created_at', 'last_used')
+
+    def __init__(self, conn):
+        now = time.monotonic()
+        self.conn = conn
+        self.created_at = now
+        self.last_used = now
+
+
+class ConnectionPool:
+    """Thread-safe pool of psycopg2 connections.
+
+    Idle connections are reused LIFO so the hottest ones stay warm. A
+    connection that has been idle longer than ``health_check_interval`` is
+    pinged before being handed out, and connections older than
+    ``max_lifetime`` or found broken are closed and replaced.
+    """
+
+    def __init__(
+        self,
+        dsn: str,
+        min_size: int = 1,
+        max_size: int = 10,
+        timeout: float = 5.0,
+        max_lifetime: float = 1800.0,
+        health_check_interval: float = 30.0,
+    ):
+        if max_size < 1 or min_size < 0 or min_size > max_size:
+            raise ValueError("Invalid pool size configuration")
+
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.health_check_interval = health_check_interval
+
+        self._idle: List[_PooledConnection] = []
+        self._in_use: Dict[int, _PooledConnection] = {}
+        self._opening = 0
+        self._cond = threading.Condition()
+        self._closed = False
+
+        self._hits = 0
+        self._misses = 0
+        self._waits = 0
+        self._wait_time = 0.0
+        self._timeouts = 0
+        self._recycled = 0
+        self._health_checks = 0
+
+        for _ in range(min_size):
+            self._idle.append(self._open())
+
+    def _open(self) -> _PooledConnection:
+        started = time.perf_counter()
+        conn = psycopg2.connect(self.dsn, cursor_factory=CountingCursor)
+        conn.autocommit = True
+        record_db_phase('connect', time.perf_counter() - started)
+        return _PooledConnection(conn)
+
+    def _discard(self, pooled: _PooledConnection) -> None:
+        try:
+            pooled.conn.close()
+        except Exception:
+            pass
+
+    def _is_healthy(self, pooled: _PooledConnection) -> bool:
+        conn = pooled.conn
+        if conn.closed:
+            return False
+        if time.monotonic() - pooled.created_at > self.max_lifetime:
+            return False
+        if time.monotonic() - pooled.last_used < self.health_check_interval:
+            return True
+
+        self._health_checks += 1
+        try:
+            # A plain cursor, so pool checks don't count towards request queries.
+            with conn.cursor(cursor_factory=psycopg2.extensions.cursor) as cur:
+                cur.execute('SELECT 1')
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _checkout(self) -> _PooledConnection:
+        deadline = time.monotonic() + self.timeout
+        wait_started: Optional[float] = None
+
+        while True:
+            with self._cond:
+                if self._closed:
+                    raise PoolTimeout("Connection pool is closed")
+
+                if self._idle:
+                    pooled = self._idle.pop()
+                    self._in_use[id(pooled)] = pooled
+                    reuse = True
+                elif len(self._in_use) + self._opening < self.max_size:
+                    self._opening += 1
+                    reuse = False
+                else:
+                    if wait_started is None:
+                        wait_started = time.monotonic()
+                        self._waits += 1
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        self._wait_time += time.monotonic() - wait_started
+                        raise PoolTimeout(
+                            f"Timed out after {self.timeout}s waiting for a database connection"
+                        )
+                    self._cond.wait(remaining)
+                    continue
+
+                if wait_started is not None:
+                    waited = time.monotonic() - wait_started
+                    self._wait_time += waited
+                    record_db_phase('wait', waited)
+                    wait_started = None
+
+            if reuse:
+                if self._is_healthy(pooled):
+                    with self._cond:
+                        self._hits += 1
+                    return pooled
+                self._discard(pooled)
+                with self._cond:
+                    self._in_use.pop(id(pooled), None)
+                    self._recycled += 1
+                    self._cond.notify()
+                continue
+
+            try:
+                pooled = self._open()
+            except Exception:
+                with self._cond:
+                    self._opening -= 1
+                    self._cond.notify()
+                raise
+
+            with self._cond:
+                self._opening -= 1
+                self._misses += 1
+                self._in_use[id(pooled)] = pooled
+            return pooled
+
+    def _checkin(self, pooled: _PooledConnection, broken: bool) -> None:
+        conn = pooled.conn
+        if not broken and not conn.closed:
+            status = conn.get_transaction_status()
+            if status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    broken = True
+            if not conn.autocommit and not broken:
+                try:
+                    conn.autocommit = True
+                except psycopg2.Error:
+                    broken = True
+
+        with self._cond:
+            self._in_use.pop(id(pooled), None)
+            if broken or conn.closed or self._closed:
+                self._discard(pooled)
+                if broken:
+                    self._recycled += 1
+            else:
+                pooled.last_used = time.monotonic()
+                self._idle.append(pooled)
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        """Check out a connection for the duration of the block.
+
+        Connections are in autocommit mode; callers that need a multi-statement
+        transaction should set ``conn.autocommit = False`` and commit themselves.
+        Anything left uncommitted is rolled back on return to the pool.
+        """
+        pooled = self._checkout()
+        broken = False
+        try:
+            yield pooled.conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        finally:
+            self._checkin(pooled, broken)
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._cond.notify_all()
+        for pooled in idle:
+            self._discard(pooled)
+
+    def stats(self) -> Dict:
+        with self._cond:
+            checkouts = self._hits + self._misses
+            return {
+                'size': len(self._idle) + len(self._in_use),
+                'idle': len(self._idle),
+                'in_use': len(self._in_use),
+                'max_size': self.max_size,
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': round(self._hits / checkouts, 4) if checkouts else 0.0,
+                'waits': self._waits,
+                'wait_time_total': round(self._wait_time, 6),
+                'timeouts': self._timeouts,
+                'recycled': self._recycled,
+                'health_checks': self._health_checks,
+                'queries': CountingCursor.queries,
+            }
+
+
+def pool_size_from_env() -> Dict:
+    """Read per-worker pool sizing from the environment.
+
+    DB_POOL_MAX_SIZE caps each worker process. If it is unset and
+    DB_POOL_TOTAL_MAX_SIZE is given, the total is split across WEB_CONCURRENCY
+    workers so the whole deployment stays under the server's connection limit.
+    """
+    workers = max(int(os.getenv('WEB_CONCURRENCY', '1')), 1)
+    max_size: Optional[str] = os.getenv('DB_POOL_MAX_SIZE')
+    total = os.getenv('DB_POOL_TOTAL_MAX_SIZE')
+
+    if max_size is not None:
+        per_worker = int(max_size)
+    elif total is not None:
+        per_worker = max(int(total) // workers, 1)
+    else:
+        per_worker = 10
+
+    min_size = min(int(os.getenv('DB_POOL_MIN_SIZE', '1')), per_worker)
+
+    return {
+        'min_size': min_size,
+        'max_size': per_worker,
+        'timeout': float(os.getenv('DB_POOL_TIMEOUT', '5')),
+        'max_lifetime': float(os.getenv('DB_POOL_MAX_LIFETIME', '1800')),
+        'health_check_interval': float(os.getenv('DB_POOL_HEALTH_CHECK_INTERVAL', '30')),
+    }
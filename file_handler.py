@@ -1,33 +1,660 @@
+import heapq
 import json
 import os
-from typing import List, Dict, Optional
+import threading
+import time
+import zlib
+from bisect import bisect_left, bisect_right
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: single process, the thread lock is enough.
+    fcntl = None
+
 from constants import DATA_FILE
+from storage import StorageBackend
+from url_cache import resolution_cache
+from url_utils import url_digest, url_host
+
+FSYNC_POLICIES = ('always', 'interval', 'never')
+
+
+def _encode(record: Dict) -> bytes:
+    payload = json.dumps(record, separators=(',', ':')).encode('utf-8')
+    return b'%08x %s\n' % (zlib.crc32(payload), payload)
+
 
-def read_urls() -> List[Dict]:
-    if not os.path.exists(DATA_FILE):
-        return []
-    
+def _decode(line: bytes) -> Optional[Dict]:
+    """The record on one log line, or None if it is torn or corrupt."""
+    if len(line) < 10 or line[8:9] != b' ' or not line.endswith(b'\n'):
+        return None
+    payload = line[9:-1]
     try:
-        with open(DATA_FILE, 'r') as f:
-            return json.load(f)
-    except (json.JSONDecodeError, FileNotFoundError):
-        return []
-    
-def write_urls(urls: List[Dict]) -> None:
-    with open(DATA_FILE, 'w') as f:
-        json.dump(urls, f, indent=2)
-
-def find_url_by_code(short_code: str) -> Optional[Dict]:
-    urls = read_urls()
-    for url_entry in urls:
-        if url_entry['short_code'] == short_code:
-            return url_entry
-    return None
-
-def increment_clicks(short_code: str) -> None:
-    urls = read_urls()
-    for url_entry in urls:
-        if url_entry['short_code'] == short_code:
-            url_entry['clicks'] += 1
-            write_urls(urls)
-            break
\ No newline at end of file
+        if int(line[:8], 16) != zlib.crc32(payload):
+            return None
+        return json.loads(payload)
+    except ValueError:
+        return None
+
+
+def _format_created_at(created_at: str) -> str:
+    return datetime.fromisoformat(created_at).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _expired(entry: Dict, now: datetime) -> bool:
+    return entry.get('expires_at') is not None and datetime.fromisoformat(entry['expires_at']) <= now
+
+
+def _expiry_key(entry: Dict) -> Tuple[float, str]:
+    return datetime.fromisoformat(entry['expires_at']).timestamp(), entry['short_code']
+
+
+class FileBackend(StorageBackend):
+    """Links in an append-only log on local disk, indexed in memory.
+
+    Every change is one appended line: ``<crc32> <json>``. Creating a link
+    appends its entry, a flush of buffered clicks appends one line of
+    counts, a purge appends the deleted codes. Replaying the log rebuilds a
+    hash index of short_code -> entry (plus url_hash -> short_code for
+    dedupe), so lookups never touch the disk.
+
+    Durability follows ``fsync``: 'always' syncs every append, 'interval'
+    at most every ``fsync_interval`` seconds (a background thread syncs the
+    tail of a burst), 'never' leaves it to the OS; close() syncs too.
+    A crash can leave a torn last line; it fails its checksum and is cut off
+    the next time the log is opened. Once the log holds more than
+    ``compact_ratio`` records per live link (and at least
+    ``compact_min_records``), it is rewritten with one record per link and
+    swapped in atomically.
+
+    Several processes can share a log: appends happen under a lock file,
+    and each process replays what others appended (or reloads after their
+    compaction) before it reads. Reads check the log at most every
+    ``refresh_interval`` seconds, except that a code lookup that misses
+    always checks, so a link created by another process never 404s.
+    """
+
+    name = 'file'
+
+    def __init__(
+        self,
+        path: str,
+        fsync: str = 'interval',
+        fsync_interval: float = 1.0,
+        compact_ratio: float = 2.0,
+        compact_min_records: int = 10000,
+        refresh_interval: float = 0.1,
+        legacy_path: Optional[str] = DATA_FILE,
+    ):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"STORAGE_FSYNC must be one of {', '.join(FSYNC_POLICIES)}")
+
+        self.path = path
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.compact_ratio = compact_ratio
+        self.compact_min_records = compact_min_records
+        self.refresh_interval = refresh_interval
+        self.legacy_path = legacy_path
+
+        self._lock = threading.RLock()
+        self._pid: Optional[int] = None
+        self._fd: Optional[int] = None
+        self._lock_file = None
+        self._inode: Optional[int] = None
+        self._offset = 0
+        self._last_fsync = 0.0
+        self._unsynced = False
+        self._flusher_pid: Optional[int] = None
+        self._flusher_stop = threading.Event()
+        self._caught_up_at = 0.0
+
+        self._reset()
+        self._compactions = 0
+        self._recovered_bytes = 0
+
+    def _reset(self) -> None:
+        self._entries: Dict[str, Dict] = {}
+        self._by_hash: Dict[bytes, str] = {}
+        # (expiry timestamp, short_code), soonest first. Links deleted or
+        # given a new expiry since are skipped when they reach the top.
+        self._expiring: List[Tuple[float, str]] = []
+        # Row ids in append order with their codes, for newest-first paging.
+        # Positions of deleted links are pruned once they are half the list.
+        self._ids: List[int] = []
+        self._codes: List[str] = []
+        self._dead_ids = 0
+        self._next_row_id = 1
+        self._next_code_id = 1
+        self._records = 0
+        self._total_clicks = 0
+
+    # -- replay -----------------------------------------------------------
+
+    def _apply(self, record: Dict) -> None:
+        op = record['op']
+        if op == 'put':
+            entry = dict(record)
+            del entry['op']
+            entry['url_hash'] = bytes.fromhex(entry['url_hash']) if entry.get('url_hash') else None
+            if entry['short_code'] in self._entries:
+                self._dead_ids += 1
+            self._entries[entry['short_code']] = entry
+            if entry['url_hash'] is not None:
+                self._by_hash.setdefault(entry['url_hash'], entry['short_code'])
+            if entry.get('expires_at') is not None:
+                heapq.heappush(self._expiring, _expiry_key(entry))
+            self._ids.append(entry['id'])
+            self._codes.append(entry['short_code'])
+            self._next_row_id = max(self._next_row_id, entry['id'] + 1)
+            self._total_clicks += entry['clicks']
+        elif op == 'clicks':
+            for short_code, count in record['counts'].items():
+                entry = self._entries.get(short_code)
+                if entry is not None:
+                    entry['clicks'] += count
+                    self._total_clicks += count
+        elif op == 'use':
+            entry = self._entries.get(record['short_code'])
+            if entry is not None:
+                entry['clicks_left'] -= 1
+                if entry['clicks_left'] == 0 and not _expired(entry, datetime.fromisoformat(record['at'])):
+                    entry['expires_at'] = record['at']
+                    heapq.heappush(self._expiring, _expiry_key(entry))
+        elif op == 'del':
+            for short_code in record['codes']:
+                entry = self._entries.pop(short_code, None)
+                if entry is None:
+                    continue
+                self._total_clicks -= entry['clicks']
+                self._dead_ids += 1
+                if entry['url_hash'] is not None and self._by_hash.get(entry['url_hash']) == short_code:
+                    del self._by_hash[entry['url_hash']]
+            if self._dead_ids > max(1000, len(self._ids) // 2):
+                self._prune_ids()
+        elif op == 'ids':
+            self._next_code_id = max(self._next_code_id, record['next'])
+        self._records += 1
+
+    def _prune_ids(self) -> None:
+        """Drop the paging positions of links that were deleted or rewritten."""
+        live = [
+            position for position, short_code in enumerate(self._codes)
+            if short_code in self._entries and self._entries[short_code]['id'] == self._ids[position]
+        ]
+        self._ids = [self._ids[position] for position in live]
+        self._codes = [self._codes[position] for position in live]
+        self._dead_ids = 0
+
+    def _replay(self, exclusive: bool) -> None:
+        """Apply records appended since the last replay.
+
+        With the lock held exclusively, a torn or corrupt tail (a crashed
+        append) is cut off so the next append starts on a clean line.
+        """
+        with open(self.path, 'rb') as f:
+            f.seek(self._offset)
+            for line in f:
+                record = _decode(line)
+                if record is None:
+                    break
+                self._apply(record)
+                self._offset += len(line)
+            size = f.seek(0, os.SEEK_END)
+
+        if exclusive and size > self._offset:
+            print(f"Discarding {size - self._offset} bytes of incomplete records at the end of {self.path}")
+            self._recovered_bytes += size - self._offset
+            os.truncate(self.path, self._offset)
+
+    def _open(self) -> None:
+        self._close_fd()
+        self._reset()
+        self._offset = 0
+        # Whatever the old descriptor didn't sync was either compacted into
+        # the new (synced) file or belongs to an unlinked one.
+        self._unsynced = False
+        self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self._inode = os.fstat(self._fd).st_ino
+
+    def _close_fd(self) -> None:
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def _ensure_process(self) -> None:
+        pid = os.getpid()
+        if self._pid != pid:
+            # Descriptors and locks inherited across a fork belong to the parent.
+            self._fd = None
+            self._lock_file = open(self.path + '.lock', 'a+b')
+            self._pid = pid
+            self._inode = None
+
+    def _catch_up(self, exclusive: bool = False) -> None:
+        """Bring the index up to date with the log on disk."""
+        self._ensure_process()
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            stat = None
+
+        if stat is None and not exclusive:
+            # Create the log (and import legacy data) under the lock.
+            with self._file_lock():
+                pass
+        elif stat is None or stat.st_ino != self._inode:
+            self._open()
+            self._replay(exclusive)
+        elif stat.st_size != self._offset:
+            self._replay(exclusive)
+        self._caught_up_at = time.monotonic()
+
+    @contextmanager
+    def _file_lock(self):
+        """Exclusive access to the log for one append (or compaction) across processes."""
+        with self._lock:
+            self._ensure_process()
+            if fcntl is not None:
+                fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                self._catch_up(exclusive=True)
+                if self._records == 0 and self._offset == 0:
+                    self._import_legacy()
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_UN)
+
+    @contextmanager
+    def _reading(self):
+        """Hold the index for a read, catching up first if it was last done refresh_interval ago."""
+        with self._lock:
+            if self._pid != os.getpid() or \
+                    time.monotonic() - self._caught_up_at >= self.refresh_interval:
+                self._catch_up()
+            yield
+
+    def _append(self, *records: Dict) -> None:
+        """Write records as one append; the file lock must be held."""
+        data = b''.join(_encode(record) for record in records)
+        os.write(self._fd, data)
+        self._offset += len(data)
+        for record in records:
+            self._apply(record)
+
+        self._unsynced = True
+        if self.fsync == 'always' or (self.fsync == 'interval' and time.monotonic() - self._last_fsync >= self.fsync_interval):
+            self._sync()
+        elif self.fsync == 'interval':
+            self._start_flusher()
+
+        if self._records >= self.compact_min_records and self._records > self.compact_ratio * max(1, len(self._entries)):
+            self._compact()
+
+    def _sync(self) -> None:
+        if self._unsynced and self._fd is not None:
+            os.fsync(self._fd)
+            self._unsynced = False
+        self._last_fsync = time.monotonic()
+
+    def _start_flusher(self) -> None:
+        """Start this process's thread that syncs appends left over from a burst."""
+        pid = os.getpid()
+        if self._flusher_pid == pid:
+            return
+        self._flusher_pid = pid
+        self._flusher_stop = threading.Event()
+        threading.Thread(target=self._flush, args=(self._flusher_stop,), name='file-log-fsync', daemon=True).start()
+
+    def _flush(self, stop: threading.Event) -> None:
+        while not stop.wait(self.fsync_interval):
+            try:
+                with self._lock:
+                    if self._pid == os.getpid() and time.monotonic() - self._last_fsync >= self.fsync_interval:
+                        self._sync()
+            except OSError as e:
+                print(f"Failed to fsync {self.path}: {e}")
+
+    # -- compaction and recovery -----------------------------------------
+
+    def _snapshot_records(self) -> List[Dict]:
+        records = [{'op': 'ids', 'next': self._next_code_id}]
+        for row_id, short_code in zip(self._ids, self._codes):
+            entry = self._entries.get(short_code)
+            if entry is None or entry['id'] != row_id:
+                continue
+            record = dict(entry, op='put')
+            record['url_hash'] = entry['url_hash'].hex() if entry['url_hash'] is not None else None
+            records.append(record)
+        return records
+
+    def _compact(self) -> None:
+        """Rewrite the log as one record per live link; the file lock must be held."""
+        started = time.monotonic()
+        before = self._offset
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            for record in self._snapshot_records():
+                f.write(_encode(record))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+        self._open()
+        self._replay(exclusive=True)
+        self._compactions += 1
+        print(f"Compacted {self.path}: {before} -> {self._offset} bytes in {time.monotonic() - started:.2f}s")
+
+    def compact(self) -> None:
+        with self._file_lock():
+            self._compact()
+
+    def _import_legacy(self) -> None:
+        """Seed an empty log from the old whole-file urls.json, once."""
+        if not self.legacy_path or not os.path.exists(self.legacy_path):
+            return
+        try:
+            with open(self.legacy_path, 'r') as f:
+                legacy = json.load(f)
+        except (json.JSONDecodeError, OSError) as e:
+            print(f"Could not import {self.legacy_path}: {e}")
+            return
+
+        records = []
+        row_id = self._next_row_id
+        seen_hashes = set()
+        for entry in sorted(legacy, key=lambda entry: entry.get('created_at', '')):
+            url_hash = url_digest(entry['original_url'])
+            records.append({
+                'op': 'put',
+                'id': row_id,
+                'short_code': entry['short_code'],
+                'original_url': entry['original_url'],
+                'clicks': entry.get('clicks', 0),
+                'created_at': entry.get('created_at') or datetime.now().isoformat(),
+                'url_hash': url_hash.hex() if url_hash not in seen_hashes else None,
+                'expires_at': None,
+                'clicks_left': None,
+            })
+            seen_hashes.add(url_hash)
+            row_id += 1
+
+        if records:
+            self._append(*records)
+            print(f"Imported {len(records)} URLs from {self.legacy_path} into {self.path}")
+
+    # -- StorageBackend ---------------------------------------------------
+
+    def _public(self, entry: Dict) -> Dict:
+        return {
+            'short_code': entry['short_code'],
+            'original_url': entry['original_url'],
+            'clicks': entry['clicks'],
+            'created_at': datetime.fromisoformat(entry['created_at']),
+            'expires_at': datetime.fromisoformat(entry['expires_at']) if entry.get('expires_at') else None,
+            'clicks_left': entry.get('clicks_left'),
+        }
+
+    def init(self) -> None:
+        with self._file_lock():
+            pass
+
+    def ping(self) -> bool:
+        with self._reading():
+            return True
+
+    def allocate_id_block(self, size: int) -> int:
+        with self._file_lock():
+            start = self._next_code_id
+            self._append({'op': 'ids', 'next': start + size})
+            return start
+
+    def find_url_by_code(self, short_code: str) -> Optional[Dict]:
+        with self._reading():
+            entry = self._entries.get(short_code)
+            if entry is None:
+                # Another process may have just created it.
+                self._catch_up()
+                entry = self._entries.get(short_code)
+            return self._public(entry) if entry is not None else None
+
+    def find_urls_by_hashes(self, url_hashes: List[bytes]) -> List[Dict]:
+        with self._reading():
+            found = []
+            for url_hash in set(url_hashes):
+                short_code = self._by_hash.get(url_hash)
+                if short_code is not None:
+                    found.append(dict(self._public(self._entries[short_code]), url_hash=url_hash))
+            return found
+
+    def _new_entry(self, short_code: str, original_url: str, url_hash: Optional[bytes],
+                   expires_at=None, max_clicks: Optional[int] = None, row_id: Optional[int] = None) -> Dict:
+        return {
+            'op': 'put',
+            'id': row_id if row_id is not None else self._next_row_id,
+            'short_code': short_code,
+            'original_url': original_url,
+            'clicks': 0,
+            'created_at': datetime.now().isoformat(),
+            'url_hash': url_hash.hex() if url_hash is not None else None,
+            'expires_at': expires_at.astimezone(timezone.utc).isoformat() if expires_at is not None else None,
+            'clicks_left': max_clicks,
+        }
+
+    def get_or_create_url_entry(self, short_code: str, original_url: str) -> Optional[Dict]:
+        url_hash = url_digest(original_url)
+        with self._file_lock():
+            existing = self._by_hash.get(url_hash)
+            if existing is not None:
+                return self._public(self._entries[existing])
+            if short_code in self._entries:
+                return None
+            self._append(self._new_entry(short_code, original_url, url_hash))
+            result = self._public(self._entries[short_code])
+
+        resolution_cache.invalidate(short_code)
+        return result
+
+    def insert_url_entries(self, rows: List[tuple], expires_at=None, max_clicks: Optional[int] = None) -> List[Dict]:
+        if not rows:
+            return []
+
+        with self._file_lock():
+            records = []
+            codes, hashes = set(), set()
+            row_id = self._next_row_id
+            for short_code, original_url, url_hash in rows:
+                if short_code in self._entries or short_code in codes:
+                    continue
+                if url_hash is not None and (url_hash in self._by_hash or url_hash in hashes):
+                    continue
+                records.append(self._new_entry(short_code, original_url, url_hash, expires_at, max_clicks, row_id))
+                codes.add(short_code)
+                if url_hash is not None:
+                    hashes.add(url_hash)
+                row_id += 1
+
+            if records:
+                self._append(*records)
+            inserted = [
+                dict(self._public(self._entries[record['short_code']]), url_hash=self._entries[record['short_code']]['url_hash'])
+                for record in records
+            ]
+
+        for row in inserted:
+            resolution_cache.invalidate(row['short_code'])
+        return inserted
+
+    def use_url_click(self, short_code: str) -> Optional[str]:
+        now = datetime.now(timezone.utc)
+        with self._file_lock():
+            entry = self._entries.get(short_code)
+            if entry is None or not entry.get('clicks_left') or _expired(entry, now):
+                return None
+            self._append({'op': 'use', 'short_code': short_code, 'at': now.isoformat()})
+            return entry['original_url']
+
+    def increment_url_clicks_batch(self, counts: Dict[str, int]) -> int:
+        if not counts:
+            return 0
+        with self._file_lock():
+            counts = {code: count for code, count in counts.items() if code in self._entries}
+            if counts:
+                self._append({'op': 'clicks', 'counts': counts})
+            return len(counts)
+
+    def upsert_click_rollups(self, counts: Dict[tuple, int]) -> None:
+        # Per-link analytics need the rollup tables; the file backend only
+        # keeps click totals.
+        return None
+
+    def get_click_analytics(self, short_code: str, granularity: str, since, until, top: int = 10) -> Dict:
+        return {'series': [], 'referrers': [], 'countries': []}
+
+    def _newest_first(self, before_id: Optional[int] = None):
+        end = len(self._ids) if before_id is None else bisect_left(self._ids, before_id)
+        for position in range(end - 1, -1, -1):
+            entry = self._entries.get(self._codes[position])
+            if entry is not None and entry['id'] == self._ids[position]:
+                yield entry
+
+    def _page(self, entries: Iterator[Dict], limit: int) -> Tuple[List[Dict], Optional[tuple]]:
+        results = []
+        for entry in entries:
+            results.append(entry)
+            if len(results) > limit:
+                break
+
+        has_more = len(results) > limit
+        results = results[:limit]
+        next_key = (datetime.fromisoformat(results[-1]['created_at']), results[-1]['id']) if has_more else None
+        rows = [
+            {
+                'short_code': entry['short_code'],
+                'original_url': entry['original_url'],
+                'clicks': entry['clicks'],
+                'created_at': _format_created_at(entry['created_at']),
+            }
+            for entry in results
+        ]
+        return rows, next_key
+
+    def get_urls_page(self, limit: int = 50, after: Optional[tuple] = None) -> Tuple[List[Dict], Optional[tuple]]:
+        """Newest first, keyed like db.get_urls_page; ``after[1]`` is the row id to continue below."""
+        with self._reading():
+            return self._page(self._newest_first(after[1] if after is not None else None), limit)
+
+    def search_urls(self, by: str, query: str, limit: int = 50,
+                    after: Optional[tuple] = None) -> Tuple[List[Dict], Optional[tuple]]:
+        """Like db.search_urls, by scanning the index newest first."""
+        needle = query.lower()
+        subdomains = '.' + query
+
+        def matches(entry: Dict) -> bool:
+            if by == 'code':
+                return entry['short_code'].startswith(query)
+            if by == 'domain':
+                host = url_host(entry['original_url'])
+                return host == query or host.endswith(subdomains)
+            return needle in entry['original_url'].lower()
+
+        with self._reading():
+            entries = self._newest_first(after[1] if after is not None else None)
+            return self._page((entry for entry in entries if matches(entry)), limit)
+
+    def get_all_urls(self) -> List[Dict]:
+        with self._reading():
+            return [
+                {
+                    'short_code': entry['short_code'],
+                    'original_url': entry['original_url'],
+                    'clicks': entry['clicks'],
+                    'created_at': _format_created_at(entry['created_at']),
+                }
+                for entry in self._newest_first()
+            ]
+
+    def iter_urls(self, created_from=None, created_to=None, min_clicks: Optional[int] = None,
+                  batch_size: int = 1000) -> Iterator[Dict]:
+        """Oldest first, like db.iter_urls; the lock is only held while a batch is copied."""
+        # created_at is stored as naive local time.
+        if created_from is not None and created_from.tzinfo is not None:
+            created_from = created_from.astimezone().replace(tzinfo=None)
+        if created_to is not None and created_to.tzinfo is not None:
+            created_to = created_to.astimezone().replace(tzinfo=None)
+
+        after_id = 0
+        while True:
+            batch = []
+            with self._reading():
+                start = bisect_right(self._ids, after_id)
+                end = min(start + batch_size, len(self._ids))
+                if start >= end:
+                    return
+                after_id = self._ids[end - 1]
+                for position in range(start, end):
+                    entry = self._entries.get(self._codes[position])
+                    if entry is None or entry['id'] != self._ids[position]:
+                        continue
+                    if min_clicks is not None and entry['clicks'] < min_clicks:
+                        continue
+                    row = self._public(entry)
+                    if created_from is not None and row['created_at'] < created_from:
+                        continue
+                    if created_to is not None and row['created_at'] >= created_to:
+                        continue
+                    batch.append(row)
+            yield from batch
+
+    def get_stats(self) -> Dict:
+        with self._reading():
+            return {'total_urls': len(self._entries), 'total_clicks': self._total_clicks}
+
+    def delete_expired_urls(self, database: int, expired_before, batch_size: int = 1000) -> List[str]:
+        cutoff = expired_before.timestamp()
+        with self._file_lock():
+            codes = []
+            expiring = self._expiring
+            while expiring and len(codes) < batch_size and expiring[0][0] <= cutoff:
+                key = heapq.heappop(expiring)
+                entry = self._entries.get(key[1])
+                if entry is not None and entry.get('expires_at') is not None and _expiry_key(entry) == key:
+                    codes.append(key[1])
+            if codes:
+                try:
+                    self._append({'op': 'del', 'codes': codes})
+                except OSError:
+                    # Still expiring: put back whatever the failed append didn't delete.
+                    for short_code in codes:
+                        if short_code in self._entries:
+                            heapq.heappush(expiring, _expiry_key(self._entries[short_code]))
+                    raise
+
+        for short_code in codes:
+            resolution_cache.invalidate(short_code)
+        return codes
+
+    def close(self) -> None:
+        with self._lock:
+            self._flusher_stop.set()
+            self._flusher_pid = None
+            if self.fsync != 'never':
+                self._sync()
+            self._close_fd()
+
+    def stats(self) -> Dict:
+        with self._reading():
+            return {
+                'backend': self.name,
+                'path': self.path,
+                'urls': len(self._entries),
+                'log_records': self._records,
+                'log_bytes': self._offset,
+                'fsync': self.fsync,
+                'compactions': self._compactions,
+                'recovered_bytes': self._recovered_bytes,
+            }
@@ -0,0 +1,30 @@
+"""Gunicorn settings: ``gunicorn app:app`` picks this file up automatically.
+
+The app is imported once in the master (``preload_app``) and workers are
+forked from it, so imports, pre-rendered pages, static assets and the short
+code filter are loaded once and shared copy-on-write instead of rebuilt in
+every worker. Run ``python migrate_data.py init`` once per deploy and set
+SCHEMA_INIT=migrate so startup never runs DDL.
+"""
+import gc
+import os
+import sys
+
+bind = os.getenv('GUNICORN_BIND', f"0.0.0.0:{os.getenv('PORT', '5000')}")
+workers = int(os.getenv('WEB_CONCURRENCY', str(min(2 * (os.cpu_count() or 1) + 1, 8))))
+threads = int(os.getenv('GUNICORN_THREADS', '1'))
+preload_app = os.getenv('GUNICORN_PRELOAD', '1') != '0'
+
+
+def when_ready(server):
+    if not preload_app:
+        return
+    # Sockets opened while preloading must not be inherited by workers;
+    # each worker opens its own pool on first use. (Only the postgres
+    # backend imports db.)
+    db = sys.modules.get('db')
+    if db is not None:
+        db.close_pool(stop_replicas=False)
+    # Keep the preloaded objects out of the collector so its passes don't
+    # write to (and un-share) pages the workers inherited.
+    gc.freeze()
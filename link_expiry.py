@@ -0,0 +1,119 @@
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional
+from storage import get_storage
+
+
+class ExpiryPurger:
+    """Deletes expired links in the background, a bounded batch at a time.
+
+    Every ``interval`` seconds each database is drained of links that expired
+    more than ``grace`` seconds ago, ``batch_size`` rows per transaction with
+    ``pause`` seconds between batches, so the purge never holds locks for
+    long or competes with redirects for the primary. Purgers in several
+    workers skip each other's rows rather than waiting on them.
+    """
+
+    def __init__(
+        self,
+        interval: float = 60.0,
+        batch_size: int = 1000,
+        pause: float = 0.1,
+        grace: float = 0.0,
+        enabled: bool = True,
+    ):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.pause = pause
+        self.grace = grace
+        self.enabled = enabled
+
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread_pid: Optional[int] = None
+
+        self._runs = 0
+        self._purged = 0
+        self._failures = 0
+        self._last_run_at: Optional[float] = None
+        self._last_purged = 0
+        self._last_duration = 0.0
+
+    def purge(self) -> int:
+        """Delete every link that has expired by now. Returns the rows reclaimed."""
+        started = time.monotonic()
+        expired_before = datetime.now(timezone.utc) - timedelta(seconds=self.grace)
+
+        storage = get_storage()
+        purged = 0
+        for database in range(storage.databases):
+            while not self._stopping:
+                deleted = len(storage.delete_expired_urls(database, expired_before, self.batch_size))
+                purged += deleted
+                if deleted < self.batch_size:
+                    break
+                time.sleep(self.pause)
+
+        duration = time.monotonic() - started
+        with self._lock:
+            self._runs += 1
+            self._purged += purged
+            self._last_run_at = time.time()
+            self._last_purged = purged
+            self._last_duration = duration
+
+        if purged:
+            print(f"Purged {purged} expired links in {duration:.1f}s")
+        return purged
+
+    def start(self) -> None:
+        if not self.enabled:
+            return
+        pid = os.getpid()
+        if self._thread_pid == pid or self._stopping:
+            return
+
+        with self._lock:
+            if self._thread_pid == pid:
+                return
+            self._thread_pid = pid
+            threading.Thread(target=self._run, name='expiry-purger', daemon=True).start()
+
+    def _run(self) -> None:
+        while not self._stopping:
+            try:
+                self.purge()
+            except Exception as e:
+                with self._lock:
+                    self._failures += 1
+                print(f"Expired link purge failed: {e}")
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+
+    def stop(self) -> None:
+        self._stopping = True
+        self._wakeup.set()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'runs': self._runs,
+                'purged': self._purged,
+                'failures': self._failures,
+                'last_run_at': self._last_run_at,
+                'last_purged': self._last_purged,
+                'last_duration_seconds': round(self._last_duration, 3),
+            }
+
+
+expiry_purger = ExpiryPurger(
+    interval=float(os.getenv('EXPIRY_PURGE_INTERVAL', '60')),
+    batch_size=int(os.getenv('EXPIRY_PURGE_BATCH_SIZE', '1000')),
+    pause=float(os.getenv('EXPIRY_PURGE_PAUSE', '0.1')),
+    grace=float(os.getenv('EXPIRY_PURGE_GRACE', '0')),
+    enabled=os.getenv('EXPIRY_PURGE', '1') != '0',
+)
@@ -1,12 +1,16 @@
 import sys
 from datetime import datetime
-from url_shortener import create_short_url, get_all_urls
 from constants import BASE_URL
+from url_shortener import create_short_url, list_urls_page, shorten_batch, BatchStats, DEFAULT_PAGE_SIZE
+from url_export import export_urls
+from url_utils import validate_export_filters
 
 def print_usage():
     print("Usage:")
     print('  python main.py shorten "https://example.com"')
-    print("  python main.py list")
+    print("  python main.py shorten --file urls.txt   (one URL per line, '-' for stdin)")
+    print("  python main.py list [--limit N] [--cursor CURSOR] [--all]")
+    print("  python main.py export [--format csv|ndjson] [--from ISO] [--to ISO] [--min-clicks N] [--gzip] [--output FILE]")
 
 def format_datetime(iso_string: str) -> str:
     dt = datetime.fromisoformat(iso_string)
@@ -30,15 +34,86 @@ def print_table(urls):
     print("│ " + "Code".ljust(code_width) + " │ " + "Original URL".ljust(url_width) + " │ " + "Clicks".ljust(clicks_width) + " │ " + "Created".ljust(date_width) + " │")
     print("├─" + "─" * code_width + "─┼─" + "─" * url_width + "─┼─" + "─" * clicks_width + "─┼─" + "─" * date_width + "─┤")
 
-    for urls in urls:
+    for url in urls:
         code = url['short_code'].ljust(code_width)
         original = url['original_url'][:url_width].ljust(url_width)
         clicks = str(url['clicks']).ljust(clicks_width)
         created = format_datetime(url['created_at']).ljust(date_width)
-        print(f"| {code} | {original} | {clicks} | {created} |")
+        print(f"│ {code} │ {original} │ {clicks} │ {created} │")
 
     print("└─" + "─" * code_width + "─┴─" + "─" * url_width + "─┴─" + "─" * clicks_width + "─┴─" + "─" * date_width + "─┘")
 
+def read_url_lines(f):
+    for line in f:
+        line = line.strip()
+        if line:
+            yield line
+
+def shorten_file(path: str):
+    stats = BatchStats()
+    f = sys.stdin if path == '-' else open(path, 'r')
+    try:
+        for result in shorten_batch(read_url_lines(f)):
+            stats.add(result)
+            if 'error' in result:
+                print(f"{result['url']}\tERROR: {result['error']}")
+            else:
+                print(f"{result['url']}\t{BASE_URL}/{result['short_code']}")
+            if stats.total % 10000 == 0:
+                print(f"  ... {stats.total} URLs processed", file=sys.stderr)
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+    summary = stats.to_dict()
+    print(
+        f"Processed {summary['total']} URLs in {summary['elapsed_seconds']}s "
+        f"({summary['urls_per_second']} URLs/s): {summary['created']} created, "
+        f"{summary['existing']} existing, {summary['failed']} failed",
+        file=sys.stderr
+    )
+
+def get_option(name: str, default=None):
+    if name in sys.argv:
+        index = sys.argv.index(name)
+        if index + 1 < len(sys.argv):
+            return sys.argv[index + 1]
+    return default
+
+def list_urls():
+    try:
+        limit = int(get_option("--limit", DEFAULT_PAGE_SIZE))
+    except ValueError:
+        raise ValueError("--limit must be a whole number")
+    cursor = get_option("--cursor")
+    show_all = "--all" in sys.argv
+
+    while True:
+        urls, cursor = list_urls_page(cursor, limit)
+        print_table(urls)
+        if not cursor:
+            return
+        if not show_all:
+            print(f"More: python main.py list --limit {limit} --cursor {cursor}")
+            return
+
+def export_urls_to_file():
+    fmt = get_option("--format", "csv")
+    output = get_option("--output")
+    created_from, created_to, min_clicks = validate_export_filters(
+        get_option("--from"), get_option("--to"), get_option("--min-clicks"))
+    chunks = export_urls(fmt, created_from, created_to, min_clicks, compress="--gzip" in sys.argv)
+
+    f = open(output, 'wb') if output else sys.stdout.buffer
+    try:
+        for chunk in chunks:
+            f.write(chunk)
+    finally:
+        if output:
+            f.close()
+        else:
+            f.flush()
+
 def main():
     if len(sys.argv) < 2:
         print_usage()
@@ -52,13 +127,32 @@ def main():
             print_usage()
             sys.exit(1)
 
+        if sys.argv[2] == "--file":
+            if len(sys.argv) < 4:
+                print("Error: Please provide a file of URLs to shorten")
+                print_usage()
+                sys.exit(1)
+            shorten_file(sys.argv[3])
+            return
+
         url = sys.argv[2]
         result = create_short_url(url)
         print(f"Your short URL: {BASE_URL}/{result['short_code']}")
 
     elif command == "list":
-        urls = get_all_urls()
-        print_table(urls)
+        try:
+            list_urls()
+        except ValueError as e:
+            print(f"Error: {e}")
+            print_usage()
+            sys.exit(1)
+
+    elif command == "export":
+        try:
+            export_urls_to_file()
+        except ValueError as e:
+            print(f"Error: {e}", file=sys.stderr)
+            sys.exit(1)
 
     else:
         print(f"Error: Unknown command '{command}'")
@@ -0,0 +1,192 @@
+import functools
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Tuple
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50)
+
+SLOW_REQUEST_THRESHOLD = float(os.getenv('SLOW_REQUEST_THRESHOLD', '0.5'))
+
+
+class Histogram:
+    """Prometheus-style cumulative histogram, one series per label tuple."""
+
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...], buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = tuple(buckets)
+        self._series: Dict[Tuple[str, ...], List] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            snapshot = [(labels, list(s[0]), s[1], s[2]) for labels, s in self._series.items()]
+
+        for labels, counts, total, count in sorted(snapshot):
+            base = _format_labels(self.label_names, labels)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += bucket_count
+                le = f'le="{bound}"'
+                lines.append(f'{self.name}_bucket{_join_labels(base, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_wrap(base)} {total}')
+            lines.append(f'{self.name}_count{_wrap(base)} {count}')
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...]):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            lines.append(f'{self.name}{_wrap(_format_labels(self.label_names, labels))} {value}')
+        return lines
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...]) -> str:
+    return ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+
+
+def _wrap(labels: str) -> str:
+    return '{' + labels + '}' if labels else ''
+
+
+def _join_labels(base: str, extra: str) -> str:
+    return '{' + (base + ',' if base else '') + extra + '}'
+
+
+http_request_duration = Histogram(
+    'http_request_duration_seconds', 'Time spent handling HTTP requests.', ('route', 'method', 'status'))
+http_slow_requests = Counter(
+    'http_slow_requests_total', 'Requests slower than SLOW_REQUEST_THRESHOLD.', ('route',))
+db_queries_per_request = Histogram(
+    'db_queries_per_request', 'Database statements issued per HTTP request.', ('route',),
+    buckets=QUERY_COUNT_BUCKETS)
+db_call_duration = Histogram(
+    'db_call_duration_seconds', 'Total time spent in each db.py function.', ('function',))
+db_phase_duration = Histogram(
+    'db_phase_duration_seconds', 'Database time by phase (connect, query, commit).', ('function', 'phase'))
+
+_collectors: List[Callable[[], List[Tuple[str, str, Dict[str, float]]]]] = []
+
+
+def register_collector(collector: Callable[[], List[Tuple[str, str, Dict[str, float]]]]) -> None:
+    """Add a callback returning (metric_name, help, {label_value_or_'': value}) gauges."""
+    _collectors.append(collector)
+
+
+class RequestTrace:
+    __slots__ = ('started', 'queries', 'phases')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.phases: Dict[str, float] = {}
+
+
+_request_trace: ContextVar[Optional[RequestTrace]] = ContextVar('request_trace', default=None)
+_db_function: ContextVar[str] = ContextVar('db_function', default='other')
+
+
+def start_request() -> RequestTrace:
+    trace = RequestTrace()
+    _request_trace.set(trace)
+    return trace
+
+
+def finish_request(route: str, method: str, status: int) -> None:
+    trace = _request_trace.get()
+    if trace is None:
+        return
+    _request_trace.set(None)
+
+    elapsed = time.perf_counter() - trace.started
+    http_request_duration.observe(elapsed, route, method, str(status))
+    db_queries_per_request.observe(trace.queries, route)
+
+    if elapsed >= SLOW_REQUEST_THRESHOLD:
+        http_slow_requests.inc(route)
+        breakdown = ', '.join(f'{phase}={seconds * 1000:.1f}ms' for phase, seconds in sorted(trace.phases.items()))
+        print(f"Slow request: {method} {route} -> {status} in {elapsed * 1000:.1f}ms "
+              f"({trace.queries} queries; {breakdown or 'no db time'})")
+
+
+def record_db_phase(phase: str, seconds: float) -> None:
+    """Attribute database time to the current db.py function and request."""
+    db_phase_duration.observe(seconds, _db_function.get(), phase)
+    trace = _request_trace.get()
+    if trace is not None:
+        trace.phases[phase] = trace.phases.get(phase, 0.0) + seconds
+        if phase == 'query':
+            trace.queries += 1
+
+
+def timed_db_call(func):
+    """Time a db.py function and label the connect/query/commit phases inside it."""
+    name = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        token = _db_function.set(name)
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            db_call_duration.observe(time.perf_counter() - started, name)
+            _db_function.reset(token)
+
+    return wrapper
+
+
+def render_prometheus() -> str:
+    lines: List[str] = []
+    for metric in (http_request_duration, http_slow_requests, db_queries_per_request,
+                   db_call_duration, db_phase_duration):
+        lines.extend(metric.render())
+
+    for collector in _collectors:
+        try:
+            gauges = collector()
+        except Exception as e:
+            print(f"Metrics collector failed: {e}")
+            continue
+        for name, help_text, values in gauges:
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} gauge')
+            for label, value in values.items():
+                labels = f'{{kind="{_escape(label)}"}}' if label else ''
+                lines.append(f'{name}{labels} {value}')
+
+    return '\n'.join(lines) + '\n'
@@ -1,9 +1,110 @@
+import codecs
 import json
 import os
-from db import create_url_entry, init_db, get_all_urls
+import sys
+import time
+from typing import Dict, Iterator, Optional, Tuple
+from db import copy_url_entries, count_urls, init_db, get_urls_page, backfill_url_hashes, rebuild_stats, partition_urls_table, shard_map
+from link_expiry import expiry_purger
+from redirect_snapshot import redirect_snapshot
+
+CHUNK_SIZE = 5000
+CHECKPOINT_COUNTERS = ('offset', 'processed', 'migrated', 'skipped', 'invalid')
+READ_SIZE = 1 << 20
+_WHITESPACE = ' \t\r\n'
+
+def iter_json_array(path: str, offset: int = 0) -> Iterator[Tuple[Dict, int]]:
+    """Incrementally parse a top-level JSON array of objects.
+
+    Yields (item, byte_offset) where byte_offset is the file position just
+    after the item, so a later call with that offset resumes from the next
+    element. Memory use is bounded by READ_SIZE plus the largest single item.
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        buf = ''
+        idx = 0
+        pos = offset
+        eof = False
+        in_array = offset > 0
+
+        while True:
+            skip = _WHITESPACE + ',' if in_array else _WHITESPACE
+            while idx < len(buf) and buf[idx] in skip:
+                idx += 1
+                pos += 1
+
+            if idx >= len(buf):
+                if eof:
+                    if not in_array:
+                        raise ValueError("Expected a JSON array")
+                    return
+                chunk = f.read(READ_SIZE)
+                buf = buf[idx:] + utf8.decode(chunk, final=not chunk)
+                idx = 0
+                eof = not chunk
+                continue
+
+            if not in_array:
+                if buf[idx] != '[':
+                    raise ValueError("Expected a JSON array")
+                in_array = True
+                idx += 1
+                pos += 1
+                continue
+
+            if buf[idx] == ']':
+                return
+
+            try:
+                item, end = decoder.raw_decode(buf, idx)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                chunk = f.read(READ_SIZE)
+                buf = buf[idx:] + utf8.decode(chunk, final=not chunk)
+                idx = 0
+                eof = not chunk
+                continue
+
+            pos += len(buf[idx:end].encode('utf-8'))
+            idx = end
+            yield item, pos
+
+def _checkpoint_path(json_file: str) -> str:
+    return f"{json_file}.checkpoint"
+
+def load_checkpoint(json_file: str) -> Optional[Dict]:
+    path = _checkpoint_path(json_file)
+    if not os.path.exists(path):
+        return None
+
+    try:
+        with open(path, 'r') as f:
+            checkpoint = json.load(f)
+    except (json.JSONDecodeError, OSError):
+        return None
+
+    stat = os.stat(json_file)
+    if checkpoint.get('size') != stat.st_size or checkpoint.get('mtime') != stat.st_mtime:
+        print(f"  {json_file} changed since the last run; ignoring checkpoint")
+        return None
+    return checkpoint
+
+def save_checkpoint(json_file: str, checkpoint: Dict) -> None:
+    stat = os.stat(json_file)
+    checkpoint = dict(checkpoint, size=stat.st_size, mtime=stat.st_mtime)
+    tmp_path = _checkpoint_path(json_file) + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, _checkpoint_path(json_file))
+
+def migrate_from_json(json_file: str = 'urls.json', chunk_size: int = CHUNK_SIZE, resume: bool = True) -> Optional[Dict]:
+    """Stream json_file into PostgreSQL; returns the final counters, or None if it stopped early."""
 
-def migrate_from_json():
-    
     print(" Starting migration from JSON to PostgreSQL...")
     print("=" * 60)
     
@@ -12,80 +113,102 @@ def migrate_from_json():
         init_db()
     except Exception as e:
         print(f" Failed to initialize database: {e}")
-        return
+        return None
     
-    json_file = 'urls.json'
     if not os.path.exists(json_file):
         print(f"\n  No {json_file} file found.")
         print("Starting with a fresh database!")
         print("=" * 60)
-        return
-    
-    print(f"\n Reading data from {json_file}...")
+        return None
+
+    saved = load_checkpoint(json_file) if resume else None
+    if saved:
+        print(f"\n Resuming after {saved['processed']} entries (byte {saved['offset']})")
+    # The counters cover exactly the entries before the saved offset, so a
+    # resumed run carries them on instead of counting those entries again.
+    checkpoint = {key: (saved or {}).get(key, 0) for key in CHECKPOINT_COUNTERS}
+
+    initial_count = count_urls()
+    total_bytes = os.path.getsize(json_file)
+    started = time.monotonic()
+    resumed_from = checkpoint['processed']
+    migrated_before = checkpoint['migrated']
+
+    print(f"\n Streaming {json_file} into PostgreSQL in chunks of {chunk_size}...")
+    print("-" * 60)
+
+    rows = []
+    invalid = []
+    offset = checkpoint['offset']
+
+    def flush():
+        # Entries only count once the checkpoint that moves past them is saved.
+        inserted = copy_url_entries(rows) if rows else 0
+        checkpoint['migrated'] += inserted
+        checkpoint['skipped'] += len(rows) - inserted
+        checkpoint['invalid'] += len(invalid)
+        checkpoint['processed'] += len(rows) + len(invalid)
+        checkpoint['offset'] = offset
+        save_checkpoint(json_file, checkpoint)
+        rows.clear()
+        invalid.clear()
+
+        elapsed = time.monotonic() - started
+        rate = (checkpoint['processed'] - resumed_from) / elapsed if elapsed > 0 else 0
+        percent = offset * 100 / total_bytes if total_bytes else 100
+        print(f" [{percent:5.1f}%] {checkpoint['processed']} processed, "
+              f"{checkpoint['migrated']} migrated, {checkpoint['skipped']} already present "
+              f"({rate:.0f} rows/s)")
+
     try:
-        with open(json_file, 'r') as f:
-            urls = json.load(f)
-        print(f" Found {len(urls)} URLs to migrate")
-    except json.JSONDecodeError as e:
+        for url, offset in iter_json_array(json_file, checkpoint['offset']):
+            short_code = url.get('short_code') if isinstance(url, dict) else None
+            original_url = url.get('original_url') if isinstance(url, dict) else None
+
+            if not short_code or not original_url or len(short_code) > 10:
+                print(f" Invalid entry: {url}")
+                invalid.append(url)
+                continue
+
+            rows.append((short_code, original_url, url.get('clicks', 0), url.get('created_at')))
+            if len(rows) >= chunk_size:
+                flush()
+
+        if rows or invalid:
+            flush()
+    except (ValueError, json.JSONDecodeError) as e:
         print(f" Error reading JSON file: {e}")
-        return
+        return None
     except Exception as e:
-        print(f" Error: {e}")
-        return
-    
-    if not urls:
-        print("  JSON file is empty. Nothing to migrate.")
-        return
-    
-    print(f"\n Migrating URLs to PostgreSQL...")
-    print("-" * 60)
-    
-    success_count = 0
-    failed_count = 0
-    
-    for i, url in enumerate(urls, 1):
-        try:
-            short_code = url.get('short_code')
-            original_url = url.get('original_url')
-            clicks = url.get('clicks', 0)
-            
-            if not short_code or not original_url:
-                print(f" [{i}/{len(urls)}] Invalid entry: {url}")
-                failed_count += 1
-                continue
-            
-            create_url_entry(
-                short_code=short_code,
-                original_url=original_url,
-                clicks=clicks
-            )
-            
-            print(f" [{i}/{len(urls)}] Migrated: {short_code} -> {original_url[:50]}... ({clicks} clicks)")
-            success_count += 1
-            
-        except Exception as e:
-            print(f" [{i}/{len(urls)}] Failed to migrate {url.get('short_code', 'unknown')}: {e}")
-            failed_count += 1
+        print(f" Migration interrupted: {e}")
+        print(" Rerun the migration to resume from the last checkpoint.")
+        return None
     
     print("\n" + "=" * 60)
     print(" MIGRATION SUMMARY")
     print("=" * 60)
-    print(f" Successfully migrated: {success_count} URLs")
-    print(f" Failed: {failed_count} URLs")
-    print(f" Total processed: {len(urls)} URLs")
+    print(f" Successfully migrated: {checkpoint['migrated']} URLs")
+    print(f" Already present: {checkpoint['skipped']} URLs")
+    print(f" Invalid: {checkpoint['invalid']} URLs")
+    print(f" Total processed: {checkpoint['processed']} URLs")
+    print(f" Elapsed: {time.monotonic() - started:.1f}s")
     
     print("\n Verifying migration...")
     try:
-        db_urls = get_all_urls()
-        print(f" Database now contains {len(db_urls)} URLs")
+        final_count = count_urls()
+        expected = initial_count + checkpoint['migrated'] - migrated_before
+        print(f" Database now contains {final_count} URLs")
         
-        if len(db_urls) == success_count:
+        if final_count == expected:
             print(" Migration verification PASSED!")
         else:
-            print(f"  Warning: Expected {success_count} URLs but found {len(db_urls)}")
+            print(f"  Warning: Expected {expected} URLs but found {final_count}")
     
     except Exception as e:
         print(f" Failed to verify migration: {e}")
+
+    if os.path.exists(_checkpoint_path(json_file)):
+        os.remove(_checkpoint_path(json_file))
     
     print("\n" + "=" * 60)
     print(" BACKUP RECOMMENDATION")
@@ -97,6 +220,25 @@ def migrate_from_json():
     print(f"  - {json_file}")
     print(f"  - file_handler.py (if you're not using it anymore)")
     print("=" * 60)
+    return checkpoint
+
+def migrate_url_hashes():
+    """Add and backfill the url_hash dedupe column on an existing database"""
+    print("\n Initializing database tables...")
+    init_db()
+
+    print("\n Backfilling url_hash for existing rows...")
+    updated = backfill_url_hashes()
+    print(f" Hashed {updated} URLs")
+
+def migrate_to_partitions():
+    """Split existing urls tables into URL_PARTITIONS hash partitions"""
+    print(f"\n Partitioning urls into {shard_map.partitions} partitions per database...")
+    moved = partition_urls_table()
+    print(f" Moved {moved} URLs")
+
+    print("\n Initializing database tables...")
+    init_db()
 
 def verify_database():
     """Quick verification of database contents"""
@@ -104,20 +246,21 @@ def verify_database():
     print("=" * 60)
     
     try:
-        urls = get_all_urls()
+        total = count_urls()
         
-        if not urls:
+        if not total:
             print("Database is empty")
             return
         
-        print(f"\nTotal URLs: {len(urls)}\n")
+        print(f"\nTotal URLs: {total}\n")
         
-        for i, url in enumerate(urls[:10], 1):  
+        urls, _ = get_urls_page(limit=10)
+        for i, url in enumerate(urls, 1):  
             print(f"{i}. {url['short_code']} -> {url['original_url'][:60]}...")
             print(f"   Clicks: {url['clicks']} | Created: {url['created_at']}")
         
-        if len(urls) > 10:
-            print(f"\n... and {len(urls) - 10} more URLs")
+        if total > 10:
+            print(f"\n... and {total - 10} more URLs")
     
     except Exception as e:
         print(f" Error verifying database: {e}")
@@ -135,12 +278,52 @@ if __name__ == '__main__':
         exit(1)
     
     print(f"\n Database: {db_url.split('@')[1] if '@' in db_url else db_url}")
+
+    if len(sys.argv) > 1 and sys.argv[1] == 'init':
+        init_db()
+        print("\n Schema ready! Start the app with SCHEMA_INIT=migrate.\n")
+        sys.exit(0)
+
+    if len(sys.argv) > 1 and sys.argv[1] == 'backfill-hashes':
+        migrate_url_hashes()
+        print("\n Backfill complete!\n")
+        sys.exit(0)
+
+    if len(sys.argv) > 1 and sys.argv[1] == 'partition':
+        migrate_to_partitions()
+        print("\n Partitioning complete!\n")
+        sys.exit(0)
+
+    if len(sys.argv) > 1 and sys.argv[1] == 'purge-expired':
+        purged = expiry_purger.purge()
+        print(f"\n Purged {purged} expired links\n")
+        sys.exit(0)
+
+    if len(sys.argv) > 1 and sys.argv[1] == 'snapshot':
+        if not redirect_snapshot.enabled:
+            print("\n The redirect snapshot is turned off (REDIRECT_SNAPSHOT=0, the file backend or no DATABASE_URL)\n")
+            sys.exit(1)
+        count = redirect_snapshot.rebuild()
+        if count is None:
+            print("\n Another process is building the snapshot\n")
+            sys.exit(1)
+        print(f"\n Snapshot written to {redirect_snapshot.path}\n")
+        sys.exit(0)
+
+    if len(sys.argv) > 1 and sys.argv[1] == 'rebuild-stats':
+        totals = rebuild_stats()
+        print(f"\n Stats rebuilt: {totals['total_urls']} URLs, {totals['total_clicks']} clicks\n")
+        sys.exit(0)
     
-    print("\n  WARNING: This will migrate data from urls.json to PostgreSQL")
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    json_file = args[0] if args else 'urls.json'
+    resume = '--restart' not in sys.argv
+
+    print(f"\n  WARNING: This will migrate data from {json_file} to PostgreSQL")
     response = input("\nContinue? (yes/no): ").strip().lower()
     
     if response in ['yes', 'y']:
-        migrate_from_json()
+        migrate_from_json(json_file, resume=resume)
         verify_database()
         print("\n Migration complete!\n")
     else:
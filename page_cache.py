@@ -0,0 +1,195 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import threading
+from html import escape
+from typing import Callable, Dict, List, Optional, Tuple
+
+try:
+    import brotli
+except ImportError:  # Optional: clients are offered gzip instead.
+    brotli = None
+
+# Smaller bodies don't shrink enough to be worth a Content-Encoding.
+COMPRESS_MIN_SIZE = 512
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'image/svg+xml')
+# Preferred first when a client accepts several.
+ENCODINGS = ('br', 'gzip')
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'no-cache'
+
+STATIC_PAGES = ('index.html', 'login.html', 'signup.html', '404.html')
+_SHORT_CODE_MARKER = '__short_code__'
+
+
+def _accepted_encodings(accept_encoding: str) -> List[str]:
+    accepted = []
+    for item in accept_encoding.split(','):
+        name, _, params = item.strip().partition(';')
+        params = params.replace(' ', '')
+        if name and params not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            accepted.append(name.lower())
+    return accepted
+
+
+class CachedBody:
+    """A response body kept in memory with its ETag and precompressed variants."""
+
+    def __init__(self, body: bytes, content_type: str):
+        self.content_type = content_type
+        self.fingerprint = hashlib.sha256(body).hexdigest()[:12]
+        self.variants: Dict[str, bytes] = {'identity': body}
+
+        if len(body) >= COMPRESS_MIN_SIZE and content_type.startswith(COMPRESSIBLE_TYPES):
+            compressed = {'gzip': gzip.compress(body, compresslevel=9, mtime=0)}
+            if brotli is not None:
+                compressed['br'] = brotli.compress(body, quality=11)
+            for encoding, data in compressed.items():
+                if len(data) < len(body):
+                    self.variants[encoding] = data
+
+    @property
+    def size(self) -> int:
+        return sum(len(data) for data in self.variants.values())
+
+    def respond(self, accept_encoding: str = '', if_none_match: str = '',
+                cache_control: str = REVALIDATE, status: int = 200) -> Tuple[int, List[Tuple[str, str]], bytes]:
+        """(status, headers, body) for a request, as a 304 when its ETag still matches."""
+        encoding = 'identity'
+        if len(self.variants) > 1:
+            accepted = _accepted_encodings(accept_encoding)
+            encoding = next((e for e in ENCODINGS if e in self.variants and e in accepted), 'identity')
+
+        etag = f'"{self.fingerprint}"' if encoding == 'identity' else f'"{self.fingerprint}-{encoding}"'
+        headers = [('ETag', etag), ('Cache-Control', cache_control)]
+        if len(self.variants) > 1:
+            headers.append(('Vary', 'Accept-Encoding'))
+
+        if status == 200 and etag in if_none_match:
+            return 304, headers, b''
+
+        headers.append(('Content-Type', self.content_type))
+        if encoding != 'identity':
+            headers.append(('Content-Encoding', encoding))
+        return status, headers, self.variants[encoding]
+
+
+class PageCache:
+    """Templates that don't depend on the request, rendered once and served as bytes.
+
+    ``render(name, **context)`` is supplied by the web app. The per-code 404
+    page is cached as the bytes around the code, so a miss costs an escape
+    and a join rather than a template render.
+    """
+
+    def __init__(self):
+        self._render: Optional[Callable[..., str]] = None
+        self._pages: Dict[str, CachedBody] = {}
+        self._not_found_parts: Optional[Tuple[bytes, bytes]] = None
+        self._lock = threading.Lock()
+
+    def configure(self, render: Callable[..., str]) -> None:
+        with self._lock:
+            self._render = render
+            self._pages = {}
+            self._not_found_parts = None
+
+    def prerender(self, names=STATIC_PAGES) -> None:
+        for name in names:
+            self.page(name)
+        self.not_found('')
+
+    def page(self, name: str) -> CachedBody:
+        page = self._pages.get(name)
+        if page is None:
+            page = CachedBody(self._render(name).encode('utf-8'), 'text/html; charset=utf-8')
+            with self._lock:
+                self._pages[name] = page
+        return page
+
+    def not_found(self, short_code: str) -> bytes:
+        """The 404 page for an unknown short code."""
+        parts = self._not_found_parts
+        if parts is None:
+            html = self._render('404.html', short_code=_SHORT_CODE_MARKER)
+            before, _, after = html.partition(_SHORT_CODE_MARKER)
+            parts = self._not_found_parts = (before.encode('utf-8'), after.encode('utf-8'))
+        return parts[0] + escape(short_code).encode('utf-8') + parts[1]
+
+    def stats(self) -> Dict:
+        pages = dict(self._pages)
+        return {
+            'pages': len(pages),
+            'bytes': sum(page.size for page in pages.values()),
+            'brotli': brotli is not None,
+        }
+
+
+class StaticAssets:
+    """Files under a static folder served from memory, fingerprinted for cache busting.
+
+    A file is reloaded when its mtime changes. Links carry the content
+    fingerprint (``?v=``), so a request for the current fingerprint can be
+    cached forever; anything else has to revalidate.
+    """
+
+    def __init__(self, folder: str):
+        self.folder = os.path.abspath(folder)
+        self._assets: Dict[str, Tuple[float, CachedBody]] = {}
+        self._lock = threading.Lock()
+
+    def _path(self, filename: str) -> Optional[str]:
+        path = os.path.abspath(os.path.join(self.folder, filename))
+        if not path.startswith(self.folder + os.sep):
+            return None
+        return path
+
+    def get(self, filename: str) -> Optional[CachedBody]:
+        path = self._path(filename)
+        if path is None:
+            return None
+        try:
+            mtime = os.stat(path).st_mtime
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+
+        cached = self._assets.get(filename)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+        if not os.path.isfile(path):
+            return None
+        with open(path, 'rb') as f:
+            content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+            if content_type.startswith('text/') or content_type == 'application/javascript':
+                content_type += '; charset=utf-8'
+            asset = CachedBody(f.read(), content_type)
+
+        with self._lock:
+            self._assets[filename] = (mtime, asset)
+        return asset
+
+    def fingerprint(self, filename: str) -> Optional[str]:
+        asset = self.get(filename)
+        return asset.fingerprint if asset is not None else None
+
+    def respond(self, filename: str, version: Optional[str], accept_encoding: str = '',
+                if_none_match: str = '') -> Optional[Tuple[int, List[Tuple[str, str]], bytes]]:
+        asset = self.get(filename)
+        if asset is None:
+            return None
+        cache_control = IMMUTABLE if version == asset.fingerprint else REVALIDATE
+        return asset.respond(accept_encoding, if_none_match, cache_control)
+
+    def stats(self) -> Dict:
+        assets = dict(self._assets)
+        return {
+            'files': len(assets),
+            'bytes': sum(asset.size for _, asset in assets.values()),
+        }
+
+
+page_cache = PageCache()
+static_assets = StaticAssets(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static'))
@@ -1,7 +1,21 @@
-import qrcode
+import base64
+import hashlib
+import json
+import os
+import struct
+import zlib
+from functools import lru_cache
 from typing import List
 
-def generate_qr_matrix(url: str, size: int = 25) -> List[List[int]]:
+QR_CACHE_SIZE = int(os.getenv('QR_CACHE_SIZE', '4096'))
+QR_PNG_SCALE = 8
+
+
+def _build_matrix(url: str) -> List[List[bool]]:
+    # Imported on first use: qrcode and Pillow are slow to load and most
+    # processes never render a code.
+    import qrcode
+
     qr = qrcode.QRCode(
         version=1,
         error_correction=qrcode.constants.ERROR_CORRECT_L,
@@ -12,16 +26,139 @@ def generate_qr_matrix(url: str, size: int = 25) -> List[List[int]]:
     qr.add_data(url)
     qr.make(fit=True)
 
-    qr_matrix = qr.get_matrix()
+    return qr.get_matrix()
+
+
+def generate_qr_matrix(url: str, size: int = 25) -> List[List[int]]:
+    return [list(row) for row in get_qr_render(url).matrix]
+
+
+def _pack_row(row, scale: int = 1, dark_bit: int = 1) -> bytes:
+    """Pack a row of modules into bytes, MSB first, repeating each one ``scale`` times."""
+    packed = bytearray()
+    byte = 0
+    bits = 0
+    for cell in row:
+        bit = dark_bit if cell else 1 - dark_bit
+        for _ in range(scale):
+            byte = (byte << 1) | bit
+            bits += 1
+            if bits == 8:
+                packed.append(byte)
+                byte = 0
+                bits = 0
+    if bits:
+        packed.append(byte << (8 - bits))
+    return bytes(packed)
+
+
+def _png_chunk(kind: bytes, data: bytes) -> bytes:
+    return (
+        struct.pack('>I', len(data)) + kind + data
+        + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+    )
+
+
+class QRRender:
+    """One QR code and its serialized forms, each built at most once."""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.matrix = tuple(tuple(1 if cell else 0 for cell in row) for row in _build_matrix(url))
+        self.height = len(self.matrix)
+        self.width = len(self.matrix[0]) if self.matrix else 0
+        self._formats = {}
 
-    matrix = [[1 if cell else 0 for cell in row] for row in qr_matrix]
+    def etag(self, fmt: str) -> str:
+        return '"' + hashlib.sha1(f'{fmt}:{self.url}'.encode()).hexdigest() + '"'
+
+    def render(self, fmt: str) -> bytes:
+        body = self._formats.get(fmt)
+        if body is None:
+            body = getattr(self, f'_render_{fmt}')()
+            self._formats[fmt] = body
+        return body
+
+    def _render_matrix(self) -> bytes:
+        return json.dumps({
+            'matrix': self.matrix,
+            'width': self.width,
+            'height': self.height,
+        }, separators=(',', ':')).encode()
+
+    def _render_packed(self) -> bytes:
+        """Rows bit-packed MSB first, each padded to a whole byte, base64-encoded."""
+        packed = b''.join(_pack_row(row) for row in self.matrix)
+        return json.dumps({
+            'packed': base64.b64encode(packed).decode(),
+            'width': self.width,
+            'height': self.height,
+        }, separators=(',', ':')).encode()
+
+    def _render_png(self) -> bytes:
+        # 1-bit greyscale, where 0 is black, so dark modules pack as 0 bits.
+        scale = QR_PNG_SCALE
+        raw = bytearray()
+        for row in self.matrix:
+            line = b'\x00' + _pack_row(row, scale=scale, dark_bit=0)
+            raw += line * scale
+
+        header = struct.pack('>IIBBBBB', self.width * scale, self.height * scale, 1, 0, 0, 0, 0)
+        return (
+            b'\x89PNG\r\n\x1a\n'
+            + _png_chunk(b'IHDR', header)
+            + _png_chunk(b'IDAT', zlib.compress(bytes(raw), 9))
+            + _png_chunk(b'IEND', b'')
+        )
+
+    def _render_svg(self) -> bytes:
+        path = []
+        for y, row in enumerate(self.matrix):
+            x = 0
+            while x < self.width:
+                if not row[x]:
+                    x += 1
+                    continue
+                start = x
+                while x < self.width and row[x]:
+                    x += 1
+                path.append(f'M{start} {y}h{x - start}v1h-{x - start}z')
+
+        return (
+            f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {self.width} {self.height}" '
+            f'shape-rendering="crispEdges"><rect width="100%" height="100%" fill="#fff"/>'
+            f'<path d="{"".join(path)}" fill="#000"/></svg>'
+        ).encode()
+
+
+QR_FORMATS = {
+    'matrix': 'application/json',
+    'packed': 'application/json',
+    'png': 'image/png',
+    'svg': 'image/svg+xml',
+}
+
+
+@lru_cache(maxsize=QR_CACHE_SIZE)
+def get_qr_render(url: str) -> QRRender:
+    """Cached QR code for url; the least recently used entries are evicted first."""
+    return QRRender(url)
+
+
+def get_qr_cache_stats() -> dict:
+    info = get_qr_render.cache_info()
+    return {
+        'hits': info.hits,
+        'misses': info.misses,
+        'size': info.currsize,
+        'max_size': info.maxsize,
+    }
 
-    return matrix
 
 def get_qr_dimensions(url: str) -> dict:
-    matrix = generate_qr_matrix(url)
+    render = get_qr_render(url)
     return {
-        'width': len(matrix[0]) if matrix else 0,
-        'height': len(matrix) if matrix else 0,
-        'total_blocks': sum(sum(row) for row in matrix)
-    }
\ No newline at end of file
+        'width': render.width,
+        'height': render.height,
+        'total_blocks': sum(sum(row) for row in render.matrix)
+    }
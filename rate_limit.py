@@ -0,0 +1,227 @@
+import math
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+PERIODS = {
+    'second': 1,
+    'minute': 60,
+    'hour': 3600,
+    'day': 86400,
+}
+
+
+class RateLimitExceeded(Exception):
+    def __init__(self, limit: 'RateLimit', retry_after: float):
+        super().__init__(str(limit))
+        self.limit = limit
+        self.retry_after = retry_after
+
+
+class MemoryStore:
+    """In-process counter store: the stand-in for tests and single-worker setups."""
+
+    def __init__(self):
+        self._counters: Dict[str, Tuple[int, float]] = {}
+        self._lock = threading.Lock()
+        # Round-trips to the store, like RedisStore.operations.
+        self.operations = 0
+
+    def incr(self, key: str, amount: int, ttl: float) -> int:
+        now = time.monotonic()
+        with self._lock:
+            self.operations += 1
+            value, expires_at = self._counters.get(key, (0, 0.0))
+            if expires_at <= now:
+                value = 0
+            value += amount
+            self._counters[key] = (value, now + ttl)
+            if len(self._counters) > 100000:
+                self._counters = {k: v for k, v in self._counters.items() if v[1] > now}
+            return value
+
+    def get(self, key: str) -> int:
+        with self._lock:
+            self.operations += 1
+            value, expires_at = self._counters.get(key, (0, 0.0))
+            return value if expires_at > time.monotonic() else 0
+
+
+class RedisStore:
+    """Counters shared by every worker and host through Redis."""
+
+    def __init__(self, url: str):
+        import redis
+        self._redis = redis.Redis.from_url(url)
+        self.operations = 0
+
+    def incr(self, key: str, amount: int, ttl: float) -> int:
+        self.operations += 1
+        pipe = self._redis.pipeline()
+        pipe.incrby(key, amount)
+        pipe.expire(key, int(math.ceil(ttl)))
+        value, _ = pipe.execute()
+        return int(value)
+
+    def get(self, key: str) -> int:
+        self.operations += 1
+        value = self._redis.get(key)
+        return int(value) if value is not None else 0
+
+
+def store_from_uri(uri: str):
+    if uri.startswith('memory://'):
+        return MemoryStore()
+    if uri.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisStore(uri)
+    raise ValueError(f"Unsupported RATELIMIT_STORAGE_URI '{uri}'")
+
+
+class RateLimit:
+    def __init__(self, amount: int, period: str):
+        if period not in PERIODS:
+            raise ValueError(f"Unknown rate limit period '{period}'")
+        self.amount = amount
+        self.period = period
+        self.window = PERIODS[period]
+
+    @classmethod
+    def parse_many(cls, spec: str) -> List['RateLimit']:
+        """Parse '10/minute;200/day' (also accepts '10 per minute')."""
+        limits = []
+        for part in spec.replace(',', ';').split(';'):
+            part = part.strip()
+            if not part:
+                continue
+            amount, period = part.replace(' per ', '/').split('/')
+            limits.append(cls(int(amount), period.strip().rstrip('s')))
+        return limits
+
+    def __str__(self) -> str:
+        return f"{self.amount} per {self.period}"
+
+
+class _Lease:
+    __slots__ = ('window_id', 'tokens', 'blocked_until')
+
+    def __init__(self, window_id: int, tokens: int, blocked_until: float = 0.0):
+        self.window_id = window_id
+        self.tokens = tokens
+        self.blocked_until = blocked_until
+
+
+class SlidingWindowLimiter:
+    """Sliding-window limit shared through a store, with local token leases.
+
+    The window count is estimated from the current and previous fixed
+    windows, weighted by how far into the current one we are. Instead of one
+    store round-trip per request, a worker reserves ``lease_size`` tokens at
+    a time and spends them locally, so the store sees roughly
+    limit / lease_size operations per window per worker. Small limits get a
+    lease of 1 and stay exact.
+    """
+
+    def __init__(self, name: str, limit: RateLimit, store, lease_size: Optional[int] = None):
+        self.name = name
+        self.limit = limit
+        self.store = store
+        self.lease_size = lease_size or max(1, limit.amount // 50)
+        self._leases: Dict[str, _Lease] = {}
+        self._lock = threading.Lock()
+
+    def _keys(self, key: str, window_id: int) -> Tuple[str, str]:
+        prefix = f"rl:{self.name}:{self.limit.window}:{key}"
+        return f"{prefix}:{window_id}", f"{prefix}:{window_id - 1}"
+
+    def hit(self, key: str) -> int:
+        """Take one token for key; returns the window it came from, for refund()."""
+        now = time.time()
+        window = self.limit.window
+        window_id = int(now // window)
+
+        with self._lock:
+            lease = self._leases.get(key)
+            if lease is not None and lease.window_id == window_id:
+                if lease.tokens > 0:
+                    lease.tokens -= 1
+                    return window_id
+                if now < lease.blocked_until:
+                    raise RateLimitExceeded(self.limit, lease.blocked_until - now)
+
+        current_key, previous_key = self._keys(key, window_id)
+        reserved = self.store.incr(current_key, self.lease_size, ttl=window * 2)
+        previous = self.store.get(previous_key)
+        elapsed_fraction = (now - window_id * window) / window
+        used_before = previous * (1 - elapsed_fraction) + reserved - self.lease_size
+        granted = min(self.lease_size, int(self.limit.amount - used_before))
+
+        if granted < self.lease_size:
+            self.store.incr(current_key, -(self.lease_size - max(granted, 0)), ttl=window * 2)
+        with self._lock:
+            if granted <= 0:
+                # Rejections are answered locally for a short while too, so a
+                # client hammering past its limit doesn't hammer the store.
+                retry_after = window - (now - window_id * window)
+                blocked_until = now + min(retry_after, max(window / 50, 1))
+                self._leases[key] = _Lease(window_id, 0, blocked_until)
+            else:
+                self._leases[key] = _Lease(window_id, granted - 1)
+            if len(self._leases) > 10000:
+                self._leases = {k: v for k, v in self._leases.items() if v.window_id == window_id}
+
+        if granted <= 0:
+            raise RateLimitExceeded(self.limit, retry_after)
+        return window_id
+
+    def refund(self, key: str, window_id: int) -> None:
+        """Give back a token hit() took in window_id, if its lease is still current."""
+        with self._lock:
+            lease = self._leases.get(key)
+            if lease is not None and lease.window_id == window_id:
+                lease.tokens += 1
+
+
+class RateLimiter:
+    """Named groups of limits, e.g. 'shorten' -> [10/minute], checked together."""
+
+    def __init__(self, store):
+        self.store = store
+        self.enabled = True
+        self._groups: Dict[str, List[SlidingWindowLimiter]] = {}
+
+    def configure(self, name: str, spec: str) -> None:
+        self._groups[name] = [
+            SlidingWindowLimiter(f"{name}:{i}", limit, self.store)
+            for i, limit in enumerate(RateLimit.parse_many(spec))
+        ]
+
+    def check(self, name: str, key: str) -> None:
+        """Count one request for key against group name; raises RateLimitExceeded.
+
+        A rejected request costs nothing: tokens already taken from the
+        group's earlier limits are refunded.
+        """
+        if not self.enabled:
+            return
+        taken = []
+        try:
+            for limiter in self._groups.get(name, ()):
+                taken.append((limiter, limiter.hit(key)))
+        except RateLimitExceeded:
+            for limiter, window_id in taken:
+                limiter.refund(key, window_id)
+            raise
+
+    def stats(self) -> Dict:
+        return {
+            'store': type(self.store).__name__,
+            'store_operations': self.store.operations,
+            'groups': {name: [str(l.limit) for l in limiters] for name, limiters in self._groups.items()},
+        }
+
+
+rate_limiter = RateLimiter(store_from_uri(os.getenv('RATELIMIT_STORAGE_URI', 'memory://')))
+rate_limiter.configure('default', os.getenv('DEFAULT_RATE_LIMIT', '200/day;50/hour'))
+rate_limiter.configure('shorten', os.getenv('SHORTEN_RATE_LIMIT', '10/minute'))
+rate_limiter.configure('batch', os.getenv('BATCH_RATE_LIMIT', '5/minute'))
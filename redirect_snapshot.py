@@ -0,0 +1,477 @@
+import mmap
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import threading
+import time
+from array import array
+from contextlib import contextmanager
+from hashlib import blake2b
+from typing import Dict, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: no shared workers, builds just aren't coordinated.
+    fcntl = None
+
+from storage import host_cache_enabled, host_cache_path
+from url_cache import resolution_cache
+
+MAGIC = b'URLSNAP\x00'
+VERSION = 1
+# Average entries per hash bucket; lookups scan one bucket.
+BUCKET_LOAD = 4
+# Tombstones are kept this long; an older snapshot can't be checked
+# against deletes and isn't served.
+TOMBSTONE_RETENTION = 7 * 86400.0
+# Deletes this long before a build may still be in it (clock skew between
+# hosts and the database).
+TOMBSTONE_LOOKBACK = 60.0
+
+# magic, version, bucket_bits, count, built_at, entries_offset, records_offset, records_size
+_HEADER = struct.Struct('<8sIIQdQQQ')
+_BUCKET = struct.Struct('<Q')
+# 64-bit code hash and record offset, grouped by the hash's top bits.
+_ENTRY = struct.Struct('<QQ')
+# code length, URL length, expiry in Unix seconds (0: never), then code and URL.
+_RECORD = struct.Struct('<BII')
+
+
+def _code_hash(short_code: bytes) -> int:
+    return int.from_bytes(blake2b(short_code, digest_size=8).digest(), 'little')
+
+
+class Snapshot:
+    """A read-only short_code -> original_url table over a mapped snapshot file.
+
+    Layout: header, bucket directory (the first entry of each bucket, plus
+    an end marker), entries and packed records. A code hashes to one bucket
+    of about ``BUCKET_LOAD`` entries; a hash match is confirmed against the
+    code stored in the record, so a collision can never resolve to the
+    wrong URL.
+    """
+
+    def __init__(self, mm: mmap.mmap, inode: int):
+        magic, version, bucket_bits, count, built_at, entries_offset, records_offset, records_size = \
+            _HEADER.unpack_from(mm, 0)
+        if (magic, version) != (MAGIC, VERSION) or len(mm) != records_offset + records_size \
+                or entries_offset + count * _ENTRY.size != records_offset:
+            raise ValueError("not a redirect snapshot")
+
+        self.mm = mm
+        self.inode = inode
+        self.bucket_bits = bucket_bits
+        self.count = count
+        self.built_at = built_at
+        self.entries_offset = entries_offset
+        self.records_offset = records_offset
+
+    def get(self, short_code: str) -> Optional[str]:
+        """The URL for short_code, or None if the snapshot doesn't have it (or it expired)."""
+        code = short_code.encode('utf-8')
+        h = _code_hash(code)
+        bucket = h >> (64 - self.bucket_bits)
+
+        mm = self.mm
+        start, end = struct.unpack_from('<QQ', mm, _HEADER.size + bucket * _BUCKET.size)
+        offset = self.entries_offset + start * _ENTRY.size
+        for _ in range(end - start):
+            entry_hash, record = _ENTRY.unpack_from(mm, offset)
+            offset += _ENTRY.size
+            if entry_hash != h:
+                continue
+            record += self.records_offset
+            code_length, url_length, expires_at = _RECORD.unpack_from(mm, record)
+            record += _RECORD.size
+            if mm[record:record + code_length] != code:
+                continue
+            if expires_at and expires_at <= time.time():
+                return None
+            record += code_length
+            return mm[record:record + url_length].decode('utf-8')
+        return None
+
+    @property
+    def size(self) -> int:
+        return len(self.mm)
+
+
+def build_snapshot(path: str) -> int:
+    """Write a snapshot of every live, unlimited link to path; returns the link count.
+
+    Records are streamed to a scratch file while only the 16-byte entries
+    are kept in memory, then the file is assembled next to ``path`` and
+    renamed over it, so readers see either the old snapshot or the new one.
+    """
+    # Imported here so the file backend, which never builds one, runs without psycopg2.
+    from db import iter_redirects, shard_map
+
+    hashes = array('Q')
+    offsets = array('Q')
+    directory = os.path.dirname(os.path.abspath(path))
+    built_at = time.time()
+
+    with tempfile.TemporaryFile(dir=directory) as records:
+        records_size = 0
+        for database in range(shard_map.databases):
+            for short_code, original_url, expires_at in iter_redirects(database):
+                code = short_code.encode('utf-8')
+                url = original_url.encode('utf-8')
+                expires = int(expires_at.timestamp()) if expires_at is not None else 0
+                hashes.append(_code_hash(code))
+                offsets.append(records_size)
+                records.write(_RECORD.pack(len(code), len(url), expires))
+                records.write(code)
+                records.write(url)
+                records_size += _RECORD.size + len(code) + len(url)
+
+        count = len(hashes)
+        bucket_bits = max(count // BUCKET_LOAD, 1).bit_length() - 1
+        shift = 64 - bucket_bits
+        buckets = array('Q', bytes(_BUCKET.size * ((1 << bucket_bits) + 1)))
+        for h in hashes:
+            buckets[(h >> shift) + 1] += 1
+        for bucket in range(1, len(buckets)):
+            buckets[bucket] += buckets[bucket - 1]
+
+        # Counting sort by bucket; order within a bucket doesn't matter.
+        placed = array('Q', buckets[:-1])
+        entries = array('Q', bytes(_ENTRY.size * count))
+        for h, offset in zip(hashes, offsets):
+            slot = placed[h >> shift]
+            placed[h >> shift] = slot + 1
+            entries[2 * slot] = h
+            entries[2 * slot + 1] = offset
+        del hashes, offsets, placed
+
+        entries_offset = _HEADER.size + len(buckets) * _BUCKET.size
+        records_offset = entries_offset + count * _ENTRY.size
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(_HEADER.pack(MAGIC, VERSION, bucket_bits, count, built_at,
+                                 entries_offset, records_offset, records_size))
+            if sys.byteorder == 'big':
+                buckets.byteswap()
+                entries.byteswap()
+            buckets.tofile(f)
+            entries.tofile(f)
+            records.seek(0)
+            shutil.copyfileobj(records, f, 1 << 20)
+            f.flush()
+            os.fsync(f.fileno())
+
+    os.replace(tmp_path, path)
+    return count
+
+
+class RedirectSnapshots:
+    """Serves redirects from a snapshot file every worker on the host maps.
+
+    The file is immutable: one copy in the page cache is shared by all
+    workers, however many there are, and nothing has to warm up after a
+    restart. Rebuilds (``python migrate_data.py snapshot``, or a background
+    thread every ``rebuild_interval`` seconds in one process per host) write
+    a new file and rename it into place; each worker notices the new inode
+    within ``reload_interval`` seconds and switches over without a restart.
+
+    Links created after a build aren't in the snapshot and fall through to
+    the resolution cache and the database. Links deleted after a build are
+    tombstoned (see db.delete_url): the deleting process stops serving them
+    at once, the others within ``tombstone_interval`` seconds, when they are
+    also evicted from the resolution cache. One process per host queries
+    the tombstones and writes them to a file next to the snapshot, which
+    the rest reload when it changes. A snapshot isn't served until its
+    tombstones have been loaded.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        reload_interval: float = 1.0,
+        rebuild_interval: float = 3600.0,
+        tombstone_interval: float = 1.0,
+        enabled: bool = True,
+    ):
+        # None: the host default, settled when the snapshot is first opened.
+        self.path = path
+        self.reload_interval = reload_interval
+        self.rebuild_interval = rebuild_interval
+        self.tombstone_interval = tombstone_interval
+        self.enabled = enabled
+
+        self._snapshot: Optional[Snapshot] = None
+        self._checked_at = 0.0
+        # Codes deleted since the snapshot with this built_at was made, and
+        # the ones this process deleted itself (with when), which a poll
+        # racing with the delete could miss.
+        self._tombstones: frozenset = frozenset()
+        self._tombstones_for: Optional[float] = None
+        self._tombstones_loaded: Optional[tuple] = None
+        self._forgotten: Dict[str, float] = {}
+        self._build_checked_at = 0.0
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread_pid: Optional[int] = None
+
+        self._hits = 0
+        self._misses = 0
+        self._builds = 0
+        self._build_failures = 0
+        self._tombstone_failures = 0
+
+    def _reload(self) -> None:
+        """Map the snapshot file if it was replaced since it was last opened."""
+        try:
+            inode = os.stat(self.path).st_ino
+        except FileNotFoundError:
+            return
+        current = self._snapshot
+        if current is not None and current.inode == inode:
+            return
+
+        try:
+            with open(self.path, 'rb') as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                snapshot = Snapshot(mm, os.fstat(f.fileno()).st_ino)
+        except (ValueError, OSError, struct.error) as e:
+            print(f"Ignoring redirect snapshot {self.path}: {e}")
+            return
+        # The old map is unmapped once lookups still holding it finish.
+        self._snapshot = snapshot
+
+    def _setup(self) -> None:
+        if self.path is None:
+            self.path = host_cache_path('REDIRECT_SNAPSHOT', '.snapshot')
+
+    def start(self) -> None:
+        """Open the snapshot and, if enabled, start this process's rebuild thread."""
+        if not self.enabled:
+            return
+        pid = os.getpid()
+        if self._thread_pid == pid or self._stopping:
+            return
+
+        with self._lock:
+            if self._thread_pid == pid:
+                return
+            self._setup()
+            self._reload()
+            self._checked_at = time.monotonic()
+            self._thread_pid = pid
+            if self.rebuild_interval > 0 or self.tombstone_interval > 0:
+                threading.Thread(target=self._run, name='redirect-snapshot', daemon=True).start()
+
+    def get(self, short_code: str) -> Optional[str]:
+        """The snapshot's URL for short_code, or None to fall through to the database."""
+        if not self.enabled:
+            return None
+        self.start()
+
+        now = time.monotonic()
+        if now - self._checked_at >= self.reload_interval and self._lock.acquire(blocking=False):
+            try:
+                self._checked_at = now
+                self._reload()
+            finally:
+                self._lock.release()
+
+        snapshot = self._snapshot
+        if snapshot is None or snapshot.built_at != self._tombstones_for:
+            return None
+        if short_code in self._tombstones:
+            self._misses += 1
+            return None
+        url = snapshot.get(short_code)
+        if url is None:
+            self._misses += 1
+        else:
+            self._hits += 1
+        return url
+
+    def forget(self, short_code: str) -> None:
+        """Stop serving short_code from the snapshot in this process; it was deleted."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._forgotten[short_code] = time.time()
+            self._tombstones = self._tombstones | {short_code}
+
+    def _poll_tombstones(self) -> None:
+        """Load the codes deleted since the current snapshot was built."""
+        snapshot = self._snapshot
+        if snapshot is None:
+            return
+        since = snapshot.built_at - TOMBSTONE_LOOKBACK
+        if time.time() - since > TOMBSTONE_RETENTION:
+            self._tombstones_for = None
+            return
+
+        with self._host_lock('.tombstones.lock') as lock_file:
+            if lock_file is not None:
+                self._refresh_tombstone_file(snapshot, since, lock_file)
+        self._load_tombstone_file(snapshot, since)
+
+    def _read_tombstone_file(self) -> Tuple[Optional[float], frozenset]:
+        try:
+            with open(self.path + '.tombstones', 'r') as f:
+                built_at = float(f.readline())
+                return built_at, frozenset(f.read().split())
+        except (FileNotFoundError, ValueError):
+            return None, frozenset()
+
+    def _refresh_tombstone_file(self, snapshot: 'Snapshot', since: float, lock_file) -> None:
+        """Query the tombstones for the host if nobody has in the last interval.
+
+        The lock file's mtime records the last query. The tombstone file is
+        only replaced when its contents change, so the others don't reparse
+        an unchanged set.
+        """
+        built_at, codes = self._read_tombstone_file()
+        if built_at is not None and built_at > snapshot.built_at:
+            return  # Written for a newer snapshot, which this process reloads soon.
+        if built_at == snapshot.built_at and \
+                time.time() - os.fstat(lock_file.fileno()).st_mtime < self.tombstone_interval:
+            return
+
+        import db
+        deleted = set()
+        for database in range(db.shard_map.databases):
+            deleted.update(db.get_tombstones(database, since))
+        os.utime(lock_file.name)
+        if built_at == snapshot.built_at and codes == deleted:
+            return
+
+        path = self.path + '.tombstones'
+        with open(path + '.tmp', 'w') as f:
+            f.write(f'{snapshot.built_at!r}\n')
+            f.writelines(f'{code}\n' for code in sorted(deleted))
+        os.replace(path + '.tmp', path)
+
+    def _load_tombstone_file(self, snapshot: 'Snapshot', since: float) -> None:
+        try:
+            stat = os.stat(self.path + '.tombstones')
+        except FileNotFoundError:
+            return
+        key = (stat.st_ino, stat.st_mtime_ns, snapshot.built_at)
+        if key == self._tombstones_loaded:
+            return
+        built_at, deleted = self._read_tombstone_file()
+        self._tombstones_loaded = key
+        if built_at != snapshot.built_at:
+            return
+
+        with self._lock:
+            fresh = deleted - self._tombstones
+            self._forgotten = {code: at for code, at in self._forgotten.items() if at >= since}
+            self._tombstones = deleted.union(self._forgotten)
+            self._tombstones_for = snapshot.built_at
+        # Links deleted by other processes leave this one's cache too.
+        for short_code in fresh:
+            resolution_cache.invalidate(short_code)
+
+    @contextmanager
+    def _host_lock(self, suffix: str):
+        """Yield the lock file if this process holds it now, else None; one holder per host."""
+        with open(self.path + suffix, 'a+b') as lock_file:
+            if fcntl is None:
+                yield lock_file
+                return
+            try:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield None
+                return
+            try:
+                yield lock_file
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def rebuild(self) -> Optional[int]:
+        """Build a fresh snapshot and switch to it; None if another process is building."""
+        self._setup()
+        with self._host_lock('.lock') as lock_file:
+            if lock_file is None:
+                return None
+            started = time.time()
+            count = build_snapshot(self.path)
+            with self._lock:
+                self._reload()
+            self._builds += 1
+
+            import db
+            db.prune_tombstones(started - TOMBSTONE_RETENTION)
+            print(f"Redirect snapshot built: {count} links, "
+                  f"{os.path.getsize(self.path) // 1024} KiB, {time.time() - started:.1f}s")
+            return count
+
+    def _needs_rebuild(self) -> bool:
+        snapshot = self._snapshot
+        return snapshot is None or time.time() - snapshot.built_at >= self.rebuild_interval
+
+    def _run(self) -> None:
+        while not self._stopping:
+            now = time.monotonic()
+            if self.rebuild_interval > 0 and now - self._build_checked_at >= min(self.rebuild_interval, 60.0):
+                self._build_checked_at = now
+                try:
+                    with self._lock:
+                        self._reload()
+                    if self._needs_rebuild():
+                        self.rebuild()
+                except Exception as e:
+                    self._build_failures += 1
+                    print(f"Redirect snapshot build failed: {e}")
+
+            if self.tombstone_interval > 0:
+                try:
+                    with self._lock:
+                        self._reload()
+                    self._poll_tombstones()
+                except Exception as e:
+                    self._tombstone_failures += 1
+                    print(f"Redirect snapshot tombstone check failed: {e}")
+
+            intervals = (self.tombstone_interval, min(self.rebuild_interval, 60.0))
+            self._wakeup.wait(min(interval for interval in intervals if interval > 0))
+            self._wakeup.clear()
+
+    def stop(self) -> None:
+        self._stopping = True
+        self._wakeup.set()
+
+    def stats(self) -> Dict:
+        snapshot = self._snapshot
+        lookups = self._hits + self._misses
+        stats = {
+            'enabled': self.enabled,
+            'ready': snapshot is not None,
+            'path': self.path,
+            'hits': self._hits,
+            'misses': self._misses,
+            'hit_rate': round(self._hits / lookups, 4) if lookups else 0.0,
+            'builds': self._builds,
+            'build_failures': self._build_failures,
+            'tombstones': len(self._tombstones),
+            'tombstone_failures': self._tombstone_failures,
+        }
+        if snapshot is not None:
+            stats.update({
+                'serving': snapshot.built_at == self._tombstones_for,
+                'links': snapshot.count,
+                'bytes': snapshot.size,
+                'built_at': snapshot.built_at,
+                'age_seconds': round(time.time() - snapshot.built_at, 1),
+            })
+        return stats
+
+
+redirect_snapshot = RedirectSnapshots(
+    os.getenv('REDIRECT_SNAPSHOT_PATH') or None,
+    reload_interval=float(os.getenv('REDIRECT_SNAPSHOT_RELOAD_INTERVAL', '1')),
+    rebuild_interval=float(os.getenv('REDIRECT_SNAPSHOT_REBUILD_INTERVAL', '3600')),
+    tombstone_interval=float(os.getenv('REDIRECT_SNAPSHOT_TOMBSTONE_INTERVAL', '1')),
+    enabled=host_cache_enabled('REDIRECT_SNAPSHOT'),
+)
@@ -0,0 +1,159 @@
+import itertools
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+# Replay lag in seconds. 0 when the replica is streaming from the primary and
+# has replayed everything it received, so an idle primary doesn't make its
+# replicas look stale. A replica that isn't streaming (its WAL receiver lost
+# the primary) has nothing left to replay, so it is judged by the age of its
+# last replayed transaction instead, and drops out of rotation once that
+# exceeds the limit. NULL if it has replayed nothing yet. Seeing the receiver
+# status needs pg_read_all_stats; without it every replica is judged by age.
+REPLICA_LAG_SQL = '''
+    SELECT
+        pg_is_in_recovery() AS in_recovery,
+        CASE
+            WHEN NOT pg_is_in_recovery() THEN 0
+            WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn()
+                 AND EXISTS (SELECT 1 FROM pg_stat_wal_receiver WHERE status = 'streaming') THEN 0
+            ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+        END AS lag
+'''
+
+
+class _Replica:
+    __slots__ = ('dsn', 'healthy', 'lag', 'error', 'checked_at', 'failures')
+
+    def __init__(self, dsn: str):
+        self.dsn = dsn
+        self.healthy = False
+        self.lag: Optional[float] = None
+        self.error: Optional[str] = None
+        self.checked_at = 0.0
+        self.failures = 0
+
+
+class ReplicaSet:
+    """Read replicas of one database, kept in rotation only while healthy.
+
+    A background thread runs ``check_lag(dsn)`` against every replica each
+    ``check_interval`` seconds; a replica that errors or reports more than
+    ``max_lag`` seconds of replay lag is skipped until a later check passes.
+    Replicas start out of rotation, so reads go to the primary until the
+    first check has run. ``choose`` round-robins over the healthy ones.
+    """
+
+    def __init__(
+        self,
+        dsns: List[str],
+        check_lag: Callable[[str], float],
+        max_lag: float = 5.0,
+        check_interval: float = 2.0,
+    ):
+        self.dsns = dsns
+        self.check_lag = check_lag
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+
+        self._replicas = [_Replica(dsn) for dsn in dsns]
+        self._healthy: List[str] = []
+        self._next = itertools.count()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread_pid: Optional[int] = None
+
+    def __bool__(self) -> bool:
+        return bool(self._replicas)
+
+    def choose(self) -> Optional[str]:
+        """DSN of a replica to read from, or None to use the primary."""
+        if not self._replicas:
+            return None
+        self._ensure_thread()
+        healthy = self._healthy
+        if not healthy:
+            return None
+        return healthy[next(self._next) % len(healthy)]
+
+    def mark_failed(self, dsn: str, error: Exception) -> None:
+        """Take a replica out of rotation after a request-time failure."""
+        with self._lock:
+            for replica in self._replicas:
+                if replica.dsn == dsn:
+                    replica.healthy = False
+                    replica.error = str(error)
+                    replica.failures += 1
+            self._healthy = [r.dsn for r in self._replicas if r.healthy]
+        self._wakeup.set()
+
+    def check(self) -> None:
+        for replica in self._replicas:
+            try:
+                lag = self.check_lag(replica.dsn)
+            except Exception as e:
+                healthy, lag, error = False, None, str(e)
+            else:
+                healthy = lag <= self.max_lag
+                error = None if healthy else f"Replication lag {lag:.1f}s exceeds {self.max_lag}s"
+
+            with self._lock:
+                if replica.healthy and not healthy:
+                    replica.failures += 1
+                    print(f"Replica removed from rotation: {error}")
+                replica.healthy = healthy
+                replica.lag = lag
+                replica.error = error
+                replica.checked_at = time.time()
+                self._healthy = [r.dsn for r in self._replicas if r.healthy]
+
+    def _ensure_thread(self) -> None:
+        pid = os.getpid()
+        if self._thread_pid == pid or self._stopping:
+            return
+
+        with self._lock:
+            if self._thread_pid == pid:
+                return
+            for replica in self._replicas:
+                replica.healthy = False
+            self._healthy = []
+            self._thread_pid = pid
+            threading.Thread(target=self._run, name='replica-monitor', daemon=True).start()
+
+    def _run(self) -> None:
+        while not self._stopping:
+            self.check()
+            self._wakeup.wait(self.check_interval)
+            self._wakeup.clear()
+
+    def stop(self) -> None:
+        self._stopping = True
+        self._wakeup.set()
+
+    def stats(self) -> List[Dict]:
+        with self._lock:
+            return [
+                {
+                    'healthy': replica.healthy,
+                    'lag_seconds': round(replica.lag, 3) if replica.lag is not None else None,
+                    'error': replica.error,
+                    'failures': replica.failures,
+                    'checked_at': replica.checked_at,
+                }
+                for replica in self._replicas
+            ]
+
+
+def replica_urls_from_env(databases: int) -> List[List[str]]:
+    """DATABASE_REPLICA_URLS: comma-separated replicas, ';' between database shards."""
+    groups = [
+        [url.strip() for url in group.split(',') if url.strip()]
+        for group in os.getenv('DATABASE_REPLICA_URLS', '').split(';')
+    ]
+    if len(groups) > databases:
+        raise ValueError(f"DATABASE_REPLICA_URLS lists replicas for {len(groups)} databases, "
+                         f"but only {databases} are configured")
+    return groups + [[] for _ in range(databases - len(groups))]
@@ -0,0 +1,78 @@
+import os
+import zlib
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, TypeVar
+
+T = TypeVar('T')
+
+
+def shard_for(short_code: str, count: int) -> int:
+    """Stable shard number for a short code.
+
+    crc32 rather than hash() so every process and host agrees on the answer.
+    """
+    if count <= 1:
+        return 0
+    return zlib.crc32(short_code.encode('utf-8')) % count
+
+
+class ShardMap:
+    """Where urls rows live, derived from nothing but the short code.
+
+    ``database_urls`` lists one DSN per database shard; a code's row is on
+    ``database_urls[shard_for(code, len(database_urls))]``, so a lookup or
+    insert by code goes to exactly one database. Inside each database the
+    urls table can additionally be hash-partitioned on short_code into
+    ``partitions`` tables, which Postgres prunes to one partition for the
+    same queries. Both numbers are fixed for the life of a deployment:
+    changing them moves rows.
+
+    New deduplicated links are also placed by URL: their code is chosen so
+    that it maps to ``database_for_hash(url_hash)``, which makes the "does
+    this URL already have a link?" lookup a single-database query too.
+    """
+
+    def __init__(self, database_urls: List[str], partitions: int = 0):
+        if not database_urls:
+            raise ValueError("At least one database URL is required")
+        if partitions < 0:
+            raise ValueError("Partition count cannot be negative")
+        self.database_urls = database_urls
+        self.partitions = partitions
+
+    @property
+    def databases(self) -> int:
+        return len(self.database_urls)
+
+    @property
+    def sharded(self) -> bool:
+        """True when urls is split at all, so no index on it spans every row."""
+        return self.databases > 1 or self.partitions > 1
+
+    def database_for(self, short_code: str) -> int:
+        return shard_for(short_code, self.databases)
+
+    def database_for_hash(self, url_hash: bytes) -> int:
+        """The database that holds new links for a normalized URL digest."""
+        if self.databases <= 1:
+            return 0
+        return int.from_bytes(url_hash[:4], 'big') % self.databases
+
+    def group_by_database(self, items: Iterable[T], short_code_of=lambda item: item[0]) -> Dict[int, List[T]]:
+        groups: Dict[int, List[T]] = defaultdict(list)
+        for item in items:
+            groups[self.database_for(short_code_of(item))].append(item)
+        return groups
+
+    def describe(self) -> Dict:
+        return {
+            'databases': self.databases,
+            'partitions_per_database': self.partitions,
+            'sharded': self.sharded,
+        }
+
+
+def shard_map_from_env(default_url: Optional[str]) -> ShardMap:
+    """DATABASE_SHARD_URLS (comma-separated) overrides DATABASE_URL; URL_PARTITIONS sets partitions."""
+    urls = [url.strip() for url in os.getenv('DATABASE_SHARD_URLS', '').split(',') if url.strip()]
+    return ShardMap(urls or [default_url], int(os.getenv('URL_PARTITIONS', '0')))
@@ -14,9 +14,9 @@ class QRTetrisBuilder {
 
     async loadQRMatrix(shortCode) {
         try {
-            const response = await fetch(`/api/qr/${shortCode}`);
+            const response = await fetch(`/api/qr/${shortCode}?format=packed`);
             const data = await response.json();
-            this.qrMatrix = data.matrix;
+            this.qrMatrix = this.unpackMatrix(data.packed, data.width, data.height);
             
             this.canvas.width = data.width * this.blockSize;
             this.canvas.height = data.height * this.blockSize;
@@ -29,6 +29,22 @@ class QRTetrisBuilder {
         }
     }
 
+    unpackMatrix(packed, width, height) {
+        const bytes = atob(packed);
+        const rowBytes = Math.ceil(width / 8);
+        const matrix = [];
+
+        for (let y = 0; y < height; y++) {
+            const row = [];
+            for (let x = 0; x < width; x++) {
+                const byte = bytes.charCodeAt(y * rowBytes + (x >> 3));
+                row.push((byte >> (7 - (x & 7))) & 1);
+            }
+            matrix.push(row);
+        }
+        return matrix;
+    }
+
     prepareBlocks() {
         this.buildQueue = [];
         
@@ -0,0 +1,257 @@
+import asyncio
+import os
+import tempfile
+import threading
+import zlib
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+
+class StorageBackend:
+    """Where links live: the operations url_shortener and the background workers need.
+
+    Backends are interchangeable; pick one with STORAGE_BACKEND. Entries are
+    dicts with short_code, original_url, clicks and created_at (plus
+    url_hash, expires_at and clicks_left where relevant), as returned by db.py.
+    """
+
+    name = ''
+    # Independently purged databases (see link_expiry).
+    databases = 1
+
+    def init(self) -> None:
+        raise NotImplementedError
+
+    def ping(self) -> bool:
+        raise NotImplementedError
+
+    def allocate_id_block(self, size: int) -> int:
+        raise NotImplementedError
+
+    def code_fits(self, short_code: str, url_hash: bytes) -> bool:
+        """Whether a new link for url_hash may use short_code; any code by default."""
+        return True
+
+    def find_url_by_code(self, short_code: str) -> Optional[Dict]:
+        raise NotImplementedError
+
+    def find_urls_by_hashes(self, url_hashes: List[bytes]) -> List[Dict]:
+        raise NotImplementedError
+
+    def get_or_create_url_entry(self, short_code: str, original_url: str) -> Optional[Dict]:
+        raise NotImplementedError
+
+    def insert_url_entries(self, rows: List[tuple], expires_at=None, max_clicks: Optional[int] = None) -> List[Dict]:
+        raise NotImplementedError
+
+    def use_url_click(self, short_code: str) -> Optional[str]:
+        raise NotImplementedError
+
+    def increment_url_clicks_batch(self, counts: Dict[str, int]) -> int:
+        raise NotImplementedError
+
+    def upsert_click_rollups(self, counts: Dict[tuple, int]) -> None:
+        raise NotImplementedError
+
+    def get_click_analytics(self, short_code: str, granularity: str, since, until, top: int = 10) -> Dict:
+        raise NotImplementedError
+
+    def get_urls_page(self, limit: int = 50, after: Optional[tuple] = None) -> Tuple[List[Dict], Optional[tuple]]:
+        raise NotImplementedError
+
+    def search_urls(self, by: str, query: str, limit: int = 50,
+                    after: Optional[tuple] = None) -> Tuple[List[Dict], Optional[tuple]]:
+        raise NotImplementedError
+
+    def get_all_urls(self) -> List[Dict]:
+        raise NotImplementedError
+
+    def iter_urls(self, created_from=None, created_to=None, min_clicks: Optional[int] = None) -> Iterator[Dict]:
+        raise NotImplementedError
+
+    def get_stats(self) -> Dict:
+        raise NotImplementedError
+
+    def delete_expired_urls(self, database: int, expired_before, batch_size: int = 1000) -> List[str]:
+        raise NotImplementedError
+
+    def stats(self) -> Dict:
+        return {'backend': self.name}
+
+    def get_pool_stats(self) -> Dict:
+        """Connection pool counters, empty when the backend has no pool."""
+        return {}
+
+    def get_replica_stats(self) -> Dict:
+        return {}
+
+    # Async servers (asgi.py) resolve redirects through these. By default
+    # they run the blocking methods on a worker thread.
+
+    async def open_async(self) -> None:
+        """Set up async lookups; called once per ASGI worker at startup."""
+
+    async def close_async(self) -> None:
+        pass
+
+    async def find_url_by_code_async(self, short_code: str) -> Optional[Dict]:
+        return await asyncio.to_thread(self.find_url_by_code, short_code)
+
+    async def use_url_click_async(self, short_code: str) -> Optional[str]:
+        return await asyncio.to_thread(self.use_url_click, short_code)
+
+
+class PostgresBackend(StorageBackend):
+    """The db.py functions: pooled, sharded, replicated PostgreSQL."""
+
+    name = 'postgres'
+
+    def __init__(self):
+        import db
+        self._db = db
+        self._db_async = None
+        self.databases = db.shard_map.databases
+
+    def init(self) -> None:
+        self._db.init_db()
+
+    def ping(self) -> bool:
+        return self._db.ping()
+
+    def allocate_id_block(self, size: int) -> int:
+        return self._db.allocate_id_block(size)
+
+    def code_fits(self, short_code: str, url_hash: bytes) -> bool:
+        # Keeps each URL's links on one shard, so dedupe asks one database.
+        shard_map = self._db.shard_map
+        return shard_map.database_for(short_code) == shard_map.database_for_hash(url_hash)
+
+    def find_url_by_code(self, short_code: str) -> Optional[Dict]:
+        return self._db.find_url_by_code(short_code)
+
+    def find_urls_by_hashes(self, url_hashes: List[bytes]) -> List[Dict]:
+        return self._db.find_urls_by_hashes(url_hashes)
+
+    def get_or_create_url_entry(self, short_code: str, original_url: str) -> Optional[Dict]:
+        return self._db.get_or_create_url_entry(short_code, original_url)
+
+    def insert_url_entries(self, rows: List[tuple], expires_at=None, max_clicks: Optional[int] = None) -> List[Dict]:
+        return self._db.insert_url_entries(rows, expires_at, max_clicks)
+
+    def use_url_click(self, short_code: str) -> Optional[str]:
+        return self._db.use_url_click(short_code)
+
+    def increment_url_clicks_batch(self, counts: Dict[str, int]) -> int:
+        return self._db.increment_url_clicks_batch(counts)
+
+    def upsert_click_rollups(self, counts: Dict[tuple, int]) -> None:
+        self._db.upsert_click_rollups(counts)
+
+    def get_click_analytics(self, short_code: str, granularity: str, since, until, top: int = 10) -> Dict:
+        return self._db.get_click_analytics(short_code, granularity, since, until, top)
+
+    def get_urls_page(self, limit: int = 50, after: Optional[tuple] = None) -> Tuple[List[Dict], Optional[tuple]]:
+        return self._db.get_urls_page(limit, after)
+
+    def search_urls(self, by: str, query: str, limit: int = 50,
+                    after: Optional[tuple] = None) -> Tuple[List[Dict], Optional[tuple]]:
+        return self._db.search_urls(by, query, limit, after)
+
+    def get_all_urls(self) -> List[Dict]:
+        return self._db.get_all_urls()
+
+    def iter_urls(self, created_from=None, created_to=None, min_clicks: Optional[int] = None) -> Iterator[Dict]:
+        return self._db.iter_urls(created_from, created_to, min_clicks)
+
+    def get_stats(self) -> Dict:
+        return self._db.get_stats()
+
+    def delete_expired_urls(self, database: int, expired_before, batch_size: int = 1000) -> List[str]:
+        return self._db.delete_expired_urls(database, expired_before, batch_size)
+
+    def stats(self) -> Dict:
+        return {'backend': self.name, 'databases': self.databases, 'pool': self._db.get_pool_stats()}
+
+    def get_pool_stats(self) -> Dict:
+        return self._db.get_pool_stats()
+
+    def get_replica_stats(self) -> Dict:
+        return self._db.get_replica_stats()
+
+    async def open_async(self) -> None:
+        # asyncpg pools, so one worker can hold thousands of concurrent redirects.
+        import db_async
+        await db_async.init_pool()
+        self._db_async = db_async
+
+    async def close_async(self) -> None:
+        if self._db_async is not None:
+            await self._db_async.close_pool()
+
+    async def find_url_by_code_async(self, short_code: str) -> Optional[Dict]:
+        return await self._db_async.find_url_by_code(short_code)
+
+    async def use_url_click_async(self, short_code: str) -> Optional[str]:
+        return await self._db_async.use_url_click(short_code)
+
+
+def _file_backend() -> StorageBackend:
+    from file_handler import FileBackend
+    return FileBackend(
+        os.getenv('STORAGE_PATH', 'urls.log'),
+        fsync=os.getenv('STORAGE_FSYNC', 'interval'),
+        fsync_interval=float(os.getenv('STORAGE_FSYNC_INTERVAL', '1')),
+        compact_ratio=float(os.getenv('STORAGE_COMPACT_RATIO', '2')),
+        compact_min_records=int(os.getenv('STORAGE_COMPACT_MIN_RECORDS', '10000')),
+        refresh_interval=float(os.getenv('STORAGE_REFRESH_INTERVAL', '0.1')),
+    )
+
+
+BACKENDS: Dict[str, Callable[[], StorageBackend]] = {
+    'postgres': PostgresBackend,
+    'file': _file_backend,
+}
+
+_storage: Optional[StorageBackend] = None
+_storage_lock = threading.Lock()
+
+
+def host_cache_enabled(name: str) -> bool:
+    """Whether the host-wide cache ``name`` is on.
+
+    The short code filter (CODE_FILTER) and redirect snapshot
+    (REDIRECT_SNAPSHOT) are files every worker on a host maps to skip
+    PostgreSQL; ``<name>=0`` turns one off and ``<name>_PATH`` moves it.
+    Both are off with the file backend, which already answers from an
+    in-memory index, and when no database is configured.
+    """
+    if os.getenv(name, '1') == '0' or os.getenv('STORAGE_BACKEND', 'postgres') != 'postgres':
+        return False
+    return bool(os.getenv('DATABASE_SHARD_URLS') or os.getenv('DATABASE_URL'))
+
+
+def host_cache_path(name: str, suffix: str) -> str:
+    """Where the host-wide cache ``name`` lives.
+
+    Imports db, so it is called when the cache is first opened rather
+    than at import time.
+    """
+    path = os.getenv(f'{name}_PATH')
+    if path:
+        return path
+    from db import shard_map
+    # Keyed on the databases so two deployments on one host never share a file.
+    key = zlib.crc32(','.join(shard_map.database_urls).encode('utf-8'))
+    return os.path.join(tempfile.gettempdir(), f'url_shortener-{key:08x}{suffix}')
+
+
+def get_storage() -> StorageBackend:
+    """Return the backend selected by STORAGE_BACKEND (default: postgres)."""
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                name = os.getenv('STORAGE_BACKEND', 'postgres')
+                if name not in BACKENDS:
+                    raise ValueError(f"Unknown STORAGE_BACKEND '{name}'")
+                _storage = BACKENDS[name]()
+    return _storage
@@ -0,0 +1,77 @@
+import os
+import tempfile
+import unittest
+
+from file_handler import FileBackend
+from url_utils import url_digest
+
+
+class FileBackendTestCase(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'urls.log')
+
+    def open_backend(self, **kwargs):
+        backend = FileBackend(self.path, fsync='never', legacy_path=None, **kwargs)
+        self.addCleanup(backend.close)
+        return backend
+
+    def shorten(self, backend, short_code, url):
+        return backend.insert_url_entries([(short_code, url, url_digest(url))])
+
+
+class CrashRecoveryTest(FileBackendTestCase):
+    """A crash mid-append leaves a torn last line; the links before it survive."""
+
+    def test_torn_tail_is_cut_off(self):
+        backend = self.open_backend()
+        self.shorten(backend, 'abc123', 'https://example.com/a')
+        self.shorten(backend, 'def456', 'https://example.com/b')
+        backend.close()
+        torn = b'0badc0de {"op":"put","short_code":"ghi7'
+        with open(self.path, 'ab') as f:
+            f.write(torn)
+
+        recovered = self.open_backend()
+        self.assertEqual(recovered.find_url_by_code('abc123')['original_url'], 'https://example.com/a')
+        self.assertIsNone(recovered.find_url_by_code('ghi789'))
+
+        # The next append holds the lock exclusively and truncates the tail first.
+        self.shorten(recovered, 'jkl012', 'https://example.com/c')
+        self.assertEqual(recovered.stats()['recovered_bytes'], len(torn))
+        recovered.close()
+
+        reopened = self.open_backend()
+        self.assertEqual(reopened.get_stats()['total_urls'], 3)
+        self.assertEqual(reopened.find_url_by_code('jkl012')['original_url'], 'https://example.com/c')
+
+    def test_corrupt_record_is_not_applied(self):
+        backend = self.open_backend()
+        self.shorten(backend, 'abc123', 'https://example.com/a')
+        backend.close()
+        with open(self.path, 'r+b') as f:
+            data = f.read()
+            f.seek(0)
+            f.write(data.replace(b'example.com/a', b'example.com/z'))
+
+        self.assertIsNone(self.open_backend().find_url_by_code('abc123'))
+
+
+class CompactionTest(FileBackendTestCase):
+    def test_keeps_live_links_and_ids(self):
+        backend = self.open_backend(compact_min_records=1)
+        for i in range(5):
+            self.shorten(backend, f'code{i}', f'https://example.com/{i}')
+        start = backend.allocate_id_block(100)
+        backend.compact()
+        backend.close()
+
+        reopened = self.open_backend()
+        self.assertEqual([row['short_code'] for row in reopened.get_all_urls()],
+                         [f'code{i}' for i in reversed(range(5))])
+        self.assertEqual(reopened.allocate_id_block(10), start + 100)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import contextlib
+import io
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import migrate_data
+
+ENTRIES = [
+    {'short_code': 'aaa111', 'original_url': 'https://example.com/1'},
+    {'short_code': '', 'original_url': 'https://example.com/bad'},
+    {'short_code': 'bbb222', 'original_url': 'https://example.com/2'},
+    {'short_code': 'ccc333', 'original_url': 'https://example.com/3'},
+    {'original_url': 'https://example.com/no-code'},
+    {'short_code': 'ddd444', 'original_url': 'https://example.com/4'},
+    {'short_code': 'eee555', 'original_url': 'https://example.com/5'},
+]
+
+
+class ResumeTest(unittest.TestCase):
+    """A migration interrupted part way and rerun counts every entry once."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'urls.json')
+        with open(self.path, 'w') as f:
+            json.dump(ENTRIES, f)
+
+        self.table = {}
+        self.fail_after = None
+        fakes = {
+            'init_db': lambda: None,
+            'count_urls': lambda: len(self.table),
+            'copy_url_entries': self.copy_url_entries,
+        }
+        for name, fake in fakes.items():
+            patcher = mock.patch.object(migrate_data, name, fake)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def copy_url_entries(self, rows):
+        if self.fail_after is not None and len(self.table) >= self.fail_after:
+            raise ConnectionError('server closed the connection')
+        inserted = 0
+        for short_code, original_url, clicks, created_at in rows:
+            if short_code not in self.table:
+                self.table[short_code] = original_url
+                inserted += 1
+        return inserted
+
+    def migrate(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return migrate_data.migrate_from_json(self.path, chunk_size=2)
+
+    def test_resume_counts_each_entry_once(self):
+        self.fail_after = 2
+        self.assertIsNone(self.migrate())
+        self.assertTrue(os.path.exists(migrate_data._checkpoint_path(self.path)))
+
+        self.fail_after = None
+        result = self.migrate()
+
+        self.assertEqual(result['processed'], len(ENTRIES))
+        self.assertEqual(result['invalid'], 2)
+        self.assertEqual(result['migrated'], 5)
+        self.assertEqual(result['skipped'], 0)
+        self.assertEqual(len(self.table), 5)
+        self.assertFalse(os.path.exists(migrate_data._checkpoint_path(self.path)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import db
+from redirect_snapshot import RedirectSnapshots
+
+LINKS = [
+    ('abc123', 'https://example.com/a', None),
+    ('def456', 'https://example.com/b', None),
+]
+
+
+def eventually(check, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not check():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+class DeleteAfterSnapshotTest(unittest.TestCase):
+    """A link deleted after the snapshot was built must stop redirecting."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+
+        self.tombstones = []
+        fakes = {
+            'iter_redirects': lambda database: iter(LINKS),
+            'get_tombstones': lambda database, since: list(self.tombstones),
+            'prune_tombstones': lambda before: 0,
+        }
+        for name, fake in fakes.items():
+            patcher = mock.patch.object(db, name, fake)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.path = os.path.join(directory.name, 'redirects.snapshot')
+        self.assertEqual(RedirectSnapshots(self.path, rebuild_interval=0, tombstone_interval=0).rebuild(),
+                         len(LINKS))
+        self.snapshots = self.serving(tombstone_interval=0.01)
+
+    def serving(self, **kwargs):
+        snapshots = RedirectSnapshots(self.path, rebuild_interval=0, **kwargs)
+        self.addCleanup(snapshots.stop)
+        return snapshots
+
+    def test_not_served_before_tombstones_are_loaded(self):
+        self.assertIsNone(self.serving(tombstone_interval=0).get('abc123'))
+        self.assertTrue(eventually(lambda: self.snapshots.get('abc123') == 'https://example.com/a'))
+
+    def test_deleted_elsewhere(self):
+        self.assertTrue(eventually(lambda: self.snapshots.get('abc123') is not None))
+        self.tombstones.append('abc123')
+        self.assertTrue(eventually(lambda: self.snapshots.get('abc123') is None))
+        self.assertEqual(self.snapshots.get('def456'), 'https://example.com/b')
+
+    def test_deleted_here(self):
+        self.assertTrue(eventually(lambda: self.snapshots.get('abc123') is not None))
+        cursor = mock.MagicMock(rowcount=1)
+        with mock.patch.object(db, 'get_code_cursor') as get_code_cursor, \
+                mock.patch('redirect_snapshot.redirect_snapshot', self.snapshots):
+            get_code_cursor.return_value.__enter__.return_value = cursor
+            self.assertTrue(db.delete_url('abc123'))
+
+        self.assertIn('url_tombstones', cursor.execute.call_args_list[1][0][0])
+        self.assertIsNone(self.snapshots.get('abc123'))
+        # Polls that started before the tombstone committed don't bring it back.
+        time.sleep(0.1)
+        self.assertIsNone(self.snapshots.get('abc123'))
+
+    def test_one_query_per_host(self):
+        queries = []
+        with mock.patch.object(db, 'get_tombstones', lambda database, since: queries.append(database) or []):
+            workers = [self.serving(tombstone_interval=3600) for _ in range(4)]
+            self.assertTrue(eventually(lambda: all(worker.get('abc123') for worker in workers)))
+        self.assertEqual(queries, [0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import storage
+from code_filter import code_filter
+from file_handler import FileBackend
+from redirect_snapshot import redirect_snapshot
+from url_cache import resolution_cache
+from url_shortener import get_original_url, shorten_batch
+
+
+class FileBackendTestCase(unittest.TestCase):
+    """Runs url_shortener against a fresh file backend, with the host caches off."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'urls.log')
+        self.backend = FileBackend(self.path, fsync='never', legacy_path=None)
+        self.addCleanup(self.backend.close)
+
+        for target, name, value in (
+            (storage, '_storage', self.backend),
+            (code_filter, 'enabled', False),
+            (redirect_snapshot, 'enabled', False),
+        ):
+            patcher = mock.patch.object(target, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        resolution_cache.clear()
+
+
+class ShortenBatchTest(FileBackendTestCase):
+    def test_repeats_are_created_once(self):
+        results = list(shorten_batch(['example.com/a', 'example.com/b', 'https://EXAMPLE.com/a/']))
+
+        self.assertEqual([result['created'] for result in results], [True, True, False])
+        self.assertEqual(results[0]['short_code'], results[2]['short_code'])
+        self.assertNotEqual(results[0]['short_code'], results[1]['short_code'])
+        self.assertEqual(get_original_url(results[1]['short_code']), 'https://example.com/b')
+
+    def test_one_bad_url_fails_alone(self):
+        results = list(shorten_batch(['example.com/a', 'http://[abc.example', 'example.com/b', 'example.com/a']))
+
+        self.assertEqual([result['index'] for result in results], [0, 1, 2, 3])
+        self.assertEqual(results[1]['error'], 'Invalid URL format')
+        for result in (results[0], results[2], results[3]):
+            self.assertNotIn('error', result)
+        self.assertEqual([results[0]['created'], results[2]['created'], results[3]['created']], [True, True, False])
+
+    def test_chunks_share_dedupe(self):
+        results = list(shorten_batch(['example.com/a', 'example.com/b', 'example.com/a'], chunk_size=2))
+
+        self.assertEqual([result['created'] for result in results], [True, True, False])
+        self.assertEqual(results[0]['short_code'], results[2]['short_code'])
+
+
+if __name__ == '__main__':
+    unittest.main()
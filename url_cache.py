@@ -0,0 +1,140 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+MISSING = object()
+# Cached in place of a URL for click-limited links: the link exists, but
+# every redirect has to spend a click in the database.
+LIMITED = object()
+
+
+class ResolutionCache:
+    """Bounded LRU cache of short_code -> original_url with TTL expiry.
+
+    Unknown codes are cached as negative entries (``None``) with their own,
+    much shorter TTL so repeated 404s don't each cost a database query;
+    url_shortener skips them for codes the short code filter has seen since.
+    Entries for expiring links never outlive the link. Links deleted by
+    other processes are evicted by the redirect snapshot's tombstone poll.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: float = 300.0, negative_ttl: float = 2.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+
+        self._entries: "OrderedDict[str, Tuple[Optional[str], float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self._hits = 0
+        self._negative_hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._invalidations = 0
+
+    def get(self, short_code: str):
+        """Return the cached URL, ``None`` for a cached miss, or ``MISSING``."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(short_code)
+            if entry is None:
+                self._misses += 1
+                return MISSING
+
+            url, expires_at = entry
+            if expires_at <= now:
+                del self._entries[short_code]
+                self._misses += 1
+                return MISSING
+
+            self._entries.move_to_end(short_code)
+            if url is None:
+                self._negative_hits += 1
+            else:
+                self._hits += 1
+            return url
+
+    def set(self, short_code: str, url: Optional[str], expires_at: Optional[float] = None) -> None:
+        """Cache a resolution; ``expires_at`` (Unix time) caps the TTL."""
+        if self.max_size <= 0:
+            return
+        ttl = self.ttl if url is not None else self.negative_ttl
+        if expires_at is not None:
+            ttl = min(ttl, expires_at - time.time())
+        if ttl <= 0:
+            return
+
+        with self._lock:
+            self._entries[short_code] = (url, time.monotonic() + ttl)
+            self._entries.move_to_end(short_code)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def invalidate(self, short_code: str) -> None:
+        with self._lock:
+            if self._entries.pop(short_code, None) is not None:
+                self._invalidations += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self._hits + self._negative_hits + self._misses
+            hits = self._hits + self._negative_hits
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self._hits,
+                'negative_hits': self._negative_hits,
+                'misses': self._misses,
+                'hit_rate': round(hits / lookups, 4) if lookups else 0.0,
+                'evictions': self._evictions,
+                'invalidations': self._invalidations,
+            }
+
+
+class CachedValue:
+    """A single value recomputed by ``loader`` at most once per ``ttl`` seconds.
+
+    Only one thread reloads an expired value; the others keep serving the
+    previous one meanwhile, so an expiring entry never causes a stampede.
+    """
+
+    def __init__(self, loader: Callable[[], Any], ttl: float):
+        self.loader = loader
+        self.ttl = ttl
+        self._value: Any = MISSING
+        self._expires_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self) -> Any:
+        if self._value is not MISSING and time.monotonic() < self._expires_at:
+            return self._value
+
+        # Read once: only a thread with nothing to serve waits for the reload.
+        value = self._value
+        if not self._lock.acquire(blocking=value is MISSING):
+            return value
+
+        try:
+            if self._value is MISSING or time.monotonic() >= self._expires_at:
+                self._value = self.loader()
+                self._expires_at = time.monotonic() + self.ttl
+            return self._value
+        finally:
+            self._lock.release()
+
+    def invalidate(self) -> None:
+        self._expires_at = 0.0
+
+
+resolution_cache = ResolutionCache(
+    max_size=int(os.getenv('RESOLUTION_CACHE_SIZE', '10000')),
+    ttl=float(os.getenv('RESOLUTION_CACHE_TTL', '300')),
+    negative_ttl=float(os.getenv('RESOLUTION_CACHE_NEGATIVE_TTL', '2')),
+)
@@ -0,0 +1,75 @@
+import csv
+import io
+import json
+import zlib
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, Optional
+
+from constants import BASE_URL
+from storage import get_storage
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+EXPORT_FIELDS = ('short_code', 'short_url', 'original_url', 'clicks', 'created_at', 'expires_at', 'clicks_left')
+# Rows are encoded and handed on in chunks of about this many bytes.
+CHUNK_SIZE = 64 * 1024
+
+
+def _export_row(url: Dict) -> Dict:
+    row = {'short_code': url['short_code'], 'short_url': f"{BASE_URL}/{url['short_code']}"}
+    for field in EXPORT_FIELDS[2:]:
+        value = url.get(field)
+        row[field] = value.isoformat() if isinstance(value, datetime) else value
+    return row
+
+
+def _csv_lines(rows: Iterable[Dict]) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, EXPORT_FIELDS, lineterminator='\n')
+    writer.writeheader()
+    for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= CHUNK_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def _ndjson_lines(rows: Iterable[Dict]) -> Iterator[str]:
+    lines, size = [], 0
+    for row in rows:
+        line = json.dumps(row) + '\n'
+        lines.append(line)
+        size += len(line)
+        if size >= CHUNK_SIZE:
+            yield ''.join(lines)
+            lines, size = [], 0
+    yield ''.join(lines)
+
+
+def _gzip(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_urls(fmt: str = 'csv', created_from=None, created_to=None, min_clicks: Optional[int] = None,
+                compress: bool = False) -> Iterator[bytes]:
+    """Every matching link as CSV or NDJSON, in byte chunks, optionally gzipped.
+
+    Nothing is read until the first chunk is requested, and memory stays at
+    about one chunk plus the storage backend's read batch.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"format must be one of: {', '.join(EXPORT_FORMATS)}")
+
+    rows = (_export_row(url) for url in get_storage().iter_urls(created_from, created_to, min_clicks))
+    lines = _csv_lines(rows) if fmt == 'csv' else _ndjson_lines(rows)
+    chunks = (text.encode('utf-8') for text in lines if text)
+    return _gzip(chunks) if compress else chunks
@@ -1,35 +1,393 @@
-import random
-from datetime import datetime
-from typing import Dict, List
-from constants import BASE62_CHARS, SHORT_CODE_LENGTH
-from db import (
-    find_url_by_original,
-    find_url_by_code,
-    create_url_entry,
-    get_all_urls as db_get_all_urls
-)
+import base64
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from storage import get_storage
+from url_cache import resolution_cache, CachedValue, LIMITED, MISSING
+from code_filter import code_filter
+from redirect_snapshot import redirect_snapshot
+from url_utils import url_digest, validate_search, validate_url
+from code_generator import get_code_generator
+
+MAX_CODE_ATTEMPTS = 10
+BATCH_CHUNK_SIZE = 1000
+# Generated codes that landed on the wrong shard for the URL they were
+# drawn for, kept for later links instead of wasting their sequence IDs.
+MAX_SPARE_CODES = 1000
+# Draws per code before giving up on placing it with its URL's shard.
+MAX_FIT_DRAWS = 64
+
+_spare_codes: List[str] = []
+_spare_pid: Optional[int] = None
+_spare_lock = threading.Lock()
 
 def generate_short_code() -> str:
-    return ''.join(random.choices(BASE62_CHARS, k=SHORT_CODE_LENGTH))
+    return get_code_generator().next_code()
 
-def create_short_url(original_url: str) -> Dict:
-    existing = find_url_by_original(original_url)
-    if existing:
-        return existing
+def _take_spare(fits) -> Optional[str]:
+    global _spare_codes, _spare_pid
+    with _spare_lock:
+        if _spare_pid != os.getpid():
+            # Codes drawn before a fork would be handed out twice.
+            _spare_codes, _spare_pid = [], os.getpid()
+        for index, code in enumerate(_spare_codes):
+            if fits(code):
+                _spare_codes[index] = _spare_codes[-1]
+                _spare_codes.pop()
+                return code
+    return None
 
-    while True:
-        short_code = generate_short_code()
-        if not find_url_by_code(short_code):
+def _keep_spare(code: str) -> None:
+    with _spare_lock:
+        if _spare_pid == os.getpid() and len(_spare_codes) < MAX_SPARE_CODES:
+            _spare_codes.append(code)
+
+def _place_code(url_hash: Optional[bytes]) -> str:
+    """A new code, on the shard the storage backend places url_hash's links on.
+
+    Codes drawn for another shard are kept for later calls, so with N
+    shards this still uses about one sequence ID per link. After
+    MAX_FIT_DRAWS misses the last code is returned anyway; the link then
+    isn't deduplicated against ones on url_hash's shard.
+    """
+    storage = get_storage()
+    if url_hash is None:
+        fits = lambda code: True
+    else:
+        fits = lambda code: storage.code_fits(code, url_hash)
+
+    code = _take_spare(fits)
+    if code is not None:
+        return code
+    for attempt in range(MAX_FIT_DRAWS):
+        code = generate_short_code()
+        if fits(code) or attempt == MAX_FIT_DRAWS - 1:
+            return code
+        _keep_spare(code)
+
+def generate_free_short_code(url_hash: Optional[bytes] = None) -> str:
+    """A generated code the short code filter doesn't already know about.
+
+    With url_hash, the code is also one the storage backend places next to
+    any existing link for that URL (see StorageBackend.code_fits).
+    """
+    for _ in range(MAX_CODE_ATTEMPTS):
+        code = _place_code(url_hash)
+        if not code_filter.might_exist(code):
+            return code
+    return code
+
+def create_short_url(original_url: str, expires_at: Optional[datetime] = None,
+                     max_clicks: Optional[int] = None) -> Dict:
+    """Shorten original_url, reusing an existing link for the same URL.
+
+    A link with an expiry or click limit is always new, and is never reused
+    for later requests: it gets no url_hash.
+    """
+    if expires_at is not None or max_clicks is not None:
+        return _create_limited_urls([original_url], expires_at, max_clicks)[0]
+
+    url_hash = url_digest(original_url)
+    for _ in range(MAX_CODE_ATTEMPTS):
+        result = get_storage().get_or_create_url_entry(generate_free_short_code(url_hash), original_url)
+        if result:
+            code_filter.add(result['short_code'])
+            return result
+
+    raise RuntimeError("Could not allocate a unique short code")
+
+def _create_limited_urls(original_urls: List[str], expires_at: Optional[datetime],
+                         max_clicks: Optional[int]) -> List[Dict]:
+    pending = dict(enumerate(original_urls))
+    created: Dict[int, Dict] = {}
+    for _ in range(MAX_CODE_ATTEMPTS):
+        if not pending:
+            break
+
+        codes = {generate_free_short_code(): index for index in pending}
+        rows = [(code, pending[index], None) for code, index in codes.items()]
+        for row in get_storage().insert_url_entries(rows, expires_at, max_clicks):
+            code_filter.add(row['short_code'])
+            row['created'] = True
+            index = codes[row['short_code']]
+            created[index] = row
+            del pending[index]
+
+    if pending:
+        raise RuntimeError("Could not allocate unique short codes")
+
+    return [created[index] for index in range(len(original_urls))]
+
+def create_short_urls(original_urls: List[str], expires_at: Optional[datetime] = None,
+                      max_clicks: Optional[int] = None) -> List[Dict]:
+    """Bulk create_short_url for validated URLs, returned in input order.
+
+    Duplicates are collapsed by digest, so each distinct URL costs one lookup
+    and at most one insert row, and the whole list is handled in two
+    statements unless a generated code collides. Repeats of a URL share its
+    short code but only the first is marked created, so counting created
+    results counts inserted rows. Limited links skip the lookup and get one
+    new link per input.
+    """
+    if expires_at is not None or max_clicks is not None:
+        return _create_limited_urls(original_urls, expires_at, max_clicks)
+
+    hashes = [url_digest(url) for url in original_urls]
+    pending: Dict[bytes, str] = {}
+    for url_hash, url in zip(hashes, original_urls):
+        pending.setdefault(url_hash, url)
+
+    resolved: Dict[bytes, Dict] = {}
+    for _ in range(MAX_CODE_ATTEMPTS):
+        if not pending:
             break
 
-    return create_url_entry(short_code, original_url)
+        for row in get_storage().find_urls_by_hashes(list(pending)):
+            row['created'] = False
+            resolved[row['url_hash']] = row
+            pending.pop(row['url_hash'], None)
+
+        rows = [(generate_free_short_code(url_hash), url, url_hash) for url_hash, url in pending.items()]
+        for row in get_storage().insert_url_entries(rows):
+            code_filter.add(row['short_code'])
+            row['created'] = True
+            resolved[row['url_hash']] = row
+            pending.pop(row['url_hash'], None)
+
+    if pending:
+        raise RuntimeError("Could not allocate unique short codes")
+
+    results = []
+    seen = set()
+    for url_hash in hashes:
+        row = resolved[url_hash]
+        if url_hash in seen:
+            row = dict(row, created=False)
+        seen.add(url_hash)
+        results.append(row)
+    return results
+
+def shorten_batch(urls: Iterable[str], chunk_size: int = BATCH_CHUNK_SIZE,
+                  expires_at: Optional[datetime] = None, max_clicks: Optional[int] = None) -> Iterator[Dict]:
+    """Validate and shorten a stream of URLs, yielding one result per input.
+
+    Input is consumed chunk_size items at a time so arbitrarily long inputs
+    run in constant memory. Results carry the input index and either
+    short_code/created or error. expires_at and max_clicks apply to every
+    link in the batch.
+    """
+    iterator = iter(urls)
+    index = 0
+    while True:
+        chunk = list(islice(iterator, chunk_size))
+        if not chunk:
+            return
+
+        results = []
+        valid = []
+        for raw in chunk:
+            try:
+                url = validate_url(raw)
+            except ValueError as e:
+                results.append({'index': index, 'url': raw, 'error': str(e)})
+            else:
+                result = {'index': index, 'url': url}
+                results.append(result)
+                valid.append(result)
+            index += 1
+
+        try:
+            entries = create_short_urls([result['url'] for result in valid], expires_at, max_clicks)
+        except Exception as e:
+            print(f"Error in batch shorten: {e}")
+            for result in valid:
+                result['error'] = 'Failed to shorten URL'
+        else:
+            for result, entry in zip(valid, entries):
+                result['short_code'] = entry['short_code']
+                result['created'] = entry['created']
+
+        yield from results
+
+class BatchStats:
+    def __init__(self):
+        self.started = time.monotonic()
+        self.total = 0
+        self.created = 0
+        self.existing = 0
+        self.failed = 0
+
+    def add(self, result: Dict) -> None:
+        self.total += 1
+        if 'error' in result:
+            self.failed += 1
+        elif result['created']:
+            self.created += 1
+        else:
+            self.existing += 1
+
+    def to_dict(self) -> Dict:
+        elapsed = time.monotonic() - self.started
+        return {
+            'total': self.total,
+            'created': self.created,
+            'existing': self.existing,
+            'failed': self.failed,
+            'elapsed_seconds': round(elapsed, 3),
+            'urls_per_second': round(self.total / elapsed, 1) if elapsed > 0 else 0.0,
+        }
 
 
 def get_all_urls() -> List[Dict]:
-    return db_get_all_urls()
+    return get_storage().get_all_urls()
+
+stats_cache = CachedValue(lambda: get_storage().get_stats(), ttl=float(os.getenv('STATS_CACHE_TTL', '5')))
+
+def get_stats() -> Dict:
+    """Site-wide totals, served from memory for up to STATS_CACHE_TTL seconds."""
+    return dict(stats_cache.get())
+
+ANALYTICS_DEFAULT_RANGES = {
+    'hour': timedelta(hours=48),
+    'day': timedelta(days=30),
+}
+
+def get_link_analytics(short_code: str, granularity: str = 'day',
+                       since: Optional[str] = None, until: Optional[str] = None) -> Dict:
+    """Clicks per hour or day for one link, with top referrers and countries.
+
+    since/until are ISO-8601 UTC timestamps; by default the last 48 hours
+    (hourly) or 30 days (daily) are returned.
+    """
+    if granularity not in ANALYTICS_DEFAULT_RANGES:
+        raise ValueError("granularity must be 'hour' or 'day'")
+
+    try:
+        end = datetime.fromisoformat(until) if until else datetime.utcnow()
+        start = datetime.fromisoformat(since) if since else end - ANALYTICS_DEFAULT_RANGES[granularity]
+    except ValueError:
+        raise ValueError('since/until must be ISO-8601 timestamps')
+
+    analytics = get_storage().get_click_analytics(short_code, granularity, start, end)
+    fmt = '%Y-%m-%dT%H:00:00' if granularity == 'hour' else '%Y-%m-%d'
+    series = [
+        {'bucket': row['bucket_start'].strftime(fmt), 'clicks': row['clicks']}
+        for row in analytics['series']
+    ]
+    return {
+        'short_code': short_code,
+        'granularity': granularity,
+        'since': start.isoformat(),
+        'until': end.isoformat(),
+        'total_clicks': sum(row['clicks'] for row in series),
+        'series': series,
+        'referrers': analytics['referrers'],
+        'countries': analytics['countries'],
+    }
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+def encode_cursor(key: Tuple[datetime, int]) -> str:
+    raw = f"{key[0].isoformat()}|{key[1]}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        created_at, row_id = raw.rsplit('|', 1)
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError('Invalid cursor')
+
+def list_urls_page(cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE) -> Tuple[List[Dict], Optional[str]]:
+    """One page of URLs, newest first, plus the opaque cursor for the next page."""
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    after = decode_cursor(cursor) if cursor else None
+    urls, next_key = get_storage().get_urls_page(limit, after)
+    return urls, encode_cursor(next_key) if next_key else None
+
+def search_urls_page(query: str, by: str = 'url', cursor: Optional[str] = None,
+                     limit: int = DEFAULT_PAGE_SIZE) -> Tuple[List[Dict], Optional[str]]:
+    """One page of links matching a search, newest first, plus the next page's cursor."""
+    query = validate_search(query, by)
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    after = decode_cursor(cursor) if cursor else None
+    urls, next_key = get_storage().search_urls(by, query, limit, after)
+    return urls, encode_cursor(next_key) if next_key else None
+
+def resolve_locally(short_code: str):
+    """Resolve short_code without the database, or return MISSING.
+
+    LIMITED means the link exists but has a click limit; see spend_click.
+    """
+    cached = resolution_cache.get(short_code)
+    # A cached miss is stale once the code shows up in the filter: another
+    # worker (or host, after a sync) has created it since.
+    if cached is not MISSING and not (cached is None and code_filter.might_exist(short_code)):
+        return cached
+    # Not copied into the cache: the snapshot is already shared memory.
+    url = redirect_snapshot.get(short_code)
+    if url is not None:
+        return url
+    if code_filter.definitely_absent(short_code):
+        return None
+    return MISSING
+
+def remember_resolution(short_code: str, url_entry: Optional[Dict]):
+    """Record a database lookup result locally; returns the URL, None or LIMITED.
+
+    An expired link resolves like a missing one, and a cached link is
+    dropped from the cache when it expires.
+    """
+    if url_entry is None:
+        # Not cached when the filter knows the code: it may have just been
+        # created and not reached the replica or this process yet.
+        if not code_filter.might_exist(short_code):
+            resolution_cache.set(short_code, None)
+        return None
+
+    expires_at = url_entry.get('expires_at')
+    expires_at = expires_at.timestamp() if expires_at is not None else None
+    if expires_at is not None and expires_at <= time.time():
+        resolution_cache.set(short_code, None)
+        return None
+
+    resolved = LIMITED if url_entry.get('clicks_left') is not None else url_entry['original_url']
+    resolution_cache.set(short_code, resolved, expires_at)
+    return resolved
+
+def spend_click(short_code: str, original_url: Optional[str]) -> Optional[str]:
+    """Finish resolving a click-limited link given the result of use_url_click."""
+    if original_url is None:
+        resolution_cache.set(short_code, None)
+    return original_url
+
+def get_original_url(short_code: str) -> Optional[str]:
+    resolved = resolve_locally(short_code)
+    if resolved is MISSING:
+        resolved = remember_resolution(short_code, get_storage().find_url_by_code(short_code))
+    if resolved is LIMITED:
+        return spend_click(short_code, get_storage().use_url_click(short_code))
+    return resolved
+
+async def get_original_url_async(short_code: str) -> Optional[str]:
+    """get_original_url for async servers; the backend must have been opened with open_async()."""
+    resolved = resolve_locally(short_code)
+    if resolved is MISSING:
+        resolved = remember_resolution(short_code, await get_storage().find_url_by_code_async(short_code))
+    if resolved is LIMITED:
+        return spend_click(short_code, await get_storage().use_url_click_async(short_code))
+    return resolved
+
+def get_cache_stats() -> Dict:
+    return resolution_cache.stats()
+
+def get_code_filter_stats() -> Dict:
+    return code_filter.stats()
 
-def get_original_url(short_code: str) -> str:
-    url_entry = find_url_by_code(short_code)
-    if url_entry:
-        return url_entry['original_url']
-    return None
\ No newline at end of file
+def get_snapshot_stats() -> Dict:
+    return redirect_snapshot.stats()
\ No newline at end of file
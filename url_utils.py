@@ -0,0 +1,183 @@
+import hashlib
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Tuple
+from urllib.parse import urlsplit, urlunsplit
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+# Shorter substrings can't use the trigram index.
+MIN_URL_SEARCH_LENGTH = 3
+
+
+def normalize_url(url: str) -> str:
+    """Canonical form of a URL used for deduplication.
+
+    Lowercases the scheme and host, drops default ports, and treats a missing
+    path and a trailing slash as equivalent. Query and fragment are kept as-is.
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+
+    host = (parts.hostname or '').rstrip('.')
+    if ':' in host:
+        host = f'[{host}]'
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+    netloc = host
+    if port is not None and DEFAULT_PORTS.get(scheme) != port:
+        netloc = f'{host}:{port}'
+    if parts.username is not None:
+        userinfo = parts.username
+        if parts.password is not None:
+            userinfo += f':{parts.password}'
+        netloc = f'{userinfo}@{netloc}'
+
+    path = parts.path or '/'
+    if len(path) > 1 and path.endswith('/'):
+        path = path.rstrip('/') or '/'
+
+    return urlunsplit((scheme, netloc, path, parts.query, parts.fragment))
+
+
+def url_digest(url: str) -> bytes:
+    """SHA-256 of the normalized URL; the fixed-width dedupe key."""
+    return hashlib.sha256(normalize_url(url).encode('utf-8')).digest()
+
+
+def validate_url(url: str) -> str:
+    """Apply the /shorten input rules; returns the URL to store or raises ValueError."""
+    if url is not None and not isinstance(url, str):
+        raise ValueError('URL must be a string')
+
+    original_url = (url or '').strip()
+
+    if not original_url:
+        raise ValueError('URL is required')
+
+    if len(original_url) > 2048:
+        raise ValueError('URL is too long (max 2048 characters)')
+
+    if not original_url.startswith(('http://', 'https://')):
+        original_url = 'https://' + original_url
+
+    if not ('.' in original_url and len(original_url) > 10):
+        raise ValueError('Invalid URL format')
+
+    # Anything the dedupe key can't be computed for (e.g. 'http://[abc.example').
+    try:
+        normalize_url(original_url)
+    except ValueError:
+        raise ValueError('Invalid URL format')
+
+    return original_url
+
+
+def validate_link_limits(expires_at=None, expires_in=None, max_clicks=None) -> Tuple[Optional[datetime], Optional[int]]:
+    """Parse the optional expiry (ISO-8601 time or seconds from now) and click cap.
+
+    Naive timestamps are taken as UTC. Returns (expires_at, max_clicks) with
+    None for anything not set, or raises ValueError.
+    """
+    if expires_at is not None and expires_in is not None:
+        raise ValueError('Give expires_at or expires_in, not both')
+
+    if expires_at is not None:
+        try:
+            expires_at = datetime.fromisoformat(str(expires_at).replace('Z', '+00:00'))
+        except ValueError:
+            raise ValueError('expires_at must be an ISO-8601 timestamp')
+        if expires_at.tzinfo is None:
+            expires_at = expires_at.replace(tzinfo=timezone.utc)
+    elif expires_in is not None:
+        try:
+            expires_in = float(expires_in)
+        except (TypeError, ValueError):
+            raise ValueError('expires_in must be a number of seconds')
+        if not expires_in > 0:
+            raise ValueError('expires_in must be positive')
+        try:
+            expires_at = datetime.now(timezone.utc) + timedelta(seconds=expires_in)
+        except OverflowError:
+            raise ValueError('expires_in is too large')
+
+    if expires_at is not None and expires_at <= datetime.now(timezone.utc):
+        raise ValueError('expires_at must be in the future')
+
+    if max_clicks is not None:
+        if isinstance(max_clicks, bool) or not isinstance(max_clicks, (int, str)):
+            raise ValueError('max_clicks must be a positive integer')
+        try:
+            max_clicks = int(max_clicks)
+        except ValueError:
+            raise ValueError('max_clicks must be a positive integer')
+        if max_clicks < 1:
+            raise ValueError('max_clicks must be a positive integer')
+
+    return expires_at, max_clicks
+
+
+def validate_export_filters(created_from=None, created_to=None,
+                            min_clicks=None) -> Tuple[Optional[datetime], Optional[datetime], Optional[int]]:
+    """Parse the optional created_at range (ISO-8601) and minimum click count.
+
+    Naive timestamps are left naive, to be read in the same time zone as
+    created_at. Returns None for anything not set, or raises ValueError.
+    """
+    bounds = []
+    for name, value in (('created_from', created_from), ('created_to', created_to)):
+        if value is not None:
+            try:
+                value = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+            except ValueError:
+                raise ValueError(f'{name} must be an ISO-8601 timestamp')
+        bounds.append(value)
+    created_from, created_to = bounds
+
+    if created_from is not None and created_to is not None:
+        if (created_from.tzinfo is None) != (created_to.tzinfo is None):
+            raise ValueError('created_from and created_to must both have a time zone or neither')
+        if created_from >= created_to:
+            raise ValueError('created_from must be before created_to')
+
+    if min_clicks is not None:
+        try:
+            min_clicks = int(min_clicks)
+        except (TypeError, ValueError):
+            raise ValueError('min_clicks must be a non-negative integer')
+        if min_clicks < 0:
+            raise ValueError('min_clicks must be a non-negative integer')
+
+    return created_from, created_to, min_clicks
+
+
+def url_host(url: str) -> str:
+    """The lowercased host of a URL, '' if it has none."""
+    try:
+        return (urlsplit(url).hostname or '').rstrip('.')
+    except ValueError:
+        return ''
+
+
+def validate_search(query, by='url') -> str:
+    """Check a search query for a field (url, domain or code); returns the query to run.
+
+    Domain queries are reduced to a bare host, so 'https://Example.com/x'
+    and '*.example.com' both search example.com. Raises ValueError.
+    """
+    query = str(query or '').strip()
+    if by == 'url':
+        if len(query) < MIN_URL_SEARCH_LENGTH:
+            raise ValueError(f'URL searches need at least {MIN_URL_SEARCH_LENGTH} characters')
+    elif by == 'domain':
+        if '://' in query:
+            query = url_host(query)
+        query = query.split('/', 1)[0].lower().lstrip('*.').rstrip('.')
+        if not query:
+            raise ValueError('Enter a domain to search for')
+    elif by == 'code':
+        if not query:
+            raise ValueError('Enter the start of a short code')
+    else:
+        raise ValueError("Search by 'url', 'domain' or 'code'")
+    return query